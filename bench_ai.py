@@ -0,0 +1,94 @@
+"""
+Benchmark for the AI assistant keyword matcher.
+
+Compares the old per-intent `any(word in message ...)` chain with the compiled
+match_intent() over a mixed Burmese/English corpus and checks both pick the
+same intent for every message. Also times classify_intent() when
+intent_examples.json is present.
+
+Usage: python bench_ai.py [messages] [rounds]
+"""
+import os, random, sys, tempfile, time
+
+import main
+
+ENGLISH_WORDS = [
+    "hello", "hi", "please", "how", "much", "is", "the", "price", "for", "diamond",
+    "i", "want", "to", "topup", "my", "balance", "error", "when", "will", "order",
+    "arrive", "kpay", "wave", "thank", "you", "mlbb", "game", "bot", "time", "bro",
+    "can", "send", "weekly", "pass", "account", "ok", "yes", "no", "today", "minutes"
+]
+
+BURMESE_WORDS = [
+    "မင်္ဂလာပါ", "ဈေး", "နှုန်း", "ဘယ်လောက်လဲ", "ငွေဖြည့်", "ချင်ပါတယ်", "ကျေးဇူးတင်ပါတယ်",
+    "အော်ဒါ", "ဘယ်တော့", "ရမလဲ", "ပြဿနာ", "ရှိနေတယ်", "ဂိမ်း", "အချိန်", "မိနစ်",
+    "ငွေလွှဲ", "ပြီးပြီ", "လက်ကျန်", "စစ်ချင်တယ်", "ဘော့", "ကောင်းလား", "အကူအညီ", "ဝယ်မယ်"
+]
+
+def build_corpus(size, seed=42):
+    """Build a reproducible corpus of short mixed-language chat messages"""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        words = []
+        for _ in range(rng.randint(1, 12)):
+            pool = BURMESE_WORDS if rng.random() < 0.5 else ENGLISH_WORDS
+            words.append(rng.choice(pool))
+        if rng.random() < 0.2:
+            # Messages with no keyword at all fall through to the default reply
+            words = [rng.choice(["ok", "yes", "no", "bro", "😊", "👍", "?"])]
+        message = " ".join(words)
+        corpus.append(message.upper() if rng.random() < 0.1 else message)
+    return corpus
+
+def legacy_match(message_text, intents):
+    """The original ai_reply() if/elif chain"""
+    message_lower = message_text.lower()
+    for entry in intents:
+        if any(word in message_lower for word in entry["keywords"]):
+            return entry["intent"]
+    return None
+
+def run(label, func, corpus, rounds):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for message in corpus:
+            func(message)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    per_message = best / len(corpus) * 1e6
+    print(f"{label:<20} {best * 1000:8.2f} ms  {per_message:6.2f} µs/message")
+    return best
+
+def main_bench():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    # Building the templates loads prices; keep that off the bot's data.json
+    with tempfile.TemporaryDirectory() as workdir:
+        main.DATA_FILE = os.path.join(workdir, "data.json")
+        main.LEDGER_FILE = os.path.join(workdir, "ledger.jsonl")
+        bench(size, rounds)
+
+def bench(size, rounds):
+    intents = main.load_intents()
+    main.build_intent_matcher(intents)
+    corpus = build_corpus(size)
+
+    mismatches = [m for m in corpus if legacy_match(m, intents) != main.match_intent(m)]
+    if mismatches:
+        print(f"❌ {len(mismatches)} messages matched differently, e.g. {mismatches[0]!r}")
+        sys.exit(1)
+
+    print(f"Corpus: {size} messages, {rounds} rounds (best round shown)")
+    legacy = run("legacy", lambda m: legacy_match(m, intents), corpus, rounds)
+    compiled = run("compiled", main.match_intent, corpus, rounds)
+    print(f"Speedup: {legacy / compiled:.2f}x")
+
+    if main.train_intent_classifier():
+        backend = "numpy" if main.np is not None else "python"
+        run(f"classifier ({backend})", main.classify_intent, corpus, rounds)
+
+if __name__ == "__main__":
+    main_bench()
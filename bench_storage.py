@@ -0,0 +1,101 @@
+"""
+Micro-benchmarks for every data.json access pattern the handlers use.
+
+For each dataset size a file is generated with gen_data.py and each pattern
+is timed on its own: parsing and writing the whole file, the cached
+load_data() path, the per-user lookups done by the access gate, /balance and
+/history, and the price / authorized-user helpers.
+
+Usage: python bench_storage.py [--users 1000,10000,100000] [--seed 1]
+"""
+import argparse, os, random, statistics, tempfile, time
+
+import main
+import gen_data
+
+def measure(func, repeat):
+    """Median wall time of `func()` in microseconds"""
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - t0) * 1e6)
+    return statistics.median(samples)
+
+def run_sync(coro):
+    """Run a coroutine that never suspends without event loop overhead"""
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("coroutine suspended")
+
+def fmt(us):
+    return f"{us / 1000:10.2f} ms" if us >= 1000 else f"{us:10.2f} µs"
+
+def history_page(user_id):
+    """What history_command does: look the user up and render the first page"""
+    user_data = main.load_data()["users"].get(user_id, {})
+    return main.build_history_page(user_data, "orders")
+
+def balance_summary(user_id):
+    """The pending scan balance_command does before formatting"""
+    user_data = main.load_data()["users"].get(user_id, {})
+    pending = [t for t in user_data.get("topups", []) if t.get("status") == "pending"]
+    return user_data.get("balance", 0), len(pending), sum(t.get("amount", 0) for t in pending)
+
+def uncached_load():
+    main._data_cache["data"] = None
+    return main.load_data()
+
+def bench_dataset(users, seed, workdir):
+    path = os.path.join(workdir, f"data_{users}.json")
+    # Redirect main.py before anything loads data.json from the working directory
+    main.DATA_FILE = path
+    main.LEDGER_FILE = os.path.splitext(path)[0] + ".ledger.jsonl"
+    main._data_cache["data"] = None
+    main.price_engine["valid_until"] = 0
+    data = gen_data.generate_data(users, seed=seed)
+    gen_data.write_data(path, data)
+    main.load_authorized_users()
+
+    rng = random.Random(seed)
+    user_ids = list(data["users"])
+    sample = [rng.choice(user_ids) for _ in range(200)]
+    cycle = iter(sample * 1000)
+    heavy = max(user_ids, key=lambda u: len(data["users"][u]["orders"]))
+
+    # Whole-file operations get fewer repetitions on big datasets
+    file_repeat = 5 if users <= 10000 else 2
+    loaded = main.load_data()
+    results = [
+        ("load_data (parse)", measure(uncached_load, file_repeat)),
+        ("save_data (full rewrite)", measure(lambda: main.save_data(loaded), file_repeat)),
+        ("load_data (cached)", measure(main.load_data, 2000)),
+        ("load_authorized_users", measure(main.load_authorized_users, 200)),
+        ("load_prices / get_price", measure(lambda: main.get_price("86"), 2000)),
+        ("check_pending_topup", measure(lambda: run_sync(main.check_pending_topup(next(cycle))), 2000)),
+        ("get_access_context", measure(lambda: main.get_access_context(next(cycle)), 2000)),
+        ("balance summary", measure(lambda: balance_summary(next(cycle)), 2000)),
+        ("build_history_page", measure(lambda: history_page(next(cycle)), 2000)),
+        (f"build_history_page (heaviest user, {len(data['users'][heavy]['orders'])} orders)",
+         measure(lambda: history_page(heavy), 2000))
+    ]
+
+    size_mb = os.path.getsize(path) / 1024 / 1024
+    print(f"\n👥 {users:,} users ({size_mb:.1f} MB)")
+    for label, us in results:
+        print(f"   {label:<52} {fmt(us)}")
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", default="1000,10000", help="comma separated dataset sizes")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for users in (int(u) for u in args.users.split(",")):
+            bench_dataset(users, args.seed, workdir)
+
+if __name__ == "__main__":
+    main_bench()
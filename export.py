@@ -0,0 +1,64 @@
+"""
+Export orders or topups from data.json as CSV or JSONL.
+
+Rows are produced by the same generator pipeline the bot's /export command
+uses and written one at a time. When ijson is installed data.json is also
+read incrementally, one user at a time, so memory stays flat regardless of
+file size; without it the file is parsed with json.load first.
+
+Usage:
+    python export.py orders [--format csv|jsonl] [--from 2025-07-01] [--to 2025-07-31]
+                            [--status completed] [--user 123456789]
+                            [--data data.json] [--out orders.csv]
+"""
+import argparse, json, sys
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+import main
+
+def iter_users(path):
+    """Yield (user_id, user_data) pairs from a data.json file"""
+    if ijson is not None:
+        with open(path, "rb") as f:
+            yield from ijson.kvitems(f, "users", use_float=True)
+        return
+
+    with open(path, "r") as f:
+        yield from json.load(f).get("users", {}).items()
+
+def main_export():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=sorted(main.EXPORT_FIELDS))
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    parser.add_argument("--from", dest="date_from", help="first day, YYYY-MM-DD")
+    parser.add_argument("--to", dest="date_to", help="last day, YYYY-MM-DD")
+    parser.add_argument("--status")
+    parser.add_argument("--user")
+    parser.add_argument("--data", default=main.DATA_FILE)
+    parser.add_argument("--out", help="output file (default: stdout)")
+    args = parser.parse_args()
+
+    records = main.iter_export_records(
+        iter_users(args.data), args.kind,
+        date_from=args.date_from, date_to=args.date_to, status=args.status, user=args.user
+    )
+
+    out = open(args.out, "w", newline="", encoding="utf-8") if args.out else sys.stdout
+    try:
+        write_row = main.make_export_writer(out, args.kind, args.format)
+        count = 0
+        for record in records:
+            write_row(record)
+            count += 1
+    finally:
+        if args.out:
+            out.close()
+
+    print(f"✅ {count:,} {args.kind} rows exported", file=sys.stderr)
+
+if __name__ == "__main__":
+    main_export()
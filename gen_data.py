@@ -0,0 +1,121 @@
+"""
+Synthetic data.json generator.
+
+Produces a data.json in the bot's own format with a configurable number of
+users, order/topup history lengths and share of users with a pending topup.
+The same seed always produces the same file.
+
+Usage:
+    python gen_data.py [--users 10000] [--orders 8] [--topups 3]
+                       [--pending 0.05] [--history exponential|uniform]
+                       [--seed 1] [--out data.json]
+"""
+import argparse, json, random
+from datetime import datetime, timedelta
+
+import main
+
+FIRST_NAMES = ["Aung", "Kyaw", "Zaw", "Thiri", "Su", "Hnin", "Min", "Htet", "Nay", "Ei",
+               "မောင်", "အောင်", "သီရိ", "နှင်း", "ဇော်", "Alex", "Mg", "Ma", "Ko", "Lin"]
+LAST_NAMES = ["Htun", "Oo", "Naing", "Win", "Aye", "Myint", "Lwin", "Soe", "Thu", "Zin",
+              "ထွန်း", "ဦး", "နိုင်", "", ""]
+
+# Popular packages are ordered far more often than the big ones
+ORDER_AMOUNTS = ["wp1", "11", "22", "56", "86", "172", "257", "wp2", "343", "514", "706", "1412", "2195", "5532"]
+ORDER_WEIGHTS = [30, 12, 10, 9, 14, 8, 6, 4, 3, 2, 1.5, 1, 0.5, 0.2]
+TOPUP_AMOUNTS = [3000, 5000, 10000, 20000, 30000, 50000, 100000]
+TOPUP_WEIGHTS = [10, 25, 25, 15, 10, 10, 5]
+
+def history_length(rng, mean, distribution):
+    """Draw a history length: exponential gives a long tail of heavy users"""
+    if mean <= 0:
+        return 0
+    if distribution == "uniform":
+        return rng.randint(0, int(2 * mean))
+    return int(rng.expovariate(1 / mean))
+
+def random_timestamps(rng, count, start, end):
+    span = (end - start).total_seconds()
+    return sorted(start + timedelta(seconds=rng.random() * span) for _ in range(count))
+
+def generate_data(users=10000, orders_mean=8, topups_mean=3, pending_ratio=0.05,
+                  distribution="exponential", days=180, seed=1):
+    """Build a data.json dict with `users` authorized users"""
+    rng = random.Random(seed)
+    end = datetime(2025, 7, 1)
+    start = end - timedelta(days=days)
+    recent = end - timedelta(hours=1)
+
+    data = {"users": {}, "prices": {}, "authorized_users": []}
+    for i in range(users):
+        user_id = str(rng.randint(1000000000, 7999999999))
+        while user_id in data["users"]:
+            user_id = str(rng.randint(1000000000, 7999999999))
+
+        orders = []
+        for ts in random_timestamps(rng, history_length(rng, orders_mean, distribution), start, end):
+            amount = rng.choices(ORDER_AMOUNTS, ORDER_WEIGHTS)[0]
+            orders.append({
+                "order_id": f"ORD{ts.strftime('%Y%m%d%H%M%S')}",
+                "game_id": str(rng.randint(100000000, 999999999)),
+                "server_id": str(rng.randint(1000, 19999)),
+                "amount": amount,
+                # Generated files have no custom prices, so the base table applies
+                "price": main.BASE_PRICES[amount],
+                # Only the last hour's orders are still being delivered
+                "status": "processing" if ts > recent else "completed",
+                "timestamp": ts.isoformat()
+            })
+
+        topups = []
+        for ts in random_timestamps(rng, history_length(rng, topups_mean, distribution), start, end):
+            topups.append({
+                "amount": rng.choices(TOPUP_AMOUNTS, TOPUP_WEIGHTS)[0],
+                "status": "approved",
+                "timestamp": ts.isoformat(),
+                "approved_at": (ts + timedelta(minutes=rng.randint(1, 600))).isoformat()
+            })
+        if rng.random() < pending_ratio:
+            topups.append({
+                "amount": rng.choices(TOPUP_AMOUNTS, TOPUP_WEIGHTS)[0],
+                "status": "pending",
+                "timestamp": (end - timedelta(minutes=rng.randint(1, 1440))).isoformat()
+            })
+
+        data["users"][user_id] = {
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}".strip(),
+            "username": f"user{i}" if rng.random() < 0.7 else "-",
+            "balance": rng.choice([0, 0, rng.randint(0, 20) * 500, rng.randint(0, 400) * 500]),
+            "orders": orders,
+            "topups": topups
+        }
+        data["authorized_users"].append(user_id)
+
+    return data
+
+def write_data(path, data):
+    """Write generated data exactly the way save_data() does"""
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+def main_gen():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--orders", type=float, default=8, help="mean orders per user")
+    parser.add_argument("--topups", type=float, default=3, help="mean approved topups per user")
+    parser.add_argument("--pending", type=float, default=0.05, help="share of users with a pending topup")
+    parser.add_argument("--history", choices=["exponential", "uniform"], default="exponential")
+    parser.add_argument("--days", type=int, default=180, help="history time span")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="data.json")
+    args = parser.parse_args()
+
+    data = generate_data(args.users, args.orders, args.topups, args.pending, args.history, args.days, args.seed)
+    write_data(args.out, data)
+
+    orders = sum(len(u["orders"]) for u in data["users"].values())
+    topups = sum(len(u["topups"]) for u in data["users"].values())
+    print(f"✅ {args.out}: {args.users:,} users, {orders:,} orders, {topups:,} topups")
+
+if __name__ == "__main__":
+    main_gen()
@@ -0,0 +1,323 @@
+"""
+Load test for the bot handlers against a local fake Telegram Bot API.
+
+Builds a synthetic data.json per dataset size (see gen_data.py), then drives /start, /mmb, /topup,
+screenshot photos, /approve and /balance through the real Application
+(access gate included) with a seeded command mix. Bot API calls are answered
+in-process, so the numbers measure the bot itself: throughput, p50/p99
+latency per update and data.json I/O per update.
+
+Usage:
+    python loadtest.py [--users 1000,10000,100000] [--updates 2000] [--seed 1]
+                       [--save results.json] [--compare results.json]
+
+With --compare the run exits with status 1 when throughput or p99 latency
+is worse than the saved run by more than --tolerance (default 20%). It also
+exits with status 1 if a handler raises or an edited /approve or /mmb
+message changes a balance.
+"""
+import argparse, asyncio, json, os, random, statistics, sys, tempfile, time
+from collections import Counter
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+import main
+import gen_data
+
+ADMIN_USER_ID = 1
+BOT_USER = {"id": 42, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+# Share of sessions per scenario; a topup session is /topup + photo + /approve
+# and a start session is /start from a known user and from a new visitor
+COMMAND_MIX = [
+    ("mmb", 0.45),
+    ("balance", 0.25),
+    ("topup", 0.25),
+    ("start", 0.05)
+]
+
+MMB_AMOUNTS = ["11", "22", "56", "86", "172", "257", "wp1", "wp2", "514", "1412"]
+
+class FakeBotAPI(BaseRequest):
+    """Answers Bot API requests in-process and counts them per method"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.message_id = 0
+
+    @property
+    def read_timeout(self):
+        return 1.0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+
+        if endpoint == "getMe":
+            result = BOT_USER
+        elif endpoint in ("sendMessage", "forwardMessage", "editMessageText", "sendDocument", "sendPhoto"):
+            params = request_data.parameters if request_data else {}
+            self.message_id += 1
+            result = {
+                "message_id": self.message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "text": str(params.get("text", ""))
+            }
+        else:
+            result = True
+
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+def make_dataset(path, users, seed):
+    """Write a synthetic data.json and return its authorized user ids"""
+    data = gen_data.generate_data(users, seed=seed)
+    gen_data.write_data(path, data)
+    return [int(user_id) for user_id in data["authorized_users"]]
+
+class UpdateFactory:
+    """Builds Bot API update payloads with increasing update/message ids"""
+
+    def __init__(self):
+        self.update_id = 0
+        self.message_id = 0
+
+    def _message(self, user_id, **fields):
+        self.update_id += 1
+        self.message_id += 1
+        message = {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        }
+        message.update(fields)
+        return {"update_id": self.update_id, "message": message}
+
+    def command(self, user_id, text):
+        command = text.split()[0]
+        return self._message(user_id, text=text, entities=[{"type": "bot_command", "offset": 0, "length": len(command)}])
+
+    def edited(self, payload):
+        """The same message as `payload`, delivered again as an edit"""
+        self.update_id += 1
+        message = dict(payload["message"], edit_date=payload["message"]["date"] + 1)
+        return {"update_id": self.update_id, "edited_message": message}
+
+    def photo(self, user_id):
+        file_id = f"photo{self.message_id}"
+        return self._message(user_id, photo=[
+            {"file_id": f"{file_id}s", "file_unique_id": f"{file_id}s", "width": 90, "height": 160, "file_size": 2000},
+            {"file_id": file_id, "file_unique_id": file_id, "width": 720, "height": 1280, "file_size": 90000}
+        ])
+
+def build_workload(user_ids, sessions, rng):
+    """Turn the command mix into a list of (kind, update payload)"""
+    factory = UpdateFactory()
+    kinds = [kind for kind, _ in COMMAND_MIX]
+    weights = [weight for _, weight in COMMAND_MIX]
+    workload = []
+    for _ in range(sessions):
+        user_id = rng.choice(user_ids)
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "mmb":
+            game_id = rng.randint(100000000, 999999999)
+            server_id = rng.randint(1000, 9999)
+            text = f"/mmb {game_id} {server_id} {rng.choice(MMB_AMOUNTS)}"
+            workload.append(("mmb", factory.command(user_id, text)))
+        elif kind == "balance":
+            workload.append(("balance", factory.command(user_id, "/balance")))
+        elif kind == "start":
+            # Authorized users get the welcome, unknown ones the unauthorized reply
+            workload.append(("start", factory.command(user_id, "/start")))
+            workload.append(("start", factory.command(rng.randint(10 ** 10, 2 * 10 ** 10), "/start")))
+        else:
+            amount = rng.choice([5000, 10000, 20000, 50000])
+            workload.append(("topup", factory.command(user_id, f"/topup {amount}")))
+            workload.append(("photo", factory.photo(user_id)))
+            workload.append(("approve", factory.command(ADMIN_USER_ID, f"/approve {user_id} {amount}")))
+    return workload
+
+async def check_edited_commands(application, user_ids):
+    """Edit messages into /approve and /mmb; return how many changed a balance
+
+    Editing a message re-delivers it as edited_message, which must neither
+    run a command nor get past the access gate's checks on the original.
+    """
+    factory = UpdateFactory()
+    factory.update_id = factory.message_id = 10 ** 6
+    user_id = user_ids[0]
+    cases = [
+        # A plain user crediting themselves, and the admin re-running a credit
+        factory.command(user_id, f"/approve {user_id} 999999"),
+        factory.command(ADMIN_USER_ID, f"/approve {user_id} 999999"),
+        factory.command(user_id, "/mmb 123456789 1234 86")
+    ]
+
+    leaks = 0
+    for payload in cases:
+        before = main.load_data()["users"][str(user_id)]["balance"]
+        await application.process_update(Update.de_json(factory.edited(payload), application.bot))
+        if main.load_data()["users"][str(user_id)]["balance"] != before:
+            leaks += 1
+    return leaks
+
+def percentile(values, pct):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1]
+
+def reset_bot_state(data_file, flood):
+    """Point main.py at the dataset and clear all in-memory state"""
+    main.DATA_FILE = data_file
+    main.LEDGER_FILE = os.path.splitext(data_file)[0] + ".ledger.jsonl"
+    main.ledger_stats["seq"] = 0
+    main.ADMIN_ID = ADMIN_USER_ID
+    main._data_cache["data"] = None
+    main._data_cache["stamp"] = None
+    main.price_engine["valid_until"] = 0
+    main.user_states.clear()
+    main.pending_topups.clear()
+    main.flood_state.clear()
+    for stats in (main.storage_stats, main.gate_stats):
+        for key in stats:
+            stats[key] = 0
+    if not flood:
+        main.FLOOD_RATE = 1e9
+
+async def run_dataset(users, updates, seed, flood, workdir):
+    rng = random.Random(seed)
+    data_file = os.path.join(workdir, f"data_{users}.json")
+
+    # Redirect main.py first so nothing it loads lands in the working directory
+    reset_bot_state(data_file, flood)
+    print(f"\n👥 {users:,} users: generating dataset...", flush=True)
+    user_ids = make_dataset(data_file, users, seed)
+    dataset_mb = os.path.getsize(data_file) / 1024 / 1024
+
+    fake_api = FakeBotAPI()
+    application = (
+        Application.builder()
+        .token("0:loadtest")
+        .request(fake_api)
+        .get_updates_request(FakeBotAPI())
+        .build()
+    )
+    errors = []
+
+    async def on_error(update, context):
+        errors.append(repr(context.error))
+
+    application.add_error_handler(on_error)
+    main.setup_application(application)
+    await application.initialize()
+
+    # Sessions average ~1.5 updates; trim to the requested update count
+    workload = build_workload(user_ids, updates, rng)[:updates]
+    # The first load parses the generated file; count I/O from the run only
+    main.load_data()
+    for key in main.storage_stats:
+        main.storage_stats[key] = 0
+    fake_api.calls.clear()
+
+    latencies = {}
+    started = time.perf_counter()
+    for kind, payload in workload:
+        update = Update.de_json(payload, application.bot)
+        t0 = time.perf_counter()
+        await application.process_update(update)
+        latencies.setdefault(kind, []).append((time.perf_counter() - t0) * 1000)
+    elapsed = time.perf_counter() - started
+    edited_leaks = await check_edited_commands(application, user_ids)
+    await application.shutdown()
+
+    all_latencies = [ms for values in latencies.values() for ms in values]
+    count = len(all_latencies)
+    result = {
+        "users": users,
+        "updates": count,
+        "dataset_mb": round(dataset_mb, 2),
+        "throughput": count / elapsed,
+        "p50_ms": percentile(all_latencies, 50),
+        "p99_ms": percentile(all_latencies, 99),
+        "reads_per_update": main.storage_stats["reads"] / count,
+        "writes_per_update": main.storage_stats["writes"] / count,
+        "kb_written_per_update": main.storage_stats["bytes_written"] / 1024 / count,
+        "api_calls_per_update": sum(fake_api.calls.values()) / count,
+        "errors": len(errors),
+        "edited_command_leaks": edited_leaks,
+        "by_kind": {
+            kind: {"count": len(values), "p50_ms": percentile(values, 50), "p99_ms": percentile(values, 99)}
+            for kind, values in sorted(latencies.items())
+        }
+    }
+    print_result(result)
+    if errors:
+        print(f"   ⚠️ first handler error: {errors[0]}")
+    return result
+
+def print_result(result):
+    print(f"   dataset {result['dataset_mb']} MB, {result['updates']} updates, {result['errors']} errors")
+    if result["edited_command_leaks"]:
+        print(f"   ❌ {result['edited_command_leaks']} edited command(s) changed a balance")
+    print(f"   throughput {result['throughput']:.1f} updates/s | p50 {result['p50_ms']:.2f} ms | p99 {result['p99_ms']:.2f} ms")
+    print(f"   per update: {result['reads_per_update']:.3f} reads, {result['writes_per_update']:.3f} writes, "
+          f"{result['kb_written_per_update']:.1f} KB written, {result['api_calls_per_update']:.2f} Bot API calls")
+    for kind, stats in result["by_kind"].items():
+        print(f"   {kind:<8} n={stats['count']:<6} p50 {stats['p50_ms']:.2f} ms  p99 {stats['p99_ms']:.2f} ms")
+
+def compare(results, baseline_file, tolerance):
+    """Print deltas against a saved run; return False on a regression"""
+    with open(baseline_file, "r") as f:
+        baseline = json.load(f)
+
+    ok = True
+    print(f"\n📊 Compared with {baseline_file} (tolerance {tolerance:.0%})")
+    for users, result in results.items():
+        old = baseline.get(users)
+        if not old:
+            print(f"   {users} users: no baseline")
+            continue
+        throughput_delta = result["throughput"] / old["throughput"] - 1
+        p99_delta = result["p99_ms"] / old["p99_ms"] - 1 if old["p99_ms"] else 0.0
+        regressed = throughput_delta < -tolerance or p99_delta > tolerance
+        ok = ok and not regressed
+        print(f"   {'❌' if regressed else '✅'} {users} users: throughput {throughput_delta:+.1%}, p99 {p99_delta:+.1%}")
+    return ok
+
+def main_loadtest():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", default="1000", help="comma separated dataset sizes")
+    parser.add_argument("--updates", type=int, default=2000, help="updates per dataset")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--flood", action="store_true", help="keep inbound flood control enabled")
+    parser.add_argument("--save", help="write results as JSON")
+    parser.add_argument("--compare", help="compare with a JSON file written by --save")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for users in (int(u) for u in args.users.split(",")):
+            results[str(users)] = asyncio.run(run_dataset(users, args.updates, args.seed, args.flood, workdir))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+    if any(result["edited_command_leaks"] or result["errors"] for result in results.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_loadtest()
@@ -1,10 +1,32 @@
 
-import json, os
-from datetime import datetime
+import asyncio, csv, heapq, io, json, math, os, random, re, tempfile, time
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 from telegram import Update, Bot
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
+from telegram.ext import TypeHandler, ApplicationHandlerStop
+from telegram.error import Forbidden, RetryAfter, TelegramError
+from telegram.helpers import escape_markdown
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
+# NumPy is optional; the intent classifier falls back to pure Python without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Pillow and pytesseract are optional; screenshot checks are skipped without them
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
 # Load environment variables from .env file
 try:
     with open('.env', 'r') as f:
@@ -19,6 +41,36 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
 ADMIN_GROUP_ID = int(os.getenv("ADMIN_GROUP_ID", "0"))
 DATA_FILE = "data.json"
+LEDGER_FILE = "ledger.jsonl"
+INTENTS_FILE = "intents.json"
+INTENT_EXAMPLES_FILE = "intent_examples.json"
+
+# AI assistant backend: "keywords" (substring rules) or "classifier" (n-gram model)
+AI_BACKEND = os.getenv("AI_BACKEND", "keywords")
+AI_CONFIDENCE = float(os.getenv("AI_CONFIDENCE", "0.25"))
+
+# Game account lookups before orders: "off" or a name registered in
+# GAME_ID_VERIFIERS ("stub" is the built-in offline backend)
+GAME_ID_VERIFIER = os.getenv("GAME_ID_VERIFIER", "off")
+GAME_ID_TIMEOUT = float(os.getenv("GAME_ID_TIMEOUT", "3"))
+GAME_ID_CACHE_SIZE = 20000
+GAME_ID_CACHE_TTL = 24 * 3600
+GAME_ID_MISS_TTL = 600
+
+# Automatic order delivery: "off" or a name registered in
+# FULFILMENT_PROVIDERS ("simulator" is the built-in local backend)
+FULFILMENT_PROVIDER = os.getenv("FULFILMENT_PROVIDER", "off")
+FULFILMENT_WORKERS = int(os.getenv("FULFILMENT_WORKERS", "4"))
+FULFILMENT_TIMEOUT = 30
+FULFILMENT_RETRIES = 3
+FULFILMENT_BACKOFF = 5
+FULFILMENT_SIM_FAILURE = 0.1
+
+# Topup screenshot checks: OCR is off unless SCREENSHOT_OCR=on (needs tesseract)
+SCREENSHOT_OCR = os.getenv("SCREENSHOT_OCR", "off") == "on"
+SCREENSHOT_WORKERS = int(os.getenv("SCREENSHOT_WORKERS", "2"))
+# Max differing dHash bits for two screenshots to count as the same image
+SCREENSHOT_HASH_DISTANCE = 4
 
 # Authorized users - only these users can use the bot
 AUTHORIZED_USERS = set()
@@ -29,27 +81,131 @@ user_states = {}
 # AI states for users
 ai_users = set()
 
-# Bot maintenance mode
-bot_maintenance = {
-    "orders": True,    # True = enabled, False = disabled
-    "topups": True,    # True = enabled, False = disabled
-    "general": True    # True = enabled, False = disabled
+# Feature flags (/maintenance): a flag can be switched off outright or for
+# daily time windows, and users on its allow list keep the feature while it's
+# off. The config is saved in data.json ("flags"); bot_maintenance holds the
+# compiled form, name -> {"enabled", "off_minutes", "allow"}, where
+# off_minutes has one byte per minute of the day so a check is one lookup.
+FEATURE_FLAGS = ["orders", "topups", "general"]
+bot_maintenance = {}
+
+# In-memory copy of data.json, re-parsed only when the file changes on disk
+_data_cache = {"data": None, "stamp": None}
+
+# data.json I/O counters (file parses, writes, bytes written)
+storage_stats = {
+    "reads": 0,
+    "writes": 0,
+    "bytes_written": 0
+}
+
+# Access gate cost counters (shown in /adminhelp)
+gate_stats = {
+    "calls": 0,
+    "blocked": 0,
+    "flood_dropped": 0,
+    "total_ns": 0
+}
+
+# Inbound flood control: every non-admin user gets a token bucket that refills
+# at FLOOD_RATE tokens/second up to FLOOD_BURST. Emptying it starts a cooldown
+# that grows with each strike; after FLOOD_SILENT_STRIKES strikes updates are
+# dropped without any reply.
+FLOOD_RATE = 0.5
+FLOOD_BURST = 8
+FLOOD_COOLDOWNS = [30, 120, 600, 3600]
+FLOOD_SILENT_STRIKES = 2
+FLOOD_STRIKE_RESET = 6 * 3600
+FLOOD_MAX_TRACKED = 50000
+FLOOD_EVICT_BATCH = 500
+
+# user_id -> bucket and offence state, least recently seen first
+flood_state = OrderedDict()
+
+# Broadcasts: progress is checkpointed to BROADCAST_FILE so a restart resumes
+# where it stopped. BROADCAST_RATE stays under Telegram's ~30 messages/second
+# global limit so live order replies still get through.
+BROADCAST_FILE = "broadcast.json"
+BROADCAST_RATE = 20
+BROADCAST_CHECKPOINT_EVERY = 50
+BROADCAST_AUDIENCES = ["all", "buyers", "active", "balance"]
+BROADCAST_ACTIVE_DAYS = 30
+
+# The running broadcast task, if any
+broadcast_state = {"task": None, "job": None}
+
+# Group work queue: a claim on an order/topup notification lapses after
+# CLAIM_TIMEOUT seconds so another operator can take it over
+CLAIM_TIMEOUT = 15 * 60
+
+# work item ref -> {"user_id", "name", "at"}
+work_claims = {}
+
+# SLA timers: the delivery/confirmation times promised to users. Open orders
+# and topups sit in a min-heap keyed by deadline, so a check only looks at
+# the top of the heap; overdue items are escalated to the admin group once.
+ORDER_SLA = 30 * 60
+TOPUP_SLA = 24 * 3600
+SLA_CHECK_INTERVAL = 60
+SLA_DIGEST_OVER = 5
+
+# Heap of (deadline, work item ref) and ref -> deadline for items still open;
+# heap entries of closed items are dropped when they reach the top
+sla_heap = []
+sla_open = {}
+
+# Items closed within / after their deadline since start, and escalations
+sla_stats = {
+    "orders": {"met": 0, "missed": 0},
+    "topups": {"met": 0, "missed": 0},
+    "escalated": 0
 }
 
+# Idempotency for money-moving updates: the key of every applied message is
+# saved in data.json ("idempotency": {key: [expires_at, result]}, oldest first)
+# in the same write as its balance change, so a redelivered or replayed
+# update gets the original result back instead of running twice
+IDEMPOTENT_COMMANDS = {"mmb", "approve", "deduct"}
+IDEMPOTENCY_TTL = 6 * 3600
+IDEMPOTENCY_MAX_KEYS = 5000
+IDEMPOTENCY_INFLIGHT_TTL = 60
+
+# Keys whose handler is running right now: key -> started_at
+idempotency_inflight = {}
+
 def is_user_authorized(user_id):
     """Check if user is authorized to use the bot"""
     return str(user_id) in AUTHORIZED_USERS or int(user_id) == ADMIN_ID
 
+def _data_file_stamp():
+    st = os.stat(DATA_FILE)
+    return (st.st_mtime_ns, st.st_size)
+
 def load_data():
+    """Return the cached data.json dict, shared by every handler.
+
+    Changes to it are visible to all later readers straight away, so a
+    handler must either save_data() what it changed or not change it at
+    all; on_error() drops the cache when a handler fails halfway.
+    """
     if not os.path.exists(DATA_FILE):
         with open(DATA_FILE, "w") as f:
             json.dump({"users": {}, "prices": {}}, f)
-    with open(DATA_FILE, "r") as f:
-        return json.load(f)
+    stamp = _data_file_stamp()
+    if _data_cache["data"] is None or _data_cache["stamp"] != stamp:
+        with open(DATA_FILE, "r") as f:
+            _data_cache["data"] = json.load(f)
+        _data_cache["stamp"] = stamp
+        storage_stats["reads"] += 1
+    return _data_cache["data"]
 
 def save_data(data):
     with open(DATA_FILE, "w") as f:
         json.dump(data, f, indent=2)
+        storage_stats["bytes_written"] += f.tell()
+    storage_stats["writes"] += 1
+    _data_cache["data"] = data
+    _data_cache["stamp"] = _data_file_stamp()
 
 def load_authorized_users():
     """Load authorized users from data file"""
@@ -74,6 +230,269 @@ def save_prices(prices):
     data["prices"] = prices
     save_data(data)
 
+# Sales report periods (rolling days, today included)
+REPORT_PERIODS = {"day": 1, "week": 7, "month": 30}
+
+def new_stats_bucket():
+    return {"orders": 0, "revenue": 0, "topups": 0, "topup_total": 0, "by_amount": {}, "users": {}}
+
+def get_stats_bucket(data, day):
+    """Get (or create) the running sales aggregate for a YYYY-MM-DD day"""
+    daily = data.setdefault("stats", {}).setdefault("daily", {})
+    if day not in daily:
+        daily[day] = new_stats_bucket()
+    return daily[day]
+
+def record_order_stats(data, user_id, order):
+    """Add an order to its day's aggregate (call before save_data)"""
+    bucket = get_stats_bucket(data, order["timestamp"][:10])
+    bucket["orders"] += 1
+    bucket["revenue"] += order["price"]
+    item = bucket["by_amount"].setdefault(order["amount"], {"count": 0, "revenue": 0})
+    item["count"] += 1
+    item["revenue"] += order["price"]
+    bucket["users"][user_id] = bucket["users"].get(user_id, 0) + order["price"]
+
+def remove_order_stats(data, user_id, order):
+    """Take a refunded order back out of its day's aggregate (call before save_data)"""
+    bucket = get_stats_bucket(data, order["timestamp"][:10])
+    bucket["orders"] -= 1
+    bucket["revenue"] -= order["price"]
+    item = bucket["by_amount"][order["amount"]]
+    item["count"] -= 1
+    item["revenue"] -= order["price"]
+    if not item["count"]:
+        del bucket["by_amount"][order["amount"]]
+    bucket["users"][user_id] -= order["price"]
+    if not bucket["users"][user_id]:
+        del bucket["users"][user_id]
+
+def record_topup_stats(data, amount, day=None):
+    """Add an approved topup to its day's aggregate (call before save_data)"""
+    bucket = get_stats_bucket(data, day or datetime.now().strftime("%Y-%m-%d"))
+    bucket["topups"] += 1
+    bucket["topup_total"] += amount
+
+def rebuild_sales_stats(data):
+    """Recompute the daily aggregates from the full order/topup history"""
+    data["stats"] = {"daily": {}}
+    for user_id, user_data in data["users"].items():
+        for order in user_data.get("orders", []):
+            if order.get("status") != "refunded":
+                record_order_stats(data, user_id, order)
+        for topup in user_data.get("topups", []):
+            if topup.get("status") == "approved":
+                day = (topup.get("approved_at") or topup.get("timestamp", ""))[:10]
+                record_topup_stats(data, topup["amount"], day)
+
+def ensure_sales_stats():
+    """Build the aggregates once for data files created before they existed"""
+    data = load_data()
+    if "stats" not in data:
+        rebuild_sales_stats(data)
+        save_data(data)
+
+# Balance ledger: every balance change is one double-entry line in LEDGER_FILE
+# moving `amount` from one account to another. User accounts are "user:<id>";
+# "topups", "sales", "adjustments" and "opening" are the other sides.
+# data["users"][uid]["balance"] is the materialized sum of a user's entries.
+RECONCILE_INTERVAL = 3600
+
+# Ledger counters (entry sequence and the last reconciliation)
+ledger_stats = {
+    "seq": 0,
+    "last_reconcile": None,
+    "mismatches": 0
+}
+
+def post_ledger(data, source, target, amount, reason, ref=None):
+    """Append a ledger entry and apply it to the materialized user balances.
+
+    Callers save_data() right after, with no await in between, so the ledger
+    and data.json only diverge if the process dies between the two writes;
+    reconcile_balances() reports that case.
+    """
+    ledger_stats["seq"] += 1
+    entry = {
+        "seq": ledger_stats["seq"],
+        "ts": datetime.now().isoformat(),
+        "from": source,
+        "to": target,
+        "amount": amount,
+        "reason": reason,
+        "ref": ref
+    }
+    with open(LEDGER_FILE, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+    if source.startswith("user:"):
+        data["users"][source[5:]]["balance"] -= amount
+    if target.startswith("user:"):
+        data["users"][target[5:]]["balance"] += amount
+
+def ensure_ledger():
+    """Start the ledger from current balances the first time it's needed"""
+    if os.path.exists(LEDGER_FILE):
+        with open(LEDGER_FILE, "rb") as f:
+            ledger_stats["seq"] = sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 20), b""))
+        return
+
+    data = load_data()
+    opening = {uid: u.get("balance", 0) for uid, u in data["users"].items() if u.get("balance", 0)}
+    # Write the opening entries without touching the balances they describe
+    with open(LEDGER_FILE, "w") as f:
+        for user_id, balance in opening.items():
+            ledger_stats["seq"] += 1
+            f.write(json.dumps({
+                "seq": ledger_stats["seq"],
+                "ts": datetime.now().isoformat(),
+                "from": "opening",
+                "to": f"user:{user_id}",
+                "amount": balance,
+                "reason": "opening",
+                "ref": None
+            }) + "\n")
+
+def replay_ledger(end_offset):
+    """Sum ledger entries up to end_offset bytes into per-user balances"""
+    balances = {}
+    position = 0
+    with open(LEDGER_FILE, "rb") as f:
+        for line in f:
+            position += len(line)
+            if position > end_offset:
+                break
+            entry = json.loads(line)
+            for account, sign in ((entry["from"], -1), (entry["to"], 1)):
+                if account.startswith("user:"):
+                    user_id = account[5:]
+                    balances[user_id] = balances.get(user_id, 0) + sign * entry["amount"]
+    return balances
+
+async def reconcile_balances():
+    """Compare materialized balances with the ledger: [(user_id, balance, ledger)]"""
+    # Snapshot balances and the ledger length together; nothing can post in between
+    expected = {uid: u.get("balance", 0) for uid, u in load_data()["users"].items()}
+    end_offset = os.path.getsize(LEDGER_FILE)
+
+    # Replaying a long ledger is slow; keep it off the event loop
+    ledger = await asyncio.to_thread(replay_ledger, end_offset)
+
+    mismatches = []
+    for user_id in expected.keys() | ledger.keys():
+        if expected.get(user_id, 0) != ledger.get(user_id, 0):
+            mismatches.append((user_id, expected.get(user_id, 0), ledger.get(user_id, 0)))
+    ledger_stats["last_reconcile"] = datetime.now().strftime("%Y-%m-%d %H:%M")
+    ledger_stats["mismatches"] = len(mismatches)
+    return mismatches
+
+def format_reconcile_report(mismatches):
+    if not mismatches:
+        return f"✅ **Ledger ကိုက်ညီပါတယ်!**\n\n📒 Entries: {ledger_stats['seq']:,}"
+    msg = f"🚨 **Ledger မကိုက်ညီမှု {len(mismatches)} ခု!**\n\n"
+    for user_id, balance, ledger in sorted(mismatches, key=lambda m: -abs(m[1] - m[2]))[:10]:
+        msg += f"• `{user_id}`: balance {balance:,} / ledger {ledger:,} ({balance - ledger:+,})\n"
+    return msg
+
+async def reconcile_loop(bot: Bot):
+    """Background job: reconcile every RECONCILE_INTERVAL and alert the owner on drift"""
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL)
+        try:
+            mismatches = await reconcile_balances()
+            if mismatches:
+                await bot.send_message(chat_id=ADMIN_ID, text=format_reconcile_report(mismatches), parse_mode="Markdown")
+        except Exception as e:
+            print(f"⚠️ Reconciliation failed: {e}")
+
+# order_id -> [(user_id, order index)]; order ids are second-resolution
+# timestamps, so two users ordering in the same second share one
+order_index = {}
+
+def index_order(order_id, user_id, index):
+    order_index.setdefault(order_id, []).append((user_id, index))
+
+def build_order_index(data):
+    """Index every stored order by its order_id"""
+    order_index.clear()
+    for user_id, user_data in data["users"].items():
+        for i, order in enumerate(user_data.get("orders", [])):
+            index_order(order["order_id"], user_id, i)
+
+def build_sales_report(data, days):
+    """Merge the last `days` daily aggregates into one bucket"""
+    daily = data.get("stats", {}).get("daily", {})
+    today = datetime.now().date()
+    total = new_stats_bucket()
+    for offset in range(days):
+        bucket = daily.get((today - timedelta(days=offset)).isoformat())
+        if not bucket:
+            continue
+        for key in ("orders", "revenue", "topups", "topup_total"):
+            total[key] += bucket[key]
+        for amount, item in bucket["by_amount"].items():
+            merged = total["by_amount"].setdefault(amount, {"count": 0, "revenue": 0})
+            merged["count"] += item["count"]
+            merged["revenue"] += item["revenue"]
+        for user_id, revenue in bucket["users"].items():
+            total["users"][user_id] = total["users"].get(user_id, 0) + revenue
+    return total
+
+# Export columns per record type
+EXPORT_FIELDS = {
+    "orders": ["user_id", "username", "order_id", "game_id", "server_id", "amount", "price", "status", "timestamp"],
+    "topups": ["user_id", "username", "amount", "status", "timestamp", "approved_at"]
+}
+
+# Rows written between event loop yields while exporting inside the bot
+EXPORT_CHUNK = 2000
+
+def iter_export_records(users, kind, date_from=None, date_to=None, status=None, user=None):
+    """Yield flat order/topup rows from (user_id, user_data) pairs, filtered"""
+    for user_id, user_data in users:
+        if user and user_id != user:
+            continue
+        username = user_data.get("username", "")
+        for record in user_data.get(kind, []):
+            day = record.get("timestamp", "")[:10]
+            if date_from and day < date_from:
+                continue
+            if date_to and day > date_to:
+                continue
+            if status and record.get("status") != status:
+                continue
+            row = {"user_id": user_id, "username": username}
+            row.update(record)
+            yield row
+
+def make_export_writer(f, kind, fmt):
+    """Return a function that writes one row to `f` as CSV or JSONL"""
+    fields = EXPORT_FIELDS[kind]
+    if fmt == "csv":
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        return writer.writerow
+
+    def write_jsonl(row):
+        f.write(json.dumps({key: row.get(key) for key in fields}, ensure_ascii=False) + "\n")
+    return write_jsonl
+
+def parse_export_args(args):
+    """Parse `/export orders csv from=... to=... status=... user=...`"""
+    options = {"kind": "orders", "fmt": "csv", "date_from": None, "date_to": None, "status": None, "user": None}
+    keys = {"from": "date_from", "to": "date_to", "status": "status", "user": "user"}
+    for arg in args:
+        key, _, value = arg.partition("=")
+        if arg in EXPORT_FIELDS:
+            options["kind"] = arg
+        elif arg in ("csv", "jsonl"):
+            options["fmt"] = arg
+        elif value and key in keys:
+            options[keys[key]] = value
+        else:
+            raise ValueError(arg)
+    return options
+
 def validate_game_id(game_id):
     """Validate MLBB Game ID (6-10 digits)"""
     if not game_id.isdigit():
@@ -90,23 +509,79 @@ def validate_server_id(server_id):
         return False
     return True
 
-def is_banned_account(game_id):
+# Built-in bans that apply even with an empty ban list
+DEFAULT_BANNED_IDS = ["123456789"]
+
+# Compiled ban list (see build_ban_registry): exact ids and (game_id, server_id)
+# pairs are hash lookups, prefixes are checked once per distinct prefix length
+# and ranges are merged and binary searched
+ban_registry = {
+    "ids": set(DEFAULT_BANNED_IDS),
+    "accounts": set(),
+    "prefixes": set(),
+    "prefix_lengths": [],
+    "range_starts": [],
+    "range_ends": []
+}
+
+def parse_ban_entry(args):
+    """Turn /ban arguments into (kind, value): id, prefix (`123*`), range (`100-199`) or account"""
+    if len(args) == 2 and args[0].isdigit() and args[1].isdigit():
+        return "accounts", f"{args[0]}:{args[1]}"
+    if len(args) != 1:
+        return None
+    entry = args[0]
+    if entry.isdigit():
+        return "ids", entry
+    if entry.endswith("*") and entry[:-1].isdigit():
+        return "prefixes", entry[:-1]
+    low, sep, high = entry.partition("-")
+    if sep and low.isdigit() and high.isdigit() and int(low) <= int(high):
+        return "ranges", f"{int(low)}-{int(high)}"
+    game_id, sep, server_id = entry.partition(":")
+    if sep and game_id.isdigit() and server_id.isdigit():
+        return "accounts", entry
+    return None
+
+def build_ban_registry(bans):
+    """Compile data["bans"] into ban_registry"""
+    ban_registry["ids"] = set(DEFAULT_BANNED_IDS) | set(bans.get("ids", []))
+    ban_registry["accounts"] = {tuple(entry.split(":")) for entry in bans.get("accounts", [])}
+    ban_registry["prefixes"] = set(bans.get("prefixes", []))
+    ban_registry["prefix_lengths"] = sorted({len(prefix) for prefix in ban_registry["prefixes"]})
+
+    # Merge overlapping ranges so one bisect finds the only candidate
+    starts, ends = [], []
+    for low, high in sorted(tuple(map(int, entry.split("-"))) for entry in bans.get("ranges", [])):
+        if ends and low <= ends[-1] + 1:
+            ends[-1] = max(ends[-1], high)
+        else:
+            starts.append(low)
+            ends.append(high)
+    ban_registry["range_starts"] = starts
+    ban_registry["range_ends"] = ends
+
+def is_banned_account(game_id, server_id=None):
     """
     Check if MLBB account is banned
-    This is a simple example - in reality you'd need to integrate with MLBB API
-    For now, we'll use some common patterns of banned accounts
+    Checks the admin-managed ban list (/ban) plus some common patterns of
+    invalid accounts
     """
-    # Add known banned account IDs here
-    banned_ids = [
-        "123456789",  # Example banned ID
-        "000000000",  # Invalid pattern
-        "111111111",  # Invalid pattern
-    ]
-
-    # Check if game_id matches banned patterns
-    if game_id in banned_ids:
+    if game_id in ban_registry["ids"]:
         return True
 
+    if server_id and (game_id, server_id) in ban_registry["accounts"]:
+        return True
+
+    for length in ban_registry["prefix_lengths"]:
+        if game_id[:length] in ban_registry["prefixes"]:
+            return True
+
+    if ban_registry["range_starts"]:
+        i = bisect_right(ban_registry["range_starts"], int(game_id)) - 1
+        if i >= 0 and int(game_id) <= ban_registry["range_ends"][i]:
+            return True
+
     # Check for suspicious patterns (all same digits, too simple patterns)
     if len(set(game_id)) == 1:  # All same digits like 111111111
         return True
@@ -116,27 +591,178 @@ def is_banned_account(game_id):
 
     return False
 
-def get_price(diamonds):
-    # Load custom prices first
-    custom_prices = load_prices()
-    if diamonds in custom_prices:
-        return custom_prices[diamonds]
-    
-    # Default prices
-    if diamonds.startswith("wp") and diamonds[2:].isdigit():
-        n = int(diamonds[2:])
-        if 1 <= n <= 10:
-            return n * 6500
-    table = {
-        "11": 950, "22": 1900, "33": 2850, "56": 4200, "112": 8200,
-        "86": 5100, "172": 10200, "257": 15300, "343": 20400,
-        "429": 25500, "514": 30600, "600": 35700, "706": 40800,
-        "878": 51000, "963": 56100, "1049": 61200, "1135": 66300,
-        "1412": 81600, "2195": 122400, "3688": 204000,
-        "5532": 306000, "9288": 510000, "12976": 714000,
-        "55": 3500, "165": 10000, "275": 16000, "565": 33000
+# Account lookup backends: async (game_id, server_id) -> {"exists", "nickname", "banned"}
+GAME_ID_VERIFIERS = {}
+
+# (game_id, server_id) -> (expires_at, result), least recently used first
+game_id_cache = {}
+
+# (game_id, server_id) -> lookup task shared by concurrent callers
+game_id_inflight = {}
+
+# Verifier counters (shown in /adminhelp)
+game_id_stats = {
+    "hits": 0,
+    "lookups": 0,
+    "coalesced": 0,
+    "errors": 0
+}
+
+def register_game_id_verifier(name, verifier):
+    GAME_ID_VERIFIERS[name] = verifier
+
+async def verify_game_id_stub(game_id, server_id):
+    """Offline backend: every well-formed ID exists unless it's a ban pattern"""
+    return {
+        "exists": True,
+        "nickname": f"Player{game_id[-4:]}",
+        "banned": is_banned_account(game_id, server_id)
     }
-    return table.get(diamonds)
+
+register_game_id_verifier("stub", verify_game_id_stub)
+
+async def _lookup_game_account(key):
+    """Run the configured backend once and cache what it returns"""
+    try:
+        result = await asyncio.wait_for(GAME_ID_VERIFIERS[GAME_ID_VERIFIER](*key), GAME_ID_TIMEOUT)
+    except Exception as e:
+        game_id_stats["errors"] += 1
+        print(f"⚠️ Game ID lookup failed for {key}: {e!r}")
+        return None
+    finally:
+        game_id_inflight.pop(key, None)
+
+    ttl = GAME_ID_CACHE_TTL if result["exists"] else GAME_ID_MISS_TTL
+    game_id_cache[key] = (time.monotonic() + ttl, result)
+    if len(game_id_cache) > GAME_ID_CACHE_SIZE:
+        del game_id_cache[next(iter(game_id_cache))]
+    return result
+
+async def verify_game_account(game_id, server_id):
+    """Look up an account through the cache; None when verification is off or failed"""
+    if GAME_ID_VERIFIER not in GAME_ID_VERIFIERS:
+        return None
+
+    key = (game_id, server_id)
+    cached = game_id_cache.pop(key, None)
+    if cached and cached[0] > time.monotonic():
+        # Re-insert to mark as most recently used
+        game_id_cache[key] = cached
+        game_id_stats["hits"] += 1
+        return cached[1]
+
+    task = game_id_inflight.get(key)
+    if task:
+        game_id_stats["coalesced"] += 1
+    else:
+        game_id_stats["lookups"] += 1
+        task = game_id_inflight[key] = asyncio.ensure_future(_lookup_game_account(key))
+    # shield: one caller giving up must not cancel the lookup for the others
+    return await asyncio.shield(task)
+
+# Default price list; /setprice overrides apply on top of it for everyone
+BASE_PRICES = {f"wp{n}": n * 6500 for n in range(1, 11)}
+BASE_PRICES.update({
+    "11": 950, "22": 1900, "33": 2850, "56": 4200, "112": 8200,
+    "86": 5100, "172": 10200, "257": 15300, "343": 20400,
+    "429": 25500, "514": 30600, "600": 35700, "706": 40800,
+    "878": 51000, "963": 56100, "1049": 61200, "1135": 66300,
+    "1412": 81600, "2195": 122400, "3688": 204000,
+    "5532": 306000, "9288": 510000, "12976": 714000,
+    "55": 3500, "165": 10000, "275": 16000, "565": 33000
+})
+
+# Pricing engine: data.json "pricing" holds price groups (a % discount and/or
+# per-item prices, plus volume tiers on 30-day spend), group members and
+# time-boxed promos. build_price_engine() compiles it into one item -> price
+# table per group with the promos running now already applied, so pricing an
+# order is a dict lookup. It recompiles on admin edits and when a promo
+# starts or ends (valid_until).
+DEFAULT_PRICE_GROUP = "default"
+VOLUME_DAYS = 30
+PROMO_MAX_HOURS = 24 * 365
+
+price_engine = {
+    "tables": {},
+    "members": {},
+    "volume": {},
+    "notes": {},
+    "valid_until": 0
+}
+
+def build_price_engine():
+    """Compile custom prices, groups and promos into per-group price tables"""
+    data = load_data()
+    pricing = data.get("pricing", {})
+    groups = pricing.get("groups", {})
+    base = {**BASE_PRICES, **data.get("prices", {})}
+    now = datetime.now().isoformat(timespec="minutes")
+
+    active = [p for p in pricing.get("promos", []) if p["from"] <= now < p["to"]]
+    boundaries = [t for p in pricing.get("promos", []) for t in (p["from"], p["to"]) if t > now]
+
+    tables, notes = {}, {}
+    for group in [DEFAULT_PRICE_GROUP, *groups]:
+        config = groups.get(group, {})
+        table = {}
+        for item, price in base.items():
+            if item in config.get("prices", {}):
+                price = config["prices"][item]
+            else:
+                price -= price * config.get("discount", 0) // 100
+            for promo in active:
+                if promo["item"] in ("*", item) and promo.get("group", "*") in ("*", group):
+                    price -= price * promo["percent"] // 100
+            table[item] = price
+        tables[group] = table
+
+        # /price lines for items this group pays less for than the base list
+        cheaper = [f"• {item} = {table[item]:,} MMK ({base[item]:,} အစား)" for item in base if table[item] < base[item]]
+        notes[group] = f"🏷️ **သင့်ဈေးနှုန်းများ** ({group}):\n" + "\n".join(cheaper) + "\n\n" if cheaper else ""
+
+    price_engine["tables"] = tables
+    price_engine["members"] = dict(pricing.get("members", {}))
+    price_engine["volume"] = {
+        group: sorted(config["volume"]) for group, config in groups.items() if config.get("volume")
+    }
+    price_engine["notes"] = notes
+    price_engine["valid_until"] = datetime.fromisoformat(min(boundaries)).timestamp() if boundaries else math.inf
+
+def refresh_price_engine():
+    """Recompile if a promo has started or ended since the last build"""
+    if time.time() >= price_engine["valid_until"]:
+        build_price_engine()
+
+def get_price_group(user_id):
+    return price_engine["members"].get(str(user_id), DEFAULT_PRICE_GROUP) if user_id else DEFAULT_PRICE_GROUP
+
+def get_recent_spend(user_id, days=VOLUME_DAYS):
+    """A user's order total over the last `days` days, from the daily sales stats"""
+    daily = load_data().get("stats", {}).get("daily", {})
+    today = datetime.now()
+    return sum(
+        daily.get((today - timedelta(days=i)).strftime("%Y-%m-%d"), {}).get("users", {}).get(user_id, 0)
+        for i in range(days)
+    )
+
+def get_volume_discount(group, user_id):
+    """Percent off for the user's 30-day spend tier in their group (0 without tiers)"""
+    tiers = price_engine["volume"].get(group)
+    if not tiers:
+        return 0
+    spend = get_recent_spend(str(user_id))
+    i = bisect_right([threshold for threshold, _ in tiers], spend)
+    return tiers[i - 1][1] if i else 0
+
+def get_price(diamonds, user_id=None):
+    """Price of an item in MMK for a user (their group, promos, volume tier); None if unknown"""
+    refresh_price_engine()
+
+    group = get_price_group(user_id)
+    price = price_engine["tables"][group].get(diamonds)
+    if price is None or not user_id:
+        return price
+    return price - price * get_volume_discount(group, user_id) // 100
 
 def is_payment_screenshot(update):
     """
@@ -154,210 +780,850 @@ def is_payment_screenshot(update):
         return True
     return False
 
+# Index of every topup screenshot, rebuilt from data.json at startup.
+# file_ids and hashes map Telegram's file_unique_id / the dHash to the first
+# (user_id, time) that sent it. buckets slices each hash into
+# SCREENSHOT_HASH_DISTANCE + 1 chunks: two hashes within that distance must
+# share at least one chunk exactly, so a lookup only compares against the
+# hashes in a handful of buckets instead of every historical topup.
+screenshot_index = {"file_ids": {}, "hashes": {}, "buckets": []}
+
+# Worker processes for screenshot hashing/OCR, created on first use
+_screenshot_executor = None
+
+def dhash(image, size=8):
+    """64-bit difference hash: survives re-compression and resizing"""
+    pixels = list(image.convert("L").resize((size + 1, size)).getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+def extract_amounts(text):
+    """Pull MMK-looking amounts (1,000+) out of OCR text"""
+    amounts = set()
+    for match in re.findall(r"(?<!\d)(\d{1,3}(?:[,.]\d{3})+|\d{4,7})(?!\d)", text):
+        amounts.add(int(re.sub(r"[,.]", "", match)))
+    return amounts
+
+def analyze_screenshot(image_bytes, ocr=False):
+    """Hash (and optionally OCR) a screenshot; runs in a worker process"""
+    image = Image.open(io.BytesIO(image_bytes))
+    result = {"hash": dhash(image), "amounts": None}
+    if ocr and pytesseract is not None:
+        result["amounts"] = sorted(extract_amounts(pytesseract.image_to_string(image)))
+    return result
+
+def get_screenshot_executor():
+    global _screenshot_executor
+    if _screenshot_executor is None:
+        _screenshot_executor = ProcessPoolExecutor(max_workers=SCREENSHOT_WORKERS)
+    return _screenshot_executor
+
+def hash_chunks(image_hash):
+    """Split a 64-bit hash into SCREENSHOT_HASH_DISTANCE + 1 bit slices"""
+    count = SCREENSHOT_HASH_DISTANCE + 1
+    bounds = [64 * i // count for i in range(count + 1)]
+    return [(image_hash >> bounds[i]) & ((1 << (bounds[i + 1] - bounds[i])) - 1) for i in range(count)]
+
+def add_screenshot_hash(image_hash, owner):
+    """Index a hash; exact repeats keep the first owner"""
+    if image_hash in screenshot_index["hashes"]:
+        return
+    screenshot_index["hashes"][image_hash] = owner
+    buckets = screenshot_index["buckets"]
+    if not buckets:
+        buckets.extend({} for _ in range(SCREENSHOT_HASH_DISTANCE + 1))
+    for bucket, chunk in zip(buckets, hash_chunks(image_hash)):
+        bucket.setdefault(chunk, []).append(image_hash)
+
+def find_similar_screenshot(image_hash):
+    """Return the owner of the closest indexed hash within SCREENSHOT_HASH_DISTANCE bits"""
+    hashes = screenshot_index["hashes"]
+    if image_hash in hashes:
+        return hashes[image_hash]
+    best = None
+    best_distance = SCREENSHOT_HASH_DISTANCE + 1
+    for bucket, chunk in zip(screenshot_index["buckets"], hash_chunks(image_hash)):
+        for candidate in bucket.get(chunk, ()):
+            distance = (candidate ^ image_hash).bit_count()
+            if distance < best_distance:
+                best, best_distance = hashes[candidate], distance
+    return best
+
+def index_screenshot(owner, file_unique_id=None, image_hash=None):
+    if file_unique_id:
+        screenshot_index["file_ids"].setdefault(file_unique_id, owner)
+    if image_hash is not None:
+        add_screenshot_hash(image_hash, owner)
+
+def build_screenshot_index(data):
+    """Index file ids and hashes stored on every historical topup"""
+    screenshot_index["file_ids"] = {}
+    screenshot_index["hashes"] = {}
+    screenshot_index["buckets"] = []
+    for user_id, user_data in data["users"].items():
+        for topup in user_data.get("topups", []):
+            image_hash = topup.get("image_hash")
+            index_screenshot(
+                (user_id, topup.get("timestamp", "")[:16]),
+                topup.get("file_unique_id"),
+                int(image_hash, 16) if image_hash else None
+            )
+
+def format_duplicate(owner):
+    user_id, when = owner
+    return f"🚨 Duplicate - User `{user_id}` ({when.replace('T', ' ')}) ပို့ပြီးသား screenshot နဲ့ တူပါတယ်"
+
+def screenshot_verdict(result, amount, duplicate_of):
+    """One-line verdict appended to the admin's topup notification"""
+    if duplicate_of:
+        return format_duplicate(duplicate_of)
+    if result["amounts"] is not None:
+        if amount not in result["amounts"]:
+            found = ", ".join(f"{a:,}" for a in result["amounts"][:3]) or "မတွေ့ပါ"
+            return f"⚠️ Amount mismatch - screenshot ထဲမှာ {found}"
+        return "✅ Likely valid - amount ကိုက်ညီပါတယ်"
+    return "✅ Likely valid - အသစ်ဖြစ်ပါတယ်"
+
+async def check_screenshot(bot: Bot, photo, user_id, amount, admin_message, topup_index):
+    """Download, hash and OCR a topup screenshot, store the hash on the topup
+    record and add the verdict to admin_message"""
+    try:
+        file = await photo.get_file()
+        image_bytes = bytes(await file.download_as_bytearray())
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(get_screenshot_executor(), analyze_screenshot, image_bytes, SCREENSHOT_OCR)
+    except Exception as e:
+        print(f"⚠️ Screenshot check failed: {e}")
+        return
+
+    data = load_data()
+    topup = data["users"][user_id]["topups"][topup_index]
+    duplicate_of = find_similar_screenshot(result["hash"])
+    index_screenshot((user_id, topup["timestamp"][:16]), image_hash=result["hash"])
+    topup["image_hash"] = f"{result['hash']:016x}"
+    save_data(data)
+
+    # Once approved or rejected from the buttons the verdict no longer matters
+    if topup["status"] != "pending":
+        return
+    try:
+        await bot.edit_message_text(
+            chat_id=admin_message.chat_id,
+            message_id=admin_message.message_id,
+            text=f"{admin_message.text_markdown}\n\n🔍 {screenshot_verdict(result, amount, duplicate_of)}",
+            parse_mode="Markdown",
+            reply_markup=admin_message.reply_markup
+        )
+    except TelegramError:
+        pass
+
+# Payment accounts shown to users (single source for every payment text)
+PAYMENT_ACCOUNTS = {
+    "kpay": {"label": "KBZ Pay", "number": "09678786528", "name": "Ma May Phoo Wai"},
+    "wave": {"label": "Wave Money", "number": "09673585480", "name": "Nine Nine"}
+}
+
+DEFAULT_LANG = "my"
+
+# Pre-rendered static messages and keyboards, keyed by (name, lang) / name
+MESSAGE_TEMPLATES = {}
+KEYBOARDS = {}
+
+# Fallback replies picked at random by ai_reply()
+AI_DEFAULT_TEMPLATES = ["ai_default_1", "ai_default_2", "ai_default_3"]
+
+def register_template(name, text, lang=DEFAULT_LANG):
+    """Store a pre-rendered message; {field} placeholders are filled per user"""
+    MESSAGE_TEMPLATES[(name, lang)] = text
+
+def get_template(name, lang=DEFAULT_LANG):
+    """Get a pre-rendered message, falling back to the default language"""
+    if not MESSAGE_TEMPLATES:
+        build_templates()
+    return MESSAGE_TEMPLATES.get((name, lang)) or MESSAGE_TEMPLATES[(name, DEFAULT_LANG)]
+
+def render_template(template_name, lang=DEFAULT_LANG, **fields):
+    """Get a pre-rendered message with its per-user fields substituted"""
+    # Not `name`: the start messages have a {name} field
+    return get_template(template_name, lang).format(**fields)
+
+def get_keyboard(name):
+    """Get a pre-built InlineKeyboardMarkup"""
+    if not KEYBOARDS:
+        build_templates()
+    return KEYBOARDS[name]
+
+def build_price_template():
+    """Render the /price message (run again whenever custom prices change)"""
+    custom_prices = load_prices()
+
+    price_msg = (
+        "💎 **MLBB Diamond ဈေးနှုန်းများ**\n\n"
+        "🎟️ **Weekly Pass**:\n"
+        "• wp1 = 6,500 MMK\n"
+        "• wp2 = 13,000 MMK\n"
+        "• wp3 = 19,500 MMK\n"
+        "• wp4 = 26,000 MMK\n"
+        "• wp5 = 32,500 MMK\n"
+        "• wp6 = 39,000 MMK\n"
+        "• wp7 = 45,500 MMK\n"
+        "• wp8 = 52,000 MMK\n"
+        "• wp9 = 58,500 MMK\n"
+        "• wp10 = 65,000 MMK\n\n"
+        "💎 **Regular Diamonds**:\n"
+        "• 11 = 950 MMK\n"
+        "• 22 = 1,900 MMK\n"
+        "• 33 = 2,850 MMK\n"
+        "• 56 = 4,200 MMK\n"
+        "• 86 = 5,100 MMK\n"
+        "• 112 = 8,200 MMK\n"
+        "• 172 = 10,200 MMK\n"
+        "• 257 = 15,300 MMK\n"
+        "• 343 = 20,400 MMK\n"
+        "• 429 = 25,500 MMK\n"
+        "• 514 = 30,600 MMK\n"
+        "• 600 = 35,700 MMK\n"
+        "• 706 = 40,800 MMK\n"
+        "• 878 = 51,000 MMK\n"
+        "• 963 = 56,100 MMK\n"
+        "• 1049 = 61,200 MMK\n"
+        "• 1135 = 66,300 MMK\n"
+        "• 1412 = 81,600 MMK\n"
+        "• 2195 = 122,400 MMK\n"
+        "• 3688 = 204,000 MMK\n"
+        "• 5532 = 306,000 MMK\n"
+        "• 9288 = 510,000 MMK\n"
+        "• 12976 = 714,000 MMK\n\n"
+        "💎 **2X Diamond Pass**:\n"
+        "• 55 = 3,500 MMK\n"
+        "• 165 = 10,000 MMK\n"
+        "• 275 = 16,000 MMK\n"
+        "• 565 = 33,000 MMK\n\n"
+    )
+
+    # Add custom prices if any
+    if custom_prices:
+        price_msg += "🔥 **Special Prices**:\n"
+        for item, price in custom_prices.items():
+            price_msg += f"• {item} = {price:,} MMK\n"
+        price_msg += "\n"
+
+    price_msg += (
+        "**📝 အသုံးပြုနည်း**:\n"
+        "`/mmb gameid serverid amount`\n\n"
+        "**ဥပမာ**:\n"
+        "`/mmb 123456789 12345 wp1`\n"
+        "`/mmb 123456789 12345 86`"
+    )
+
+    register_template("price", price_msg)
+
+def build_templates():
+    """Build all static messages and keyboards once"""
+    kpay = PAYMENT_ACCOUNTS["kpay"]
+    wave = PAYMENT_ACCOUNTS["wave"]
+
+    # Keyboards
+    KEYBOARDS["contact_owner"] = InlineKeyboardMarkup(
+        [[InlineKeyboardButton("👑 Contact Owner", url=f"tg://user?id={ADMIN_ID}")]]
+    )
+    KEYBOARDS["payment"] = InlineKeyboardMarkup([
+        [InlineKeyboardButton("📱 Copy KPay Number", callback_data="copy_kpay")],
+        [InlineKeyboardButton("📱 Copy Wave Number", callback_data="copy_wave")]
+    ])
+    KEYBOARDS["topup"] = InlineKeyboardMarkup(
+        [[InlineKeyboardButton("💳 ငွေဖြည့်မယ်", callback_data="topup_button")]]
+    )
+
+    # Access / restriction replies
+    register_template(
+        "unauthorized",
+        "🚫 **အသုံးပြုခွင့် မရှိပါ!**\n\n"
+        "Owner ထံ bot အသုံးပြုခွင့် တောင်းဆိုပါ။"
+    )
+    register_template(
+        "start_unauthorized",
+        "🚫 **Bot အသုံးပြုခွင့် မရှိပါ!**\n\n"
+        "👋 မင်္ဂလာပါ `{name}`!\n"
+        "🆔 Your ID: `{user_id}`\n\n"
+        "❌ သင်သည် ဤ bot ကို အသုံးပြုခွင့် မရှိသေးပါ။\n\n"
+        "**လုပ်ရမည့်အရာများ**:\n"
+        "• အောက်က 'Contact Owner' button ကို နှိပ်ပါ\n"
+        "• Owner ထံ bot အသုံးပြုခွင့် တောင်းဆိုပါ\n"
+        "• သင့် User ID ကို ပေးပို့ပါ\n\n"
+        "✅ Owner က approve လုပ်ပြီးမှ bot ကို အသုံးပြုနိုင်ပါမယ်။"
+    )
+    register_template(
+        "restricted",
+        "⏳ **Screenshot ပို့ပြီးပါပြီ!**\n\n"
+        "❌ Admin က လက်ခံပြီးကြောင်း အတည်ပြုတဲ့အထိ commands တွေ အသုံးပြုလို့ မရပါ။\n\n"
+        "⏰ Admin က approve လုပ်ပြီးမှ ပြန်လည် အသုံးပြုနိုင်ပါမယ်။\n"
+        "📞 အရေးပေါ်ဆိုရင် admin ကို ဆက်သွယ်ပါ။"
+    )
+    register_template(
+        "restricted_content",
+        "❌ **အသုံးပြုမှု ကန့်သတ်ထားပါ!**\n\n"
+        "🔒 Screenshot ပို့ပြီးပါပြီ။ Admin က လက်ခံပြီးကြောင်း အတည်ပြုတဲ့အထိ:\n\n"
+        "❌ Commands အသုံးပြုလို့ မရပါ\n"
+        "❌ စာသား ပို့လို့ မရပါ\n"
+        "❌ Voice, Sticker, GIF, Video ပို့လို့ မရပါ\n"
+        "❌ Emoji ပို့လို့ မရပါ\n\n"
+        "⏰ Admin က approve လုပ်ပြီးမှ ပြန်လည် အသုံးပြုနိုင်ပါမယ်။\n"
+        "📞 အရေးပေါ်ဆိုရင် admin ကို ဆက်သွယ်ပါ။"
+    )
+    register_template(
+        "pending_topup",
+        "⏳ **Pending Topup ရှိနေပါတယ်!**\n\n"
+        "❌ သင့်မှာ admin က approve မလုပ်သေးတဲ့ topup ရှိနေပါတယ်။\n\n"
+        "**လုပ်ရမည့်အရာများ**:\n"
+        "• Admin က topup ကို approve လုပ်ပေးတဲ့အထိ စောင့်ပါ\n"
+        "• Approve ရပြီးမှ command တွေကို ပြန်အသုံးပြုနိုင်ပါမယ်\n\n"
+        "📞 အရေးပေါ်ဆိုရင် admin ကို ဆက်သွယ်ပါ။\n"
+        "💡 `/balance` နဲ့ status စစ်ကြည့်နိုင်ပါတယ်။"
+    )
+    register_template(
+        "flood_warning",
+        "🐢 Message များ အရမ်းများနေပါတယ်!\n\n"
+        "⏳ {seconds} စက္ကန့် စောင့်ပြီးမှ ပြန်ပို့ပါ။\n"
+        "❗ ဆက်ပို့နေရင် ပိုကြာကြာ ပိတ်ခံရပါမယ်။"
+    )
+    register_template(
+        "maintenance_orders",
+        "🔧 **အော်ဒါ လုပ်ဆောင်ချက် ယာယီ ပိတ်ထားပါ**\n\nAdmin က ပြန်ဖွင့်ပေးတဲ့အခါ အသုံးပြုနိုင်ပါမယ်။"
+    )
+    register_template(
+        "maintenance_topups",
+        "🔧 **ငွေဖြည့်လုပ်ဆောင်ချက် ယာယီ ပိတ်ထားပါ**\n\nAdmin က ပြန်ဖွင့်ပေးတဲ့အခါ အသုံးပြုနိုင်ပါမယ်။"
+    )
+    register_template(
+        "maintenance_general",
+        "🔧 **Bot ယာယီ Maintenance ဖြစ်နေပါတယ်**\n\nAdmin က ပြန်ဖွင့်ပေးတဲ့အခါ အသုံးပြုနိုင်ပါမယ်။"
+    )
+
+    # User commands
+    register_template(
+        "start_welcome",
+        "👋 မင်္ဂလာပါ `{name}`!\n"
+        "🆔 Telegram User ID: `{user_id}`\n\n"
+        "📱 MLBB Diamond Top-up Bot မှ ကြိုဆိုပါတယ်။\n\n"
+        "**အသုံးပြုနိုင်တဲ့ command များ**:\n"
+        "➤ `/mmb gameid serverid amount`\n"
+        "➤ `/balance` - ဘယ်လောက်လက်ကျန်ရှိလဲ စစ်မယ်\n"
+        "➤ `/topup amount` - ငွေဖြည့်မယ် (screenshot တင်ပါ)\n"
+        "➤ `/price` - Diamond များရဲ့ ဈေးနှုန်းများ\n"
+        "➤ `/history` - အော်ဒါမှတ်တမ်းကြည့်မယ်\n"
+        "➤ `/aistart` - AI နဲ့ စကားပြောမယ်\n"
+        "➤ `/stopai` - AI ကို ရပ်မယ်\n\n"
+        "**📌 ဥပမာ**:\n"
+        "`/mmb 123456789 12345 wp1`\n"
+        "`/mmb 123456789 12345 86`\n\n"
+        "လိုအပ်တာရှိရင် Owner ကို ဆက်သွယ်နိုင်ပါတယ်။ 😊"
+    )
+    register_template(
+        "mmb_usage",
+        "❌ အမှားရှိပါတယ်!\n\n"
+        "**မှန်ကန်တဲ့ format**:\n"
+        "`/mmb gameid serverid amount`\n\n"
+        "**ဥပမာ**:\n"
+        "`/mmb 123456789 12345 wp1`\n"
+        "`/mmb 123456789 12345 86`"
+    )
+    register_template(
+        "topup_missing_amount",
+        "❌ ငွေပမာဏ ထည့်ပါ!\n\n"
+        "**ဥပမာ**: `/topup 50000`\n\n"
+        "💳 ငွေလွှဲရန် အောက်က buttons များကို သုံးပါ။"
+    )
+    register_template(
+        "topup_instructions",
+        "💳 **ငွေဖြည့်လုပ်ငန်းစဉ်**\n\n"
+        "💰 ပမာဏ: `{amount:,} MMK`\n\n"
+        "**လွှဲရမည့် Account များ**:\n"
+        f"📱 {kpay['label']}: `{kpay['number']}`\n"
+        f"Name - **{kpay['name']}**\n"
+        f"📱 {wave['label']}: `{wave['number']}`\n"
+        f"Name - **{wave['name']}**\n"
+        "🏦 CB Bank: အသုံးပြုစဲမရှိသေးပါ\n\n"
+        "💸 ငွေလွှဲပြီးရင် screenshot ကို ဒီမှာ တင်ပေးပါ။\n"
+        "⏰ 24 နာရီအတွင်း confirm လုပ်ပါမယ်။"
+    )
+    register_template(
+        "topup_steps",
+        "💳 **ငွေဖြည့်လုပ်ငန်းစဉ်**\n\n"
+        "**အဆင့် 1**: ငွေပမာဏ ရေးပါ\n"
+        "`/topup amount` ဥပမာ: `/topup 50000`\n\n"
+        "**အဆင့် 2**: ငွေလွှဲပါ\n"
+        f"📱 {kpay['label']}: `{kpay['number']}` ({kpay['name']})\n"
+        f"📱 {wave['label']}: `{wave['number']}` ({wave['name']})\n\n"
+        "**အဆင့် 3**: Screenshot တင်ပါ\n"
+        "ငွေလွှဲပြီးရင် screenshot ကို ဒီမှာ တင်ပေးပါ။\n\n"
+        "⏰ 24 နာရီအတွင်း confirm လုပ်ပါမယ်။"
+    )
+    register_template(
+        "screenshot_received",
+        "✅ **Screenshot လက်ခံပါပြီ!**\n\n"
+        "💰 ပမာဏ: `{amount:,} MMK`\n"
+        "⏰ အချိန်: {time}\n\n"
+        "🔒 **အသုံးပြုမှု ယာယီ ကန့်သတ်ပါ**\n"
+        "❌ Admin က လက်ခံပြီးကြောင်း အတည်ပြုတဲ့အထိ commands တွေ အသုံးပြုလို့ မရပါ။\n\n"
+        "🔍 Admin မှ စစ်ဆေးပြီး 24 နာရီအတွင်း confirm လုပ်ပါမယ်။\n"
+        "✅ Approve ရပြီးမှ ပြန်လည် အသုံးပြုနိုင်ပါမယ်။\n"
+        "📞 ပြဿနာရှိရင် admin ကို ဆက်သွယ်ပါ။"
+    )
+    register_template(
+        "copy_kpay",
+        f"📱 **{kpay['label']} Number**\n\n"
+        f"`{kpay['number']}`\n\n"
+        f"👤 Name: **{kpay['name']}**\n"
+        "📋 Number ကို အပေါ်မှ copy လုပ်ပါ"
+    )
+    register_template("copy_kpay_alert", f"📱 KPay Number copied! {kpay['number']}")
+    register_template(
+        "copy_wave",
+        f"📱 **{wave['label']} Number**\n\n"
+        f"`{wave['number']}`\n\n"
+        f"👤 Name: **{wave['name']}**\n"
+        "📋 Number ကို အပေါ်မှ copy လုပ်ပါ"
+    )
+    register_template("copy_wave_alert", f"📱 Wave Number copied! {wave['number']}")
+
+    build_price_template()
+
+    # AI assistant replies
+    register_template(
+        "ai_greeting",
+        "👋 မင်္ဂလာပါ! MLBB Diamond Top-up Bot မှ ကြိုဆိုပါတယ်!\n\n"
+        "🤖 AI Assistant နဲ့ စကားပြောနေပါတယ်\n"
+        "📱 Bot commands များ သုံးရန် `/start` နှိပ်ပါ\n"
+        "🔊 AI နဲ့ ပိုများ စကားပြောချင်ရင် `/aistart` နှိပ်ပါ"
+    )
+
+    register_template(
+        "ai_help",
+        "🤖 **AI Assistant အကူအညီ** 🤖\n\n"
+        "📱 **အသုံးပြုနိုင်တဲ့ commands:**\n"
+        "• `/start` - Bot စတင်အသုံးပြုရန်\n"
+        "• `/mmb gameid serverid amount` - Diamond ဝယ်ယူရန်\n"
+        "• `/balance` - လက်ကျန်ငွေ စစ်ရန်\n"
+        "• `/topup amount` - ငွေဖြည့်ရန်\n"
+        "• `/price` - ဈေးနှုန်းများ ကြည့်ရန်\n"
+        "• `/history` - မှတ်တမ်းများ ကြည့်ရန်\n"
+        "• `/aistart` - AI နဲ့ စကားပြောရန်\n"
+        "• `/stopai` - AI ကို ရပ်ရန်\n\n"
+        "💡 အသေးစိတ် လိုအပ်ရင် admin ကို ဆက်သွယ်ပါ!"
+    )
+
+    register_template(
+        "ai_price",
+        "💎 **Diamond ဈေးနှုန်းများ** 💎\n\n"
+        "📊 လက်ရှိ ဈေးနှုန်းများ သိရှိလိုရင် `/price` command ကို သုံးပါ!\n\n"
+        "🔥 **အထူး ကမ်းလှမ်းချက်များ:**\n"
+        "• Weekly Pass: 6,500 MMK မှ\n"
+        "• Diamond 11: 950 MMK\n"
+        "• Diamond 86: 5,100 MMK\n"
+        "• အကြီးဆုံး 12976 Diamonds: 714,000 MMK\n\n"
+        "✨ မြန်ဆန်သော delivery - 5-30 မိနစ်!"
+    )
+
+    register_template(
+        "ai_diamond",
+        "💎 **MLBB Diamond Top-up Service** 💎\n\n"
+        "🎮 **လုပ်ဆောင်ချက်များ:**\n"
+        "• Weekly Pass မှ 12976 Diamonds အထိ\n"
+        "• ⚡ မြန်ဆန်သော delivery (5-30 မိနစ်)\n"
+        "• 💳 အလွယ်တကူ ငွေဖြည့်မှု\n"
+        "• 🔒 လုံခြုံသော transaction\n"
+        "• 24/7 Customer Support\n\n"
+        "📝 **မှာယူနည်း:**\n"
+        "`/mmb gameid serverid amount`\n\n"
+        "**ဥပမာ:** `/mmb 123456789 12345 wp1`"
+    )
+
+    register_template(
+        "ai_topup",
+        "💳 **ငွေဖြည့်လုပ်ငန်းစဉ်** 💳\n\n"
+        "🔢 **အဆင့်များ:**\n"
+        "1️⃣ `/topup amount` ရေးပါ (အနည်းဆုံး 1,000 MMK)\n"
+        "2️⃣ KPay/Wave ကို ငွေလွှဲပါ\n"
+        "3️⃣ Payment Screenshot တင်ပါ\n"
+        "4️⃣ Admin confirm စောင့်ပါ (24 နာရီအတွင်း)\n\n"
+        "💰 **လက်ခံနိုင်တဲ့ Payment:**\n"
+        f"📱 {kpay['label']}: {kpay['number']}\n"
+        f"📱 {wave['label']}: {wave['number']}\n\n"
+        "✅ လက်ကျန်ငွေ စစ်ရန် `/balance` သုံးပါ!"
+    )
+
+    register_template(
+        "ai_error",
+        "🔧 **Technical Support** 🔧\n\n"
+        "❗ **အမှား/ပြဿနာ ရှိပါသလား?**\n\n"
+        "🔍 **စစ်ဆေးရမည့်အရာများ:**\n"
+        "• Command format မှန်ကန်စွာ ရေးထားမလား\n"
+        "• Bot အသုံးပြုခွင့် ရှိမရှိ\n"
+        "• လက်ကျန်ငွေ လုံလောက်မလား\n"
+        "• Account ban မဖြစ်နေမလား\n\n"
+        "🔄 **ဖြေရှင်းနည်းများ:**\n"
+        "• `/start` နှိပ်ပြီး ပြန်စမ်းကြည့်ပါ\n"
+        "• Admin ကို ဆက်သွယ်ပါ\n"
+        "• Bot restart စောင့်ပါ\n\n"
+        "📞 24/7 Support ရရှိနိုင်ပါတယ်!"
+    )
+
+    register_template(
+        "ai_payment",
+        "💳 **Payment Methods** 💳\n\n"
+        "📱 **KBZ Pay (KPay)**\n"
+        f"Number: `{kpay['number']}`\n"
+        f"Name: {kpay['name']}\n\n"
+        f"📱 **{wave['label']}**\n"
+        f"Number: `{wave['number']}`\n"
+        f"Name: {wave['name']}\n\n"
+        "⚠️ **လေ့လာရန်:**\n"
+        "• ငွေလွှဲပြီးရင် screenshot ကို တင်ပေးပါ\n"
+        "• Name မှန်ကန်စွာ လွှဲပေးပါ\n"
+        "• 24 နာရီအတွင်း confirm ရပါမယ်\n"
+        "• မမှန်ကန်သော transfer များကို လက်မခံပါ"
+    )
+
+    register_template(
+        "ai_game",
+        "🎮 **Mobile Legends: Bang Bang** 🎮\n\n"
+        "🔥 **ရပ်မနေပါနဲ့! ဒီကနေ diamonds တွေ ဝယ်ပါ!**\n\n"
+        "⚡ **အမြန်ဆုံး Service:**\n"
+        "• 5-30 မိနစ်အတွင်း delivery\n"
+        "• Account safety 100% guaranteed\n"
+        "• အတုမရှိ diamonds\n"
+        "• Ban risk မရှိပါ\n\n"
+        "💎 **ရရှိနိုင်တဲ့ Items:**\n"
+        "• Weekly Pass (wp1-wp10)\n"
+        "• Regular Diamonds (11-12976)\n"
+        "• 2X Diamond Pass\n\n"
+        "🎯 **Game ID နဲ့ Server ID သာ လိုအပ်ပါတယ်!**"
+    )
+
+    register_template(
+        "ai_thanks",
+        "😊 **ကျေးဇူးတင်ပါတယ်!** 🙏\n\n"
+        "🎉 MLBB Diamond Top-up Bot ကို အသုံးပြုအားပေးတဲ့အတွက် ကျေးဇူးအများကြီး တင်ပါတယ်!\n\n"
+        "💪 **ကျွန်တော်တို့ရဲ့ ကတိများ:**\n"
+        "• အမြန်ဆုံး service\n"
+        "• စိတ်ချရသော transaction\n"
+        "• 24/7 customer support\n"
+        "• အကောင်းဆုံး ဈေးနှုန်း\n\n"
+        "🎮 **Happy Gaming!** 🎮\n"
+        "မင်းရဲ့ MLBB journey မှာ ကျွန်တော်တို့လည်း ပါဝင်ခွင့်ရလို့ ဝမ်းသာပါတယ်!"
+    )
+
+    register_template(
+        "ai_bot",
+        "🤖 **Advanced Bot Features** 🤖\n\n"
+        "🚀 **AI-Powered Assistant:**\n"
+        "• Intelligent conversation\n"
+        "• 24/7 customer support\n"
+        "• Multi-language support\n"
+        "• Smart problem solving\n\n"
+        "⚡ **Fast Processing:**\n"
+        "• Instant order processing\n"
+        "• Real-time balance updates\n"
+        "• Quick payment confirmation\n"
+        "• Auto delivery system\n\n"
+        "🔒 **Security Features:**\n"
+        "• Secure payment system\n"
+        "• User authorization\n"
+        "• Transaction history\n"
+        "• Admin monitoring\n\n"
+        "💡 `/aistart` နဲ့ AI နဲ့ ပိုများ စကားပြောနိုင်ပါတယ်!"
+    )
+
+    register_template(
+        "ai_order",
+        "🛒 **Order Management System** 🛒\n\n"
+        "📋 **မှာယူနည်း:**\n"
+        "`/mmb gameid serverid amount`\n\n"
+        "**ဥပမာများ:**\n"
+        "• `/mmb 123456789 12345 wp1` (Weekly Pass)\n"
+        "• `/mmb 123456789 12345 86` (86 Diamonds)\n"
+        "• `/mmb 123456789 12345 1412` (1412 Diamonds)\n\n"
+        "✅ **Order Status များ:**\n"
+        "• Processing: အတည်ပြုနေဆဲ\n"
+        "• Completed: ပြီးမြောက်ပြီ\n\n"
+        "📊 Order history ကြည့်ရန် `/history` သုံးပါ\n"
+        "💳 လက်ကျန်ငွေ စစ်ရန် `/balance` သုံးပါ"
+    )
+
+    register_template(
+        "ai_time",
+        "⏰ **Delivery Time Information** ⏰\n\n"
+        "🚀 **မြန်ဆန်သော Service:**\n"
+        "• Normal Orders: 5-30 မিနစ်\n"
+        "• Peak Hours: 15-45 မိနစ်\n"
+        "• Weekend: 10-60 မိနစ်\n\n"
+        "📈 **အချိန်သက်သေများ:**\n"
+        "• 95% orders delivered within 30 minutes\n"
+        "• Average delivery time: 15 minutes\n"
+        "• Fastest delivery: 3 minutes\n\n"
+        "⚡ **မြန်ဆန်အောင် လုပ်နည်း:**\n"
+        "• လက်ကျန်ငွေ အလုံအလောက် ရှိအောင်\n"
+        "• Game ID နဲ့ Server ID မှန်ကန်အောင်\n"
+        "• Peak time မဟုတ်တဲ့အချိန် မှာယူခြင်း"
+    )
+
+    register_template(
+        "ai_default_1",
+        "🤖 **AI Assistant** လေ့လာနေပါသေးတယ်!\n\n"
+        "💭 သင့်မေးခွန်းကို ကောင်းကောင်း နားမလည်သေးပါ။\n\n"
+        "💡 **လုပ်နိုင်တာများ:**\n"
+        "• `/start` - Bot commands ကြည့်ရန်\n"
+        "• `/aistart` - AI နဲ့ ပြောဆိုရန်\n"
+        "• `/help` - အကူညီရယူရန်\n\n"
+        "🙋‍♂️ Admin ကို ဆက်သွယ်လည်း ရပါတယ်!"
+    )
+
+    register_template(
+        "ai_default_2",
+        "🎯 **သင့်မေးခွန်းကို ပိုရှင်းပြပေးပါ!**\n\n"
+        "🤖 AI က အောက်ပါအကြောင်းအရာများကို နားလည်ပါတယ်:\n"
+        "• MLBB Diamond orders\n"
+        "• Payment methods\n"
+        "• Bot commands\n"
+        "• Technical support\n"
+        "• Price information\n\n"
+        "💬 ပိုရှင်းပြပြီး ပြန်မေးကြည့်ပါ!"
+    )
+
+    register_template(
+        "ai_default_3",
+        "🌟 **AI Learning Mode** 🌟\n\n"
+        "🧠 သင့်မေးခွန်းကနေ သင်ယူနေပါတယ်!\n\n"
+        "📚 **အောက်ပါ keywords တွေ သုံးကြည့်ပါ:**\n"
+        "• 'diamond' - Diamond အကြောင်း\n"
+        "• 'price' - ဈေးနှုန်းများ\n"
+        "• 'help' - အကူညီ\n"
+        "• 'topup' - ငွေဖြည့်ခြင်း\n"
+        "• 'order' - အော်ဒါများ\n\n"
+        "🎮 MLBB နဲ့ ဆိုင်တဲ့ ဘာမဆို မေးလို့ရပါတယ်!"
+    )
+
+# Keyword intents for ai_reply() in priority order (first intent wins).
+# An intents.json file ({"intents": [...]}) with the same shape overrides this;
+# entries there may also carry a "reply" text for new intents.
+DEFAULT_INTENTS = [
+    {"intent": "greeting", "keywords": ["hello", "hi", "မင်္ဂလာပါ", "ဟယ်လို", "ဟိုင်း", "ကောင်းလား"]},  # Greetings
+    {"intent": "help", "keywords": ["help", "ကူညီ", "အကူအညီ", "မသိ", "လမ်းညွှန်"]},  # Help requests
+    {"intent": "price", "keywords": ["price", "ဈေး", "နှုန်း", "ကြေး", "စျေး"]},  # Price inquiries
+    {"intent": "diamond", "keywords": ["diamond", "မှတ်တံ", "ရတနာ", "ဒိုင်မွန်"]},  # Diamond related
+    {"intent": "topup", "keywords": ["topup", "ငွေဖြည့်", "ငွေထည့်", "balance", "လက်ကျန်"]},  # Topup related
+    {"intent": "error", "keywords": ["error", "problem", "ပြဿနာ", "အမှား", "မရ", "ရမလာ"]},  # Error/Problem related
+    {"intent": "payment", "keywords": ["kpay", "wave", "ငွေလွှဲ", "payment", "pay"]},  # Payment methods
+    {"intent": "game", "keywords": ["mlbb", "mobile legend", "mobile legends", "game", "ဂိမ်း"]},  # Game related
+    {"intent": "thanks", "keywords": ["thanks", "thank you", "ကျေးဇူး", "ကျေးဇူးတင်", "အားပေး"]},  # Thanks/Appreciation
+    {"intent": "bot", "keywords": ["bot", "ဘော့", "feature", "လုပ်ဆောင်ချက်"]},  # Bot features
+    {"intent": "order", "keywords": ["order", "အော်ဒါ", "မှာ", "ဝယ်"]},  # Order related
+    {"intent": "time", "keywords": ["အချိန်", "time", "နာရီ", "မိနစ်", "မြန်", "ဖြန့်ခြင်း"]}  # Time related
+]
+
+# Compiled keyword matcher, built by build_intent_matcher()
+intent_matcher = {
+    "pattern": None,
+    "keyword_priority": {},
+    "intents": []
+}
+
+def load_intents():
+    """Load the intent table from INTENTS_FILE, falling back to DEFAULT_INTENTS"""
+    if not os.path.exists(INTENTS_FILE):
+        return DEFAULT_INTENTS
+    with open(INTENTS_FILE, "r") as f:
+        return json.load(f)["intents"]
+
+def build_intent_matcher(intents=None):
+    """Compile every intent keyword into one regex (run at startup)"""
+    if intents is None:
+        intents = load_intents()
+
+    if not MESSAGE_TEMPLATES:
+        build_templates()
+
+    keyword_priority = {}
+    valid = []
+    for entry in intents:
+        intent = entry.get("intent")
+        if not intent or not entry.get("keywords"):
+            print(f"⚠️ Skipping intent without a name or keywords: {entry!r}")
+            continue
+        if entry.get("reply"):
+            register_template(f"ai_{intent}", entry["reply"])
+        elif (f"ai_{intent}", DEFAULT_LANG) not in MESSAGE_TEMPLATES:
+            print(f"⚠️ Skipping intent {intent!r}: no reply")
+            continue
+        priority = len(valid)
+        valid.append(intent)
+        for word in entry["keywords"]:
+            keyword_priority.setdefault(word.lower(), priority)
+
+    # Alternatives are ordered by priority, so a match at any position is the
+    # highest-priority keyword starting there
+    keywords = sorted(keyword_priority, key=lambda w: (keyword_priority[w], -len(w)))
+    pattern = None
+    if keywords:
+        pattern = re.compile("|".join(re.escape(w) for w in keywords))
+
+    intent_matcher["pattern"] = pattern
+    intent_matcher["keyword_priority"] = keyword_priority
+    intent_matcher["intents"] = valid
+
+def match_intent(message_text):
+    """Return the highest-priority intent whose keyword occurs in the message"""
+    if not intent_matcher["intents"]:
+        build_intent_matcher()
+    pattern = intent_matcher["pattern"]
+    if pattern is None:
+        return None
+
+    # Resume one character after each hit (not after its end) so keywords
+    # overlapping an earlier hit are still seen
+    keyword_priority = intent_matcher["keyword_priority"]
+    message_lower = message_text.lower()
+    best = None
+    match = pattern.search(message_lower)
+    while match:
+        priority = keyword_priority[match.group()]
+        if best is None or priority < best:
+            best = priority
+            if best == 0:
+                break
+        match = pattern.search(message_lower, match.start() + 1)
+
+    if best is None:
+        return None
+    return intent_matcher["intents"][best]
+
+# Character n-gram TF-IDF model for the "classifier" AI backend,
+# built by train_intent_classifier()
+intent_classifier = {
+    "intents": [],
+    "idf": {},
+    "vocab": {},
+    "matrix": None,
+    "postings": {}
+}
+
+def char_ngrams(text, sizes=(2, 3, 4)):
+    """Count character n-grams of a whitespace-normalized, lowercased text"""
+    text = " " + " ".join(text.lower().split()) + " "
+    grams = {}
+    for n in sizes:
+        for i in range(len(text) - n + 1):
+            gram = text[i:i + n]
+            grams[gram] = grams.get(gram, 0) + 1
+    return grams
+
+def tfidf_vector(grams, idf):
+    """Weight n-gram counts by sublinear TF * IDF and L2-normalize them"""
+    vector = {g: (1 + math.log(count)) * idf[g] for g, count in grams.items() if g in idf}
+    norm = math.sqrt(sum(w * w for w in vector.values()))
+    if norm:
+        vector = {g: w / norm for g, w in vector.items()}
+    return vector
+
+def train_intent_classifier(examples=None):
+    """Fit one TF-IDF centroid per intent from the labeled examples file"""
+    if examples is None:
+        if not os.path.exists(INTENT_EXAMPLES_FILE):
+            return False
+        with open(INTENT_EXAMPLES_FILE, "r") as f:
+            examples = json.load(f)["examples"]
+
+    docs = [(e["intent"], char_ngrams(e["text"])) for e in examples]
+    intents = list(dict.fromkeys(intent for intent, _ in docs))
+    intent_index = {intent: i for i, intent in enumerate(intents)}
+
+    doc_freq = {}
+    for _, grams in docs:
+        for gram in grams:
+            doc_freq[gram] = doc_freq.get(gram, 0) + 1
+    idf = {g: math.log((1 + len(docs)) / (1 + df)) + 1 for g, df in doc_freq.items()}
+
+    # Centroid = normalized sum of the intent's normalized example vectors
+    centroids = [{} for _ in intents]
+    for intent, grams in docs:
+        centroid = centroids[intent_index[intent]]
+        for gram, weight in tfidf_vector(grams, idf).items():
+            centroid[gram] = centroid.get(gram, 0.0) + weight
+    for i, centroid in enumerate(centroids):
+        norm = math.sqrt(sum(w * w for w in centroid.values())) or 1.0
+        centroids[i] = {g: w / norm for g, w in centroid.items()}
+
+    vocab = {gram: index for index, gram in enumerate(idf)}
+    matrix = None
+    postings = {}
+    if np is not None:
+        matrix = np.zeros((len(vocab), len(intents)), dtype=np.float32)
+        for i, centroid in enumerate(centroids):
+            for gram, weight in centroid.items():
+                matrix[vocab[gram], i] = weight
+    else:
+        for i, centroid in enumerate(centroids):
+            for gram, weight in centroid.items():
+                postings.setdefault(gram, []).append((i, weight))
+
+    intent_classifier["intents"] = intents
+    intent_classifier["idf"] = idf
+    intent_classifier["vocab"] = vocab
+    intent_classifier["matrix"] = matrix
+    intent_classifier["postings"] = postings
+    return True
+
+def classify_intent(message_text):
+    """Return (intent, cosine similarity) of the closest intent centroid"""
+    intents = intent_classifier["intents"]
+    if not intents:
+        return None, 0.0
+
+    vector = tfidf_vector(char_ngrams(message_text), intent_classifier["idf"])
+    if not vector:
+        return None, 0.0
+
+    if intent_classifier["matrix"] is not None:
+        vocab = intent_classifier["vocab"]
+        rows = np.fromiter((vocab[g] for g in vector), dtype=np.intp, count=len(vector))
+        weights = np.fromiter(vector.values(), dtype=np.float32, count=len(vector))
+        scores = weights @ intent_classifier["matrix"][rows]
+        best = int(scores.argmax())
+        return intents[best], float(scores[best])
+
+    scores = [0.0] * len(intents)
+    postings = intent_classifier["postings"]
+    for gram, weight in vector.items():
+        for i, centroid_weight in postings.get(gram, ()):
+            scores[i] += weight * centroid_weight
+    best = max(range(len(intents)), key=scores.__getitem__)
+    return intents[best], scores[best]
+
 def ai_reply(message_text):
     """
     Enhanced AI-like responses for common queries
     """
-    message_lower = message_text.lower()
-    
-    # Greetings
-    if any(word in message_lower for word in ["hello", "hi", "မင်္ဂလာပါ", "ဟယ်လို", "ဟိုင်း", "ကောင်းလား"]):
-        return ("👋 မင်္ဂလာပါ! MLBB Diamond Top-up Bot မှ ကြိုဆိုပါတယ်!\n\n"
-                "🤖 AI Assistant နဲ့ စကားပြောနေပါတယ်\n"
-                "📱 Bot commands များ သုံးရန် `/start` နှိပ်ပါ\n"
-                "🔊 AI နဲ့ ပိုများ စကားပြောချင်ရင် `/aistart` နှိပ်ပါ")
-    
-    # Help requests
-    elif any(word in message_lower for word in ["help", "ကူညီ", "အကူအညီ", "မသိ", "လမ်းညွှန်"]):
-        return ("🤖 **AI Assistant အကူအညီ** 🤖\n\n"
-                "📱 **အသုံးပြုနိုင်တဲ့ commands:**\n"
-                "• `/start` - Bot စတင်အသုံးပြုရန်\n"
-                "• `/mmb gameid serverid amount` - Diamond ဝယ်ယူရန်\n"
-                "• `/balance` - လက်ကျန်ငွေ စစ်ရန်\n"
-                "• `/topup amount` - ငွေဖြည့်ရန်\n"
-                "• `/price` - ဈေးနှုန်းများ ကြည့်ရန်\n"
-                "• `/history` - မှတ်တမ်းများ ကြည့်ရန်\n"
-                "• `/aistart` - AI နဲ့ စကားပြောရန်\n"
-                "• `/stopai` - AI ကို ရပ်ရန်\n\n"
-                "💡 အသေးစိတ် လိုအပ်ရင် admin ကို ဆက်သွယ်ပါ!")
-    
-    # Price inquiries
-    elif any(word in message_lower for word in ["price", "ဈေး", "နှုန်း", "ကြေး", "စျေး"]):
-        return ("💎 **Diamond ဈေးနှုန်းများ** 💎\n\n"
-                "📊 လက်ရှိ ဈေးနှုန်းများ သိရှိလိုရင် `/price` command ကို သုံးပါ!\n\n"
-                "🔥 **အထူး ကမ်းလှမ်းချက်များ:**\n"
-                "• Weekly Pass: 6,500 MMK မှ\n"
-                "• Diamond 11: 950 MMK\n"
-                "• Diamond 86: 5,100 MMK\n"
-                "• အကြီးဆုံး 12976 Diamonds: 714,000 MMK\n\n"
-                "✨ မြန်ဆန်သော delivery - 5-30 မိနစ်!")
-    
-    # Diamond related
-    elif any(word in message_lower for word in ["diamond", "မှတ်တံ", "ရတနာ", "ဒိုင်မွန်"]):
-        return ("💎 **MLBB Diamond Top-up Service** 💎\n\n"
-                "🎮 **လုပ်ဆောင်ချက်များ:**\n"
-                "• Weekly Pass မှ 12976 Diamonds အထိ\n"
-                "• ⚡ မြန်ဆန်သော delivery (5-30 မိနစ်)\n"
-                "• 💳 အလွယ်တကူ ငွေဖြည့်မှု\n"
-                "• 🔒 လုံခြုံသော transaction\n"
-                "• 24/7 Customer Support\n\n"
-                "📝 **မှာယူနည်း:**\n"
-                "`/mmb gameid serverid amount`\n\n"
-                "**ဥပမာ:** `/mmb 123456789 12345 wp1`")
-    
-    # Topup related
-    elif any(word in message_lower for word in ["topup", "ငွေဖြည့်", "ငွေထည့်", "balance", "လက်ကျန်"]):
-        return ("💳 **ငွေဖြည့်လုပ်ငန်းစဉ်** 💳\n\n"
-                "🔢 **အဆင့်များ:**\n"
-                "1️⃣ `/topup amount` ရေးပါ (အနည်းဆုံး 1,000 MMK)\n"
-                "2️⃣ KPay/Wave ကို ငွေလွှဲပါ\n"
-                "3️⃣ Payment Screenshot တင်ပါ\n"
-                "4️⃣ Admin confirm စောင့်ပါ (24 နာရီအတွင်း)\n\n"
-                "💰 **လက်ခံနိုင်တဲ့ Payment:**\n"
-                "📱 KBZ Pay: 09678786528\n"
-                "📱 Wave Money: 09673585480\n\n"
-                "✅ လက်ကျန်ငွေ စစ်ရန် `/balance` သုံးပါ!")
-    
-    # Error/Problem related
-    elif any(word in message_lower for word in ["error", "problem", "ပြဿနာ", "အမှား", "မရ", "ရမလာ"]):
-        return ("🔧 **Technical Support** 🔧\n\n"
-                "❗ **အမှား/ပြဿနာ ရှိပါသလား?**\n\n"
-                "🔍 **စစ်ဆေးရမည့်အရာများ:**\n"
-                "• Command format မှန်ကန်စွာ ရေးထားမလား\n"
-                "• Bot အသုံးပြုခွင့် ရှိမရှိ\n"
-                "• လက်ကျန်ငွေ လုံလောက်မလား\n"
-                "• Account ban မဖြစ်နေမလား\n\n"
-                "🔄 **ဖြေရှင်းနည်းများ:**\n"
-                "• `/start` နှိပ်ပြီး ပြန်စမ်းကြည့်ပါ\n"
-                "• Admin ကို ဆက်သွယ်ပါ\n"
-                "• Bot restart စောင့်ပါ\n\n"
-                "📞 24/7 Support ရရှိနိုင်ပါတယ်!")
-    
-    # Payment methods
-    elif any(word in message_lower for word in ["kpay", "wave", "ငွေလွှဲ", "payment", "pay"]):
-        return ("💳 **Payment Methods** 💳\n\n"
-                "📱 **KBZ Pay (KPay)**\n"
-                "Number: `09678786528`\n"
-                "Name: Ma May Phoo Wai\n\n"
-                "📱 **Wave Money**\n"
-                "Number: `09673585480`\n"
-                "Name: Nine Nine\n\n"
-                "⚠️ **လေ့လာရန်:**\n"
-                "• ငွေလွှဲပြီးရင် screenshot ကို တင်ပေးပါ\n"
-                "• Name မှန်ကန်စွာ လွှဲပေးပါ\n"
-                "• 24 နာရီအတွင်း confirm ရပါမယ်\n"
-                "• မမှန်ကန်သော transfer များကို လက်မခံပါ")
-    
-    # Game related
-    elif any(word in message_lower for word in ["mlbb", "mobile legend", "mobile legends", "game", "ဂိမ်း"]):
-        return ("🎮 **Mobile Legends: Bang Bang** 🎮\n\n"
-                "🔥 **ရပ်မနေပါနဲ့! ဒီကနေ diamonds တွေ ဝယ်ပါ!**\n\n"
-                "⚡ **အမြန်ဆုံး Service:**\n"
-                "• 5-30 မိနစ်အတွင်း delivery\n"
-                "• Account safety 100% guaranteed\n"
-                "• အတုမရှိ diamonds\n"
-                "• Ban risk မရှိပါ\n\n"
-                "💎 **ရရှိနိုင်တဲ့ Items:**\n"
-                "• Weekly Pass (wp1-wp10)\n"
-                "• Regular Diamonds (11-12976)\n"
-                "• 2X Diamond Pass\n\n"
-                "🎯 **Game ID နဲ့ Server ID သာ လိုအပ်ပါတယ်!**")
-    
-    # Thanks/Appreciation
-    elif any(word in message_lower for word in ["thanks", "thank you", "ကျေးဇူး", "ကျေးဇူးတင်", "အားပေး"]):
-        return ("😊 **ကျေးဇူးတင်ပါတယ်!** 🙏\n\n"
-                "🎉 MLBB Diamond Top-up Bot ကို အသုံးပြုအားပေးတဲ့အတွက် ကျေးဇူးအများကြီး တင်ပါတယ်!\n\n"
-                "💪 **ကျွန်တော်တို့ရဲ့ ကတိများ:**\n"
-                "• အမြန်ဆုံး service\n"
-                "• စိတ်ချရသော transaction\n"
-                "• 24/7 customer support\n"
-                "• အကောင်းဆုံး ဈေးနှုန်း\n\n"
-                "🎮 **Happy Gaming!** 🎮\n"
-                "မင်းရဲ့ MLBB journey မှာ ကျွန်တော်တို့လည်း ပါဝင်ခွင့်ရလို့ ဝမ်းသာပါတယ်!")
-    
-    # Bot features
-    elif any(word in message_lower for word in ["bot", "ဘော့", "feature", "လုပ်ဆောင်ချက်"]):
-        return ("🤖 **Advanced Bot Features** 🤖\n\n"
-                "🚀 **AI-Powered Assistant:**\n"
-                "• Intelligent conversation\n"
-                "• 24/7 customer support\n"
-                "• Multi-language support\n"
-                "• Smart problem solving\n\n"
-                "⚡ **Fast Processing:**\n"
-                "• Instant order processing\n"
-                "• Real-time balance updates\n"
-                "• Quick payment confirmation\n"
-                "• Auto delivery system\n\n"
-                "🔒 **Security Features:**\n"
-                "• Secure payment system\n"
-                "• User authorization\n"
-                "• Transaction history\n"
-                "• Admin monitoring\n\n"
-                "💡 `/aistart` နဲ့ AI နဲ့ ပိုများ စကားပြောနိုင်ပါတယ်!")
-    
-    # Order related
-    elif any(word in message_lower for word in ["order", "အော်ဒါ", "မှာ", "ဝယ်"]):
-        return ("🛒 **Order Management System** 🛒\n\n"
-                "📋 **မှာယူနည်း:**\n"
-                "`/mmb gameid serverid amount`\n\n"
-                "**ဥပမာများ:**\n"
-                "• `/mmb 123456789 12345 wp1` (Weekly Pass)\n"
-                "• `/mmb 123456789 12345 86` (86 Diamonds)\n"
-                "• `/mmb 123456789 12345 1412` (1412 Diamonds)\n\n"
-                "✅ **Order Status များ:**\n"
-                "• Processing: အတည်ပြုနေဆဲ\n"
-                "• Completed: ပြီးမြောက်ပြီ\n\n"
-                "📊 Order history ကြည့်ရန် `/history` သုံးပါ\n"
-                "💳 လက်ကျန်ငွေ စစ်ရန် `/balance` သုံးပါ")
-    
-    # Time related
-    elif any(word in message_lower for word in ["အချိန်", "time", "နာရီ", "မိနစ်", "မြန်", "ဖြန့်ခြင်း"]):
-        return ("⏰ **Delivery Time Information** ⏰\n\n"
-                "🚀 **မြန်ဆန်သော Service:**\n"
-                "• Normal Orders: 5-30 မিနစ်\n"
-                "• Peak Hours: 15-45 မိနစ်\n"
-                "• Weekend: 10-60 မိနစ်\n\n"
-                "📈 **အချိန်သက်သေများ:**\n"
-                "• 95% orders delivered within 30 minutes\n"
-                "• Average delivery time: 15 minutes\n"
-                "• Fastest delivery: 3 minutes\n\n"
-                "⚡ **မြန်ဆန်အောင် လုပ်နည်း:**\n"
-                "• လက်ကျန်ငွေ အလုံအလောက် ရှိအောင်\n"
-                "• Game ID နဲ့ Server ID မှန်ကန်အောင်\n"
-                "• Peak time မဟုတ်တဲ့အချိန် မှာယူခြင်း")
-    
+    intent = None
+    if AI_BACKEND == "classifier":
+        intent, confidence = classify_intent(message_text)
+        # Low-confidence guesses fall back to the keyword rules
+        if confidence < AI_CONFIDENCE:
+            intent = None
+
+    if not intent:
+        intent = match_intent(message_text)
+    # The classifier may know intents that have no reply template
+    if intent and (f"ai_{intent}", DEFAULT_LANG) in MESSAGE_TEMPLATES:
+        return get_template(f"ai_{intent}")
+
     # Default response with more personality
-    else:
-        responses = [
-            ("🤖 **AI Assistant** လေ့လာနေပါသေးတယ်!\n\n"
-             "💭 သင့်မေးခွန်းကို ကောင်းကောင်း နားမလည်သေးပါ။\n\n"
-             "💡 **လုပ်နိုင်တာများ:**\n"
-             "• `/start` - Bot commands ကြည့်ရန်\n"
-             "• `/aistart` - AI နဲ့ ပြောဆိုရန်\n"
-             "• `/help` - အကူညီရယူရန်\n\n"
-             "🙋‍♂️ Admin ကို ဆက်သွယ်လည်း ရပါတယ်!"),
-            
-            ("🎯 **သင့်မေးခွန်းကို ပိုရှင်းပြပေးပါ!**\n\n"
-             "🤖 AI က အောက်ပါအကြောင်းအရာများကို နားလည်ပါတယ်:\n"
-             "• MLBB Diamond orders\n"
-             "• Payment methods\n"
-             "• Bot commands\n"
-             "• Technical support\n"
-             "• Price information\n\n"
-             "💬 ပိုရှင်းပြပြီး ပြန်မေးကြည့်ပါ!"),
-            
-            ("🌟 **AI Learning Mode** 🌟\n\n"
-             "🧠 သင့်မေးခွန်းကနေ သင်ယူနေပါတယ်!\n\n"
-             "📚 **အောက်ပါ keywords တွေ သုံးကြည့်ပါ:**\n"
-             "• 'diamond' - Diamond အကြောင်း\n"
-             "• 'price' - ဈေးနှုန်းများ\n"
-             "• 'help' - အကူညီ\n"
-             "• 'topup' - ငွေဖြည့်ခြင်း\n"
-             "• 'order' - အော်ဒါများ\n\n"
-             "🎮 MLBB နဲ့ ဆိုင်တဲ့ ဘာမဆို မေးလို့ရပါတယ်!")
-        ]
-        import random
-        return random.choice(responses)
+    return get_template(random.choice(AI_DEFAULT_TEMPLATES))
 
 pending_topups = {}
 
@@ -373,31 +1639,358 @@ async def check_pending_topup(user_id):
 
 async def send_pending_topup_warning(update: Update):
     """Send pending topup warning message"""
-    await update.message.reply_text(
-        "⏳ **Pending Topup ရှိနေပါတယ်!**\n\n"
-        "❌ သင့်မှာ admin က approve မလုပ်သေးတဲ့ topup ရှိနေပါတယ်။\n\n"
-        "**လုပ်ရမည့်အရာများ**:\n"
-        "• Admin က topup ကို approve လုပ်ပေးတဲ့အထိ စောင့်ပါ\n"
-        "• Approve ရပြီးမှ command တွေကို ပြန်အသုံးပြုနိုင်ပါမယ်\n\n"
-        "📞 အရေးပေါ်ဆိုရင် admin ကို ဆက်သွယ်ပါ။\n"
-        "💡 `/balance` နဲ့ status စစ်ကြည့်နိုင်ပါတယ်။",
-        parse_mode="Markdown"
-    )
+    await update.effective_message.reply_text(get_template("pending_topup"), parse_mode="Markdown")
+
+def parse_flag_window(text):
+    """`02:00-03:00` -> (start, end) minutes of the day, or None"""
+    match = re.fullmatch(r"(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})", text)
+    if not match:
+        return None
+    h1, m1, h2, m2 = map(int, match.groups())
+    if h1 > 23 or h2 > 24 or m1 > 59 or m2 > 59 or (h2 == 24 and m2):
+        return None
+    start, end = h1 * 60 + m1, h2 * 60 + m2
+    return (start, end) if start != end else None
+
+def build_feature_flags(flags):
+    """Compile the saved flag config into bot_maintenance"""
+    bot_maintenance.clear()
+    for name in FEATURE_FLAGS:
+        config = flags.get(name, {})
+        off_minutes = bytearray(24 * 60)
+        for window in config.get("windows", []):
+            parsed = parse_flag_window(window) if isinstance(window, str) else None
+            if not parsed:
+                print(f"⚠️ Skipping invalid {name} flag window: {window!r}")
+                continue
+            start, end = parsed
+            # Windows may run past midnight, e.g. 23:30-00:30
+            for minute in range(start, end if end > start else end + 24 * 60):
+                off_minutes[minute % (24 * 60)] = 1
+        bot_maintenance[name] = {
+            "enabled": config.get("enabled", True),
+            "off_minutes": off_minutes,
+            "allow": frozenset(config.get("allow", []))
+        }
 
-async def check_maintenance_mode(command_type):
-    """Check if specific command type is in maintenance mode"""
-    return bot_maintenance.get(command_type, True)
+def is_feature_enabled(feature, user_id=None):
+    """Check a feature flag for a user right now in O(1)"""
+    flag = bot_maintenance.get(feature)
+    if not flag or user_id in flag["allow"]:
+        return True
+    now = datetime.now()
+    return flag["enabled"] and not flag["off_minutes"][now.hour * 60 + now.minute]
+
+def format_flag_status(feature):
+    config = load_data().get("flags", {}).get(feature, {})
+    status = "🟢 ဖွင့်ထား" if config.get("enabled", True) else "🔴 ပိတ်ထား"
+    if config.get("windows"):
+        status += f" | 🕑 ပိတ်ချိန်: {', '.join(config['windows'])}"
+    if config.get("allow"):
+        status += f" | 👥 {len(config['allow'])} users ခွင့်ပြု"
+    return status
 
 async def send_maintenance_message(update: Update, command_type):
     """Send maintenance mode message"""
-    if command_type == "orders":
-        msg = "🔧 **အော်ဒါ လုပ်ဆောင်ချက် ယာယီ ပိတ်ထားပါ**\n\nAdmin က ပြန်ဖွင့်ပေးတဲ့အခါ အသုံးပြုနိုင်ပါမယ်။"
-    elif command_type == "topups":
-        msg = "🔧 **ငွေဖြည့်လုပ်ဆောင်ချက် ယာယီ ပိတ်ထားပါ**\n\nAdmin က ပြန်ဖွင့်ပေးတဲ့အခါ အသုံးပြုနိုင်ပါမယ်။"
+    if command_type not in ("orders", "topups"):
+        command_type = "general"
+    await update.effective_message.reply_text(get_template(f"maintenance_{command_type}"))
+
+def prune_flood_state():
+    """Forget the least recently seen users to make room for a batch of new ones.
+
+    Evicting a batch at a time keeps a wave of fresh accounts at O(1) per
+    update; anyone still flooding was seen recently and stays tracked.
+    """
+    while len(flood_state) > FLOOD_MAX_TRACKED - FLOOD_EVICT_BATCH:
+        flood_state.popitem(last=False)
+
+def check_flood(user_id):
+    """Charge one token for an inbound update: returns "ok", "warn" or "drop" """
+    now = time.monotonic()
+    state = flood_state.get(user_id)
+    if state is not None:
+        flood_state.move_to_end(user_id)
     else:
-        msg = "🔧 **Bot ယာယီ Maintenance ဖြစ်နေပါတယ်**\n\nAdmin က ပြန်ဖွင့်ပေးတဲ့အခါ အသုံးပြုနိုင်ပါမယ်။"
-    
-    await update.message.reply_text(msg)
+        if len(flood_state) >= FLOOD_MAX_TRACKED:
+            prune_flood_state()
+        state = flood_state[user_id] = {
+            "tokens": float(FLOOD_BURST),
+            "updated": now,
+            "cooldown_until": 0.0,
+            "strikes": 0,
+            "last_strike": 0.0,
+            "dropped": 0
+        }
+
+    if state["cooldown_until"] > now:
+        state["dropped"] += 1
+        return "drop"
+
+    if state["strikes"] and now - state["last_strike"] > FLOOD_STRIKE_RESET:
+        state["strikes"] = 0
+
+    state["tokens"] = min(FLOOD_BURST, state["tokens"] + (now - state["updated"]) * FLOOD_RATE)
+    state["updated"] = now
+    if state["tokens"] >= 1:
+        state["tokens"] -= 1
+        return "ok"
+
+    # Bucket empty: start an escalating cooldown
+    cooldown = FLOOD_COOLDOWNS[min(state["strikes"], len(FLOOD_COOLDOWNS) - 1)]
+    state["strikes"] += 1
+    state["last_strike"] = now
+    state["cooldown_until"] = now + cooldown
+    state["dropped"] += 1
+    return "warn" if state["strikes"] <= FLOOD_SILENT_STRIKES else "drop"
+
+def get_flood_cooldown(user_id):
+    """Seconds left on a user's flood cooldown"""
+    state = flood_state.get(user_id)
+    if not state:
+        return 0
+    return max(0, int(state["cooldown_until"] - time.monotonic()))
+
+# Pre-dispatch access rules for user commands:
+# feature = feature flag the command needs besides "general", which every
+# user command needs; restricted = blocked while
+# waiting for screenshot approval, pending = blocked while a topup is pending
+COMMAND_ACCESS = {
+    "start": {"feature": None, "restricted": False, "pending": True},
+    "mmb": {"feature": "orders", "restricted": True, "pending": True},
+    "balance": {"feature": None, "restricted": True, "pending": True},
+    "topup": {"feature": "topups", "restricted": True, "pending": True},
+    "price": {"feature": None, "restricted": True, "pending": False},
+    "history": {"feature": None, "restricted": True, "pending": True},
+    "aistart": {"feature": None, "restricted": False, "pending": False},
+}
+
+# Staff roles: the permission names are admin command names (plus button
+# actions and "report_rebuild", which rewrites data.json). ADMIN_ID is always
+# "owner", which may do everything.
+VIEWER_PERMISSIONS = {"adminhelp", "report", "export", "floodtop", "bans", "reconcile", "sla"}
+ROLE_PERMISSIONS = {
+    "owner": {"*"},
+    "approver": VIEWER_PERMISSIONS | {"approve", "deduct", "refund", "reply", "report_rebuild"},
+    "fulfiller": VIEWER_PERMISSIONS | {"done", "reply", "sendgroup"},
+    "viewer": VIEWER_PERMISSIONS
+}
+
+# Admin command -> permission it needs (checked by access_gate)
+ADMIN_COMMAND_ACCESS = {
+    command: command for command in (
+        "approve", "deduct", "refund", "done", "reply", "authorize", "unauthorize", "sendgroup",
+        "maintenance", "setprice", "removeprice", "pricing", "adminhelp", "floodtop", "report",
+        "export", "broadcast", "ban", "unban", "bans", "staff", "reconcile", "sla"
+    )
+}
+
+# user_id -> role, and user_id -> permission set cached from it
+staff_roles = {}
+staff_permissions = {}
+
+def load_staff_roles():
+    """Load staff roles from data.json and rebuild the permission cache"""
+    staff_roles.clear()
+    staff_roles.update(load_data().get("staff", {}))
+    staff_permissions.clear()
+    for user_id, role in staff_roles.items():
+        staff_permissions[user_id] = frozenset(ROLE_PERMISSIONS.get(role, ()))
+
+def get_staff_role(user_id):
+    if int(user_id) == ADMIN_ID:
+        return "owner"
+    return staff_roles.get(str(user_id))
+
+def has_permission(user_id, permission):
+    """Check a staff permission in O(1)"""
+    if int(user_id) == ADMIN_ID:
+        return True
+    permissions = staff_permissions.get(str(user_id))
+    return bool(permissions) and ("*" in permissions or permission in permissions)
+
+def get_access_context(user_id):
+    """Build the user's access context from in-memory state"""
+    user_data = load_data()["users"].get(user_id, {})
+    return {
+        "user_id": user_id,
+        "authorized": is_user_authorized(user_id),
+        "restricted": user_states.get(user_id) == "waiting_approval",
+        "pending_topup": any(t.get("status") == "pending" for t in user_data.get("topups", [])),
+    }
+
+def get_access(context: ContextTypes.DEFAULT_TYPE, user_id):
+    """Return the access context computed by access_gate for this update"""
+    access = context.user_data.get("access") if context.user_data is not None else None
+    if not access or access["user_id"] != user_id:
+        access = get_access_context(user_id)
+    return access
+
+def get_idempotency_key(update: Update, command):
+    """`chat_id:message_id` for order/topup/balance updates, else None"""
+    message = update.message
+    if not message or not (command in IDEMPOTENT_COMMANDS or message.photo):
+        return None
+    return f"{message.chat_id}:{message.message_id}"
+
+def check_idempotency_key(key):
+    """Return ("new", None), ("running", None) or ("done", result) for a key"""
+    now = time.time()
+    store = load_data().get("idempotency", {})
+    entry = store.get(key)
+    if entry and entry[0] > now:
+        # Refresh as most recently used
+        store[key] = store.pop(key)
+        return "done", entry[1]
+
+    started = idempotency_inflight.get(key)
+    if started and now - started < IDEMPOTENCY_INFLIGHT_TTL:
+        return "running", None
+    idempotency_inflight[key] = now
+    return "new", None
+
+def remember_result(context: ContextTypes.DEFAULT_TYPE, result):
+    """Record this update's result in data.json; call right before save_data()"""
+    key = context.user_data.get("idempotency_key") if context.user_data is not None else None
+    if not key:
+        return
+    now = time.time()
+    store = load_data().setdefault("idempotency", {})
+    store[key] = [now + IDEMPOTENCY_TTL, result]
+
+    # Oldest entries come first: drop expired ones and keep the store bounded
+    while store:
+        oldest = next(iter(store))
+        if store[oldest][0] > now and len(store) <= IDEMPOTENCY_MAX_KEYS:
+            break
+        del store[oldest]
+
+async def idempotency_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Post-dispatch hook: the update's handler has finished"""
+    key = context.user_data.pop("idempotency_key", None) if context.user_data is not None else None
+    if key:
+        idempotency_inflight.pop(key, None)
+
+def get_command_name(message):
+    """Extract the lowercase command name from a /command@bot message"""
+    if not message or not message.text or not message.text.startswith("/"):
+        return None
+    return message.text.split()[0][1:].split("@")[0].lower()
+
+async def send_unauthorized_message(update: Update):
+    """Send the short 'not authorized' reply with the owner contact button"""
+    await update.effective_message.reply_text(get_template("unauthorized"), reply_markup=get_keyboard("contact_owner"))
+
+async def send_start_unauthorized_message(update: Update):
+    """Send the detailed 'not authorized' reply used by /start"""
+    user = update.effective_user
+    name = f"{user.first_name} {user.last_name or ''}".strip()
+    await update.effective_message.reply_text(
+        render_template("start_unauthorized", name=name, user_id=user.id),
+        parse_mode="Markdown",
+        reply_markup=get_keyboard("contact_owner")
+    )
+
+async def send_restricted_message(update: Update):
+    """Send the 'screenshot already sent' restriction reply"""
+    await update.effective_message.reply_text(get_template("restricted"), parse_mode="Markdown")
+
+async def check_access_rules(access, rules):
+    """Return why a command is blocked for this user, or None if it may run"""
+    if not access["authorized"]:
+        return "unauthorized"
+    if not is_feature_enabled("general", access["user_id"]):
+        return "general"
+    if rules["feature"] and not is_feature_enabled(rules["feature"], access["user_id"]):
+        return rules["feature"]
+    if rules["restricted"] and access["restricted"]:
+        return "restricted"
+    if rules["pending"] and access["pending_topup"]:
+        return "pending"
+    return None
+
+async def send_access_denied(update: Update, reason, command):
+    """Send the reply matching the reason returned by check_access_rules"""
+    if reason == "not_staff":
+        await update.effective_message.reply_text("❌ သင်သည် admin မဟုတ်ပါ!")
+    elif reason == "unauthorized":
+        if command == "start":
+            await send_start_unauthorized_message(update)
+        else:
+            await send_unauthorized_message(update)
+    elif reason == "restricted":
+        await send_restricted_message(update)
+    elif reason == "pending":
+        await send_pending_topup_warning(update)
+    else:
+        await send_maintenance_message(update, reason)
+
+async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+    """Log handler errors and drop anything the failed handler left unsaved"""
+    print(f"⚠️ Handler error: {context.error!r}")
+    _data_cache["data"] = None
+
+async def access_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Pre-dispatch gate: compute access once per update and stop blocked updates"""
+    user = update.effective_user
+    if not user:
+        return
+
+    started = time.perf_counter_ns()
+    user_id = str(user.id)
+
+    # Flood control runs before anything else so spam costs almost nothing
+    if not get_staff_role(user_id):
+        flood = check_flood(user_id)
+        if flood != "ok":
+            gate_stats["flood_dropped"] += 1
+            if flood == "warn":
+                text = render_template("flood_warning", seconds=get_flood_cooldown(user_id))
+                if update.callback_query:
+                    await update.callback_query.answer(text, show_alert=True)
+                elif update.effective_message:
+                    await update.effective_message.reply_text(text)
+            raise ApplicationHandlerStop
+
+    access = get_access_context(user_id)
+    context.user_data["access"] = access
+
+    command = None
+    reason = None
+    if update.callback_query:
+        if access["restricted"]:
+            reason = "restricted"
+    else:
+        # effective_message also covers edited messages
+        command = get_command_name(update.effective_message)
+        rules = COMMAND_ACCESS.get(command)
+        if rules:
+            reason = await check_access_rules(access, rules)
+        elif command in ADMIN_COMMAND_ACCESS and not has_permission(user_id, ADMIN_COMMAND_ACCESS[command]):
+            reason = "not_staff"
+
+    gate_stats["calls"] += 1
+    gate_stats["total_ns"] += time.perf_counter_ns() - started
+    if not reason:
+        # Redelivered/replayed money-moving messages never run twice
+        key = get_idempotency_key(update, command)
+        context.user_data["idempotency_key"] = key
+        if not key:
+            return
+        state, result = check_idempotency_key(key)
+        if state == "new":
+            return
+        context.user_data.pop("idempotency_key")
+        if result:
+            await update.message.reply_text(f"🔁 လုပ်ဆောင်ပြီးသားပါ:\n{result}")
+        raise ApplicationHandlerStop
+
+    gate_stats["blocked"] += 1
+    if update.callback_query:
+        await update.callback_query.answer("❌ Screenshot ပို့ပြီးပါပြီ! Admin approve စောင့်ပါ။", show_alert=True)
+    else:
+        await send_access_denied(update, reason, command)
+    raise ApplicationHandlerStop
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -405,37 +1998,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = user.username or "-"
     name = f"{user.first_name} {user.last_name or ''}".strip()
     
-    # Load authorized users
-    load_authorized_users()
-    
-    # Check if user is authorized
-    if not is_user_authorized(user_id):
-        # Create keyboard with Owner contact button
-        keyboard = [[InlineKeyboardButton("👑 Contact Owner", url=f"tg://user?id={ADMIN_ID}")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(
-            f"🚫 **Bot အသုံးပြုခွင့် မရှိပါ!**\n\n"
-            f"👋 မင်္ဂလာပါ `{name}`!\n"
-            f"🆔 Your ID: `{user_id}`\n\n"
-            "❌ သင်သည် ဤ bot ကို အသုံးပြုခွင့် မရှိသေးပါ။\n\n"
-            "**လုပ်ရမည့်အရာများ**:\n"
-            "• အောက်က 'Contact Owner' button ကို နှိပ်ပါ\n"
-            "• Owner ထံ bot အသုံးပြုခွင့် တောင်းဆိုပါ\n"
-            "• သင့် User ID ကို ပေးပို့ပါ\n\n"
-            "✅ Owner က approve လုပ်ပြီးမှ bot ကို အသုံးပြုနိုင်ပါမယ်။",
-            parse_mode="Markdown",
-            reply_markup=reply_markup
-        )
-        return
-
     data = load_data()
 
-    # Check for pending topups first
-    if await check_pending_topup(user_id):
-        await send_pending_topup_warning(update)
-        return
-
     if user_id not in data["users"]:
         data["users"][user_id] = {
             "name": name,
@@ -450,77 +2014,19 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if user_id in user_states:
         del user_states[user_id]
 
-    # Create keyboard with Owner contact button
-    keyboard = [[InlineKeyboardButton("👑 Contact Owner", url=f"tg://user?id={ADMIN_ID}")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    msg = (
-        f"👋 မင်္ဂလာပါ `{name}`!\n"
-        f"🆔 Telegram User ID: `{user_id}`\n\n"
-        "📱 MLBB Diamond Top-up Bot မှ ကြိုဆိုပါတယ်။\n\n"
-        "**အသုံးပြုနိုင်တဲ့ command များ**:\n"
-        "➤ `/mmb gameid serverid amount`\n"
-        "➤ `/balance` - ဘယ်လောက်လက်ကျန်ရှိလဲ စစ်မယ်\n"
-        "➤ `/topup amount` - ငွေဖြည့်မယ် (screenshot တင်ပါ)\n"
-        "➤ `/price` - Diamond များရဲ့ ဈေးနှုန်းများ\n"
-        "➤ `/history` - အော်ဒါမှတ်တမ်းကြည့်မယ်\n"
-        "➤ `/aistart` - AI နဲ့ စကားပြောမယ်\n"
-        "➤ `/stopai` - AI ကို ရပ်မယ်\n\n"
-        "**📌 ဥပမာ**:\n"
-        "`/mmb 123456789 12345 wp1`\n"
-        "`/mmb 123456789 12345 86`\n\n"
-        "လိုအပ်တာရှိရင် Owner ကို ဆက်သွယ်နိုင်ပါတယ်။ 😊"
+    await update.message.reply_text(
+        render_template("start_welcome", name=name, user_id=user_id),
+        parse_mode="Markdown",
+        reply_markup=get_keyboard("contact_owner")
     )
-    await update.message.reply_text(msg, parse_mode="Markdown", reply_markup=reply_markup)
 
 async def mmb_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     
-    # Check authorization
-    load_authorized_users()
-    if not is_user_authorized(user_id):
-        keyboard = [[InlineKeyboardButton("👑 Contact Owner", url=f"tg://user?id={ADMIN_ID}")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            "🚫 **အသုံးပြုခွင့် မရှိပါ!**\n\n"
-            "Owner ထံ bot အသုံးပြုခွင့် တောင်းဆိုပါ။",
-            reply_markup=reply_markup
-        )
-        return
-
-    # Check maintenance mode
-    if not await check_maintenance_mode("orders"):
-        await send_maintenance_message(update, "orders")
-        return
-
-    # Check if user is restricted after screenshot
-    if user_id in user_states and user_states[user_id] == "waiting_approval":
-        await update.message.reply_text(
-            "⏳ **Screenshot ပို့ပြီးပါပြီ!**\n\n"
-            "❌ Admin က လက်ခံပြီးကြောင်း အတည်ပြုတဲ့အထိ commands တွေ အသုံးပြုလို့ မရပါ။\n\n"
-            "⏰ Admin က approve လုပ်ပြီးမှ ပြန်လည် အသုံးပြုနိုင်ပါမယ်။\n"
-            "📞 အရေးပေါ်ဆိုရင် admin ကို ဆက်သွယ်ပါ။",
-            parse_mode="Markdown"
-        )
-        return
-
-    # Check for pending topups first
-    if await check_pending_topup(user_id):
-        await send_pending_topup_warning(update)
-        return
-
     args = context.args
 
     if len(args) != 3:
-        await update.message.reply_text(
-            "❌ အမှားရှိပါတယ်!\n\n"
-            "**မှန်ကန်တဲ့ format**:\n"
-            "`/mmb gameid serverid amount`\n\n"
-            "**ဥပမာ**:\n"
-            "`/mmb 123456789 12345 wp1`\n"
-            "`/mmb 123456789 12345 86`",
-            parse_mode="Markdown"
-        )
+        await update.message.reply_text(get_template("mmb_usage"), parse_mode="Markdown")
         return
 
     game_id, server_id, amount = args
@@ -549,8 +2055,32 @@ async def mmb_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
+    price = get_price(amount, user_id)
+
+    if not price:
+        await update.message.reply_text(
+            "❌ Diamond amount မှားနေပါတယ်!\n\n"
+            "**ရရှိနိုင်တဲ့ amounts**:\n"
+            "• Weekly Pass: wp1-wp10\n"
+            "• Diamonds: 11, 22, 33, 56, 86, 112, 172, 257, 343, 429, 514, 600, 706, 878, 963, 1049, 1135, 1412, 2195, 3688, 5532, 9288, 12976",
+            parse_mode="Markdown"
+        )
+        return
+
+    # Look up the account (cached; skipped when GAME_ID_VERIFIER is off)
+    account = await verify_game_account(game_id, server_id)
+    if account and not account["exists"]:
+        await update.message.reply_text(
+            "❌ **Account ရှာမတွေ့ပါ!**\n\n"
+            f"🎮 Game ID: `{game_id}`\n"
+            f"🌐 Server ID: `{server_id}`\n\n"
+            "🔄 Game ID နဲ့ Server ID ကို ပြန်စစ်ပြီး ထပ်ကြိုးစားပါ။",
+            parse_mode="Markdown"
+        )
+        return
+
     # Check if account is banned
-    if is_banned_account(game_id):
+    if is_banned_account(game_id, server_id) or (account and account["banned"]):
         await update.message.reply_text(
             "🚫 **Account Ban ဖြစ်နေပါတယ်!**\n\n"
             f"🎮 Game ID: `{game_id}`\n"
@@ -584,17 +2114,8 @@ async def mmb_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         return
 
-    price = get_price(amount)
-
-    if not price:
-        await update.message.reply_text(
-            "❌ Diamond amount မှားနေပါတယ်!\n\n"
-            "**ရရှိနိုင်တဲ့ amounts**:\n"
-            "• Weekly Pass: wp1-wp10\n"
-            "• Diamonds: 11, 22, 33, 56, 86, 112, 172, 257, 343, 429, 514, 600, 706, 878, 963, 1049, 1135, 1412, 2195, 3688, 5532, 9288, 12976",
-            parse_mode="Markdown"
-        )
-        return
+    nickname = account["nickname"].replace("`", "'") if account and account.get("nickname") else None
+    nickname_line = f"👤 Nickname: `{nickname}`\n" if nickname else ""
 
     data = load_data()
     user_balance = data["users"].get(user_id, {}).get("balance", 0)
@@ -621,11 +2142,21 @@ async def mmb_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "status": "processing",
         "timestamp": datetime.now().isoformat()
     }
+    if nickname:
+        order["nickname"] = nickname
+    if fulfilment_state["queue"] is not None:
+        order["fulfilment"] = FULFILMENT_PROVIDER
 
     # Deduct balance
-    data["users"][user_id]["balance"] -= price
+    post_ledger(data, f"user:{user_id}", "sales", price, "order", order_id)
     data["users"][user_id]["orders"].append(order)
+    index_order(order_id, user_id, len(data["users"][user_id]["orders"]) - 1)
+    track_sla(f"o{user_id}:{len(data['users'][user_id]['orders']) - 1}", order["timestamp"])
+    record_order_stats(data, user_id, order)
+    remember_result(context, f"Order {order_id} - {amount} ({price:,} MMK)")
     save_data(data)
+    if order.get("fulfilment"):
+        enqueue_fulfilment(f"o{user_id}:{len(data['users'][user_id]['orders']) - 1}")
 
     # Notify admin
     admin_msg = (
@@ -635,6 +2166,7 @@ async def mmb_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"🆔 User ID: `{user_id}`\n"
         f"🎮 Game ID: `{game_id}`\n"
         f"🌐 Server ID: `{server_id}`\n"
+        f"{nickname_line}"
         f"💎 Amount: {amount}\n"
         f"💰 Price: {price:,} MMK\n"
         f"⏰ Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
@@ -646,13 +2178,17 @@ async def mmb_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         pass
 
     # Notify admin group
-    await notify_group_order(order, update.effective_user.first_name or "Unknown")
+    await notify_group_order(
+        context.bot, order, update.effective_user.first_name or "Unknown",
+        user_id, len(data["users"][user_id]["orders"]) - 1
+    )
 
     await update.message.reply_text(
         f"✅ **အော်ဒါ အောင်မြင်ပါပြီ!**\n\n"
         f"📝 Order ID: `{order_id}`\n"
         f"🎮 Game ID: `{game_id}`\n"
         f"🌐 Server ID: `{server_id}`\n"
+        f"{nickname_line}"
         f"💎 Diamond: {amount}\n"
         f"💰 ကုန်ကျစရိတ်: {price:,} MMK\n"
         f"💳 လက်ကျန်ငွေ: {data['users'][user_id]['balance']:,} MMK\n\n"
@@ -664,34 +2200,6 @@ async def mmb_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def balance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     
-    # Check authorization
-    load_authorized_users()
-    if not is_user_authorized(user_id):
-        keyboard = [[InlineKeyboardButton("👑 Contact Owner", url=f"tg://user?id={ADMIN_ID}")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            "🚫 **အသုံးပြုခွင့် မရှိပါ!**\n\n"
-            "Owner ထံ bot အသုံးပြုခွင့် တောင်းဆိုပါ။",
-            reply_markup=reply_markup
-        )
-        return
-
-    # Check if user is restricted after screenshot
-    if user_id in user_states and user_states[user_id] == "waiting_approval":
-        await update.message.reply_text(
-            "⏳ **Screenshot ပို့ပြီးပါပြီ!**\n\n"
-            "❌ Admin က လက်ခံပြီးကြောင်း အတည်ပြုတဲ့အထိ commands တွေ အသုံးပြုလို့ မရပါ။\n\n"
-            "⏰ Admin က approve လုပ်ပြီးမှ ပြန်လည် အသုံးပြုနိုင်ပါမယ်။\n"
-            "📞 အရေးပေါ်ဆိုရင် admin ကို ဆက်သွယ်ပါ။",
-            parse_mode="Markdown"
-        )
-        return
-
-    # Check for pending topups first
-    if await check_pending_topup(user_id):
-        await send_pending_topup_warning(update)
-        return
-
     data = load_data()
     user_data = data["users"].get(user_id)
 
@@ -724,10 +2232,6 @@ async def balance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if pending_topups_count > 0:
         status_msg = f"\n⏳ **Pending Topups**: {pending_topups_count} ခု ({pending_amount:,} MMK)\n❗ Diamond order ထားလို့မရပါ။ Admin approve စောင့်ပါ။"
 
-    # Create inline keyboard with topup button
-    keyboard = [[InlineKeyboardButton("💳 ငွေဖြည့်မယ်", callback_data="topup_button")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     await update.message.reply_text(
         f"💳 **သင့်ရဲ့ Account အချက်အလက်များ**\n\n"
         f"💰 လက်ကျန်ငွေ: `{balance:,} MMK`\n"
@@ -736,61 +2240,19 @@ async def balance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"👤 နာမည်: {name}\n"
         f"🆔 Username: @{username}",
         parse_mode="Markdown",
-        reply_markup=reply_markup
+        reply_markup=get_keyboard("topup")
     )
 
 async def topup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     
-    # Check authorization
-    load_authorized_users()
-    if not is_user_authorized(user_id):
-        keyboard = [[InlineKeyboardButton("👑 Contact Owner", url=f"tg://user?id={ADMIN_ID}")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            "🚫 **အသုံးပြုခွင့် မရှိပါ!**\n\n"
-            "Owner ထံ bot အသုံးပြုခွင့် တောင်းဆိုပါ။",
-            reply_markup=reply_markup
-        )
-        return
-
-    # Check maintenance mode
-    if not await check_maintenance_mode("topups"):
-        await send_maintenance_message(update, "topups")
-        return
-
-    # Check if user is restricted after screenshot
-    if user_id in user_states and user_states[user_id] == "waiting_approval":
-        await update.message.reply_text(
-            "⏳ **Screenshot ပို့ပြီးပါပြီ!**\n\n"
-            "❌ Admin က လက်ခံပြီးကြောင်း အတည်ပြုတဲ့အထိ commands တွေ အသုံးပြုလို့ မရပါ။\n\n"
-            "⏰ Admin က approve လုပ်ပြီးမှ ပြန်လည် အသုံးပြုနိုင်ပါမယ်။\n"
-            "📞 အရေးပေါ်ဆိုရင် admin ကို ဆက်သွယ်ပါ။",
-            parse_mode="Markdown"
-        )
-        return
-
-    # Check for pending topups first
-    if await check_pending_topup(user_id):
-        await send_pending_topup_warning(update)
-        return
-
     args = context.args
 
     if not args:
-        # Create payment buttons
-        keyboard = [
-            [InlineKeyboardButton("📱 Copy KPay Number", callback_data="copy_kpay")],
-            [InlineKeyboardButton("📱 Copy Wave Number", callback_data="copy_wave")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         await update.message.reply_text(
-            "❌ ငွေပမာဏ ထည့်ပါ!\n\n"
-            "**ဥပမာ**: `/topup 50000`\n\n"
-            "💳 ငွေလွှဲရန် အောက်က buttons များကို သုံးပါ။",
+            get_template("topup_missing_amount"),
             parse_mode="Markdown",
-            reply_markup=reply_markup
+            reply_markup=get_keyboard("payment")
         )
         return
 
@@ -809,149 +2271,134 @@ async def topup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "timestamp": datetime.now().isoformat()
     }
 
-    # Create payment buttons
-    keyboard = [
-        [InlineKeyboardButton("📱 Copy KPay Number", callback_data="copy_kpay")],
-        [InlineKeyboardButton("📱 Copy Wave Number", callback_data="copy_wave")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     await update.message.reply_text(
-        f"💳 **ငွေဖြည့်လုပ်ငန်းစဉ်**\n\n"
-        f"💰 ပမာဏ: `{amount:,} MMK`\n\n"
-        "**လွှဲရမည့် Account များ**:\n"
-        "📱 KBZ Pay: `09678786528`\n"
-        "Name - **Ma May Phoo Wai**\n"
-        "📱 Wave Money: `09673585480`\n"
-        "Name - **Nine Nine**\n"
-        "🏦 CB Bank: အသုံးပြုစဲမရှိသေးပါ\n\n"
-        "💸 ငွေလွှဲပြီးရင် screenshot ကို ဒီမှာ တင်ပေးပါ။\n"
-        "⏰ 24 နာရီအတွင်း confirm လုပ်ပါမယ်။",
+        render_template("topup_instructions", amount=amount),
         parse_mode="Markdown",
-        reply_markup=reply_markup
+        reply_markup=get_keyboard("payment")
     )
 
 async def price_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
-    
-    # Check authorization
-    load_authorized_users()
-    if not is_user_authorized(user_id):
-        keyboard = [[InlineKeyboardButton("👑 Contact Owner", url=f"tg://user?id={ADMIN_ID}")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            "🚫 **အသုံးပြုခွင့် မရှိပါ!**\n\n"
-            "Owner ထံ bot အသုံးပြုခွင့် တောင်းဆိုပါ။",
-            reply_markup=reply_markup
-        )
-        return
+    refresh_price_engine()
+
+    group = get_price_group(user_id)
+    msg = price_engine["notes"].get(group, "")
+    discount = get_volume_discount(group, user_id)
+    if discount:
+        msg += f"📈 Volume discount: **{discount}%** ထပ်လျှော့ပါတယ်\n\n"
+    await update.message.reply_text(msg + get_template("price"), parse_mode="Markdown")
+
+# Records per /history page
+HISTORY_PAGE_SIZE = 5
+
+# /history status filters and the record list each one applies to
+HISTORY_STATUSES = {
+    "processing": "orders",
+    "completed": "orders",
+    "refunded": "orders",
+    "failed": "orders",
+    "pending": "topups",
+    "approved": "topups",
+    "rejected": "topups"
+}
 
-    # Check if user is restricted after screenshot
-    if user_id in user_states and user_states[user_id] == "waiting_approval":
-        await update.message.reply_text(
-            "⏳ **Screenshot ပို့ပြီးပါပြီ!**\n\n"
-            "❌ Admin က လက်ခံပြီးကြောင်း အတည်ပြုတဲ့အထိ commands တွေ အသုံးပြုလို့ မရပါ။\n\n"
-            "⏰ Admin က approve လုပ်ပြီးမှ ပြန်လည် အသုံးပြုနိုင်ပါမယ်။\n"
-            "📞 အရေးပေါ်ဆိုရင် admin ကို ဆက်သွယ်ပါ။",
-            parse_mode="Markdown"
-        )
-        return
+def encode_history_cursor(kind, status, direction, index):
+    """Pack a history page position into callback_data, e.g. `h:oc:o1f` (older than index 0x1f)"""
+    return f"h:{kind[0]}{status[0] if status else '-'}:{direction}{index:x}"
 
-    # Get custom prices
-    custom_prices = load_prices()
-    
-    price_msg = (
-        "💎 **MLBB Diamond ဈေးနှုန်းများ**\n\n"
-        "🎟️ **Weekly Pass**:\n"
-        "• wp1 = 6,500 MMK\n"
-        "• wp2 = 13,000 MMK\n"
-        "• wp3 = 19,500 MMK\n"
-        "• wp4 = 26,000 MMK\n"
-        "• wp5 = 32,500 MMK\n"
-        "• wp6 = 39,000 MMK\n"
-        "• wp7 = 45,500 MMK\n"
-        "• wp8 = 52,000 MMK\n"
-        "• wp9 = 58,500 MMK\n"
-        "• wp10 = 65,000 MMK\n\n"
-        "💎 **Regular Diamonds**:\n"
-        "• 11 = 950 MMK\n"
-        "• 22 = 1,900 MMK\n"
-        "• 33 = 2,850 MMK\n"
-        "• 56 = 4,200 MMK\n"
-        "• 86 = 5,100 MMK\n"
-        "• 112 = 8,200 MMK\n"
-        "• 172 = 10,200 MMK\n"
-        "• 257 = 15,300 MMK\n"
-        "• 343 = 20,400 MMK\n"
-        "• 429 = 25,500 MMK\n"
-        "• 514 = 30,600 MMK\n"
-        "• 600 = 35,700 MMK\n"
-        "• 706 = 40,800 MMK\n"
-        "• 878 = 51,000 MMK\n"
-        "• 963 = 56,100 MMK\n"
-        "• 1049 = 61,200 MMK\n"
-        "• 1135 = 66,300 MMK\n"
-        "• 1412 = 81,600 MMK\n"
-        "• 2195 = 122,400 MMK\n"
-        "• 3688 = 204,000 MMK\n"
-        "• 5532 = 306,000 MMK\n"
-        "• 9288 = 510,000 MMK\n"
-        "• 12976 = 714,000 MMK\n\n"
-        "💎 **2X Diamond Pass**:\n"
-        "• 55 = 3,500 MMK\n"
-        "• 165 = 10,000 MMK\n"
-        "• 275 = 16,000 MMK\n"
-        "• 565 = 33,000 MMK\n\n"
-    )
-    
-    # Add custom prices if any
-    if custom_prices:
-        price_msg += "🔥 **Special Prices**:\n"
-        for item, price in custom_prices.items():
-            price_msg += f"• {item} = {price:,} MMK\n"
-        price_msg += "\n"
-    
-    price_msg += (
-        "**📝 အသုံးပြုနည်း**:\n"
-        "`/mmb gameid serverid amount`\n\n"
-        "**ဥပမာ**:\n"
-        "`/mmb 123456789 12345 wp1`\n"
-        "`/mmb 123456789 12345 86`"
+def decode_history_cursor(cursor):
+    """Unpack encode_history_cursor(); returns None for unknown cursors"""
+    try:
+        _, filters_part, position = cursor.split(":")
+        kind = {"o": "orders", "t": "topups"}[filters_part[0]]
+        status = None
+        if filters_part[1] != "-":
+            status = next(s for s, k in HISTORY_STATUSES.items() if k == kind and s[0] == filters_part[1])
+        direction = position[0]
+        index = int(position[1:], 16)
+    except (ValueError, KeyError, IndexError, StopIteration):
+        return None
+    if direction not in ("o", "n"):
+        return None
+    return kind, status, direction, index
+
+def get_history_page(records, status, direction="o", index=None):
+    """Find one page of record indexes around a cursor, newest first.
+
+    Scans outward from the cursor only as far as the page needs, so a page
+    costs the same however long the history is. Returns
+    (indexes, has_older, has_newer).
+    """
+    def matches(i):
+        return not status or records[i].get("status") == status
+
+    if index is None:
+        index = len(records)
+
+    if direction == "n":
+        found = []
+        for i in range(index + 1, len(records)):
+            if matches(i):
+                found.append(i)
+                if len(found) > HISTORY_PAGE_SIZE:
+                    break
+        if len(found) <= HISTORY_PAGE_SIZE:
+            # Fewer than a page left: show the newest full page instead
+            return get_history_page(records, status)
+        page = found[:HISTORY_PAGE_SIZE]
+        has_older = any(matches(i) for i in range(page[0] - 1, -1, -1))
+        return page[::-1], has_older, True
+
+    found = []
+    for i in range(min(index, len(records)) - 1, -1, -1):
+        if matches(i):
+            found.append(i)
+            if len(found) > HISTORY_PAGE_SIZE:
+                break
+    page = found[:HISTORY_PAGE_SIZE]
+    has_newer = bool(page) and any(matches(i) for i in range(page[0] + 1, len(records)))
+    return page, len(found) > HISTORY_PAGE_SIZE, has_newer
+
+def build_history_page(user_data, kind, status=None, direction="o", index=None):
+    """Render a /history page: returns (text, reply_markup)"""
+    records = user_data.get(kind, [])
+    page, has_older, has_newer = get_history_page(records, status, direction, index)
+
+    title = "🛒 **အော်ဒါများ**" if kind == "orders" else "💳 **ငွေဖြည့်များ**"
+    msg = f"📋 **သင့်ရဲ့ မှတ်တမ်းများ**\n\n{title}"
+    if status:
+        msg += f" ({status})"
+    msg += "\n"
+
+    if not page:
+        msg += "မှတ်တမ်း မရှိသေးပါ။\n"
+    for i in page:
+        record = records[i]
+        if kind == "orders":
+            status_emoji = {"completed": "✅", "refunded": "💸", "failed": "❌"}.get(record.get("status"), "⏳")
+            msg += f"{status_emoji} {record['order_id']} - {record['amount']} ({record['price']:,} MMK)\n"
+        else:
+            status_emoji = {"approved": "✅", "rejected": "❌"}.get(record.get("status"), "⏳")
+            msg += f"{status_emoji} {record['amount']:,} MMK - {record.get('timestamp', 'Unknown')[:10]}\n"
+    if page and not status:
+        msg += f"\n#{page[-1] + 1}-{page[0] + 1} / {len(records)}"
+
+    buttons = []
+    if has_older:
+        buttons.append(InlineKeyboardButton("⬅️ အဟောင်း", callback_data=encode_history_cursor(kind, status, "o", page[-1])))
+    if has_newer:
+        buttons.append(InlineKeyboardButton("အသစ် ➡️", callback_data=encode_history_cursor(kind, status, "n", page[0])))
+    other = "topups" if kind == "orders" else "orders"
+    switch = InlineKeyboardButton(
+        "💳 ငွေဖြည့်များ" if other == "topups" else "🛒 အော်ဒါများ",
+        callback_data=encode_history_cursor(other, None, "o", len(user_data.get(other, [])))
     )
-    
-    await update.message.reply_text(price_msg, parse_mode="Markdown")
+    keyboard = [buttons, [switch]] if buttons else [[switch]]
+    return msg, InlineKeyboardMarkup(keyboard)
 
 async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     
-    # Check authorization
-    load_authorized_users()
-    if not is_user_authorized(user_id):
-        keyboard = [[InlineKeyboardButton("👑 Contact Owner", url=f"tg://user?id={ADMIN_ID}")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            "🚫 **အသုံးပြုခွင့် မရှိပါ!**\n\n"
-            "Owner ထံ bot အသုံးပြုခွင့် တောင်းဆိုပါ။",
-            reply_markup=reply_markup
-        )
-        return
-
-    # Check if user is restricted after screenshot
-    if user_id in user_states and user_states[user_id] == "waiting_approval":
-        await update.message.reply_text(
-            "⏳ **Screenshot ပို့ပြီးပါပြီ!**\n\n"
-            "❌ Admin က လက်ခံပြီးကြောင်း အတည်ပြုတဲ့အထိ commands တွေ အသုံးပြုလို့ မရပါ။\n\n"
-            "⏰ Admin က approve လုပ်ပြီးမှ ပြန်လည် အသုံးပြုနိုင်ပါမယ်။\n"
-            "📞 အရေးပေါ်ဆိုရင် admin ကို ဆက်သွယ်ပါ။",
-            parse_mode="Markdown"
-        )
-        return
-
-    # Check for pending topups first
-    if await check_pending_topup(user_id):
-        await send_pending_topup_warning(update)
-        return
-
     data = load_data()
     user_data = data["users"].get(user_id)
 
@@ -966,38 +2413,53 @@ async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("📋 သင့်မှာ မည်သည့် မှတ်တမ်းမှ မရှိသေးပါ။")
         return
 
-    msg = "📋 **သင့်ရဲ့ မှတ်တမ်းများ**\n\n"
+    kind = "orders" if orders else "topups"
+    status = None
+    for arg in (a.lower() for a in context.args):
+        if arg in ("orders", "topups"):
+            kind = arg
+        elif arg in HISTORY_STATUSES:
+            status = arg
+            kind = HISTORY_STATUSES[arg]
+        else:
+            await update.message.reply_text(
+                "❌ မှန်ကန်တဲ့အတိုင်း ရေးပါ:\n"
+                "`/history [orders/topups] [processing/completed/refunded/failed/pending/approved/rejected]`\n\n"
+                "**ဥပမာ:**\n"
+                "• `/history`\n"
+                "• `/history topups`\n"
+                "• `/history completed`",
+                parse_mode="Markdown"
+            )
+            return
 
-    if orders:
-        msg += "🛒 **အော်ဒါများ** (နောက်ဆုံး 5 ခု):\n"
-        for order in orders[-5:]:
-            status_emoji = "✅" if order.get("status") == "completed" else "⏳"
-            msg += f"{status_emoji} {order['order_id']} - {order['amount']} ({order['price']:,} MMK)\n"
-        msg += "\n"
+    msg, reply_markup = build_history_page(user_data, kind, status)
+    await update.message.reply_text(msg, parse_mode="Markdown", reply_markup=reply_markup)
 
-    if topups:
-        msg += "💳 **ငွေဖြည့်များ** (နောက်ဆုံး 5 ခု):\n"
-        for topup in topups[-5:]:
-            status_emoji = "✅" if topup.get("status") == "approved" else "⏳"
-            msg += f"{status_emoji} {topup['amount']:,} MMK - {topup.get('timestamp', 'Unknown')[:10]}\n"
+async def history_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Older/newer/switch buttons under a /history page"""
+    query = update.callback_query
+    user_id = str(query.from_user.id)
 
-    await update.message.reply_text(msg, parse_mode="Markdown")
+    reason = await check_access_rules(get_access(context, user_id), COMMAND_ACCESS["history"])
+    user_data = load_data()["users"].get(user_id)
+    cursor = decode_history_cursor(query.data)
+    if reason or not user_data or not cursor:
+        await query.answer("❌ မှတ်တမ်း မကြည့်နိုင်ပါ။", show_alert=True)
+        return
+
+    await query.answer()
+    kind, status, direction, index = cursor
+    msg, reply_markup = build_history_page(user_data, kind, status, direction, index)
+    try:
+        await query.edit_message_text(msg, parse_mode="Markdown", reply_markup=reply_markup)
+    except Exception:
+        # Same page again (e.g. a double tap) - nothing to update
+        pass
 
 async def aistart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     
-    # Check authorization
-    load_authorized_users()
-    if not is_user_authorized(user_id):
-        keyboard = [[InlineKeyboardButton("👑 Contact Owner", url=f"tg://user?id={ADMIN_ID}")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            "🚫 **အသုံးပြုခွင့် မရှိပါ!**\n\n"
-            "Owner ထံ bot အသုံးပြုခွင့် တောင်းဆိုပါ။",
-            reply_markup=reply_markup
-        )
-        return
-
     ai_users.add(user_id)
     
     await update.message.reply_text(
@@ -1035,47 +2497,29 @@ async def stopai_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode="Markdown"
         )
 
-async def approve_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-
-    # Check if user is admin
-    if int(user_id) != ADMIN_ID:
-        await update.message.reply_text("❌ သင်သည် admin မဟုတ်ပါ!")
-        return
-
-    args = context.args
-    if len(args) != 2:
-        await update.message.reply_text(
-            "❌ အမှားရှိပါတယ်!\n\n"
-            "**မှန်ကန်တဲ့ format**: `/approve user_id amount`\n"
-            "**ဥပမာ**: `/approve 123456789 50000`"
-        )
-        return
+def find_pending_topup(topups, amount):
+    """Index of the newest pending topup of `amount`, or None"""
+    return next((i for i in range(len(topups) - 1, -1, -1)
+                 if topups[i]["status"] == "pending" and topups[i]["amount"] == amount), None)
 
-    try:
-        target_user_id = args[0]
-        amount = int(args[1])
-    except ValueError:
-        await update.message.reply_text("❌ ငွေပမာဏမှားနေပါတယ်!")
-        return
+async def approve_topup(bot: Bot, target_user_id, amount, topup_index=None):
+    """Credit a topup, mark its record approved and notify the user.
 
+    topup_index picks the record; None is a manual credit with no topup
+    record. Returns the user's new balance.
+    """
     data = load_data()
-
-    if target_user_id not in data["users"]:
-        await update.message.reply_text("❌ User မတွေ့ရှိပါ!")
-        return
-
-    # Add balance to user
-    data["users"][target_user_id]["balance"] += amount
-
-    # Update topup status
     topups = data["users"][target_user_id]["topups"]
-    for topup in reversed(topups):
-        if topup["status"] == "pending" and topup["amount"] == amount:
-            topup["status"] = "approved"
-            topup["approved_at"] = datetime.now().isoformat()
-            break
 
+    # Add balance to user
+    ref = f"t{target_user_id}:{topup_index}" if topup_index is not None else None
+    post_ledger(data, "topups", f"user:{target_user_id}", amount, "topup", ref)
+    if topup_index is not None:
+        topups[topup_index]["status"] = "approved"
+        topups[topup_index]["approved_at"] = datetime.now().isoformat()
+        close_sla(f"t{target_user_id}:{topup_index}")
+
+    record_topup_stats(data, amount)
     save_data(data)
 
     # Clear user restriction state after approval
@@ -1095,27 +2539,149 @@ async def approve_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "⚡ အမြန်ဆုံး diamonds များကို `/mmb` command နဲ့ မှာယူပါ ⚡\n\n"
             "🔓 **Bot လုပ်ဆောင်ချက်များ ပြန်လည် အသုံးပြုနိုင်ပါပြီ!**"
         )
-        await context.bot.send_message(chat_id=int(target_user_id), text=user_msg, parse_mode="Markdown")
+        await bot.send_message(chat_id=int(target_user_id), text=user_msg, parse_mode="Markdown")
+    except:
+        pass
+
+    return data["users"][target_user_id]["balance"]
+
+async def reject_topup(bot: Bot, target_user_id, topup_index):
+    """Mark a pending topup rejected, lift the user's restriction and tell them"""
+    data = load_data()
+    topup = data["users"][target_user_id]["topups"][topup_index]
+    topup["status"] = "rejected"
+    topup["rejected_at"] = datetime.now().isoformat()
+    close_sla(f"t{target_user_id}:{topup_index}")
+    save_data(data)
+
+    if target_user_id in user_states:
+        del user_states[target_user_id]
+
+    try:
+        await bot.send_message(
+            chat_id=int(target_user_id),
+            text=(
+                f"❌ **ငွေဖြည့်မှု ပယ်ချခံရပါတယ်!**\n\n"
+                f"💰 ပမာဏ: `{topup['amount']:,} MMK`\n\n"
+                "🔍 Screenshot သို့မဟုတ် ငွေပမာဏ မှန်ကန်မှု မရှိပါ။\n"
+                "📞 ပြဿနာရှိရင် admin ကို ဆက်သွယ်ပါ။"
+            ),
+            parse_mode="Markdown",
+            reply_markup=get_keyboard("contact_owner")
+        )
+    except:
+        pass
+
+async def complete_order(bot: Bot, target_user_id, order_index):
+    """Mark an order completed and send the user the done message.
+
+    Returns False and changes nothing if the order is no longer processing.
+    """
+    data = load_data()
+    order = data["users"][target_user_id]["orders"][order_index]
+    if order["status"] != "processing":
+        return False
+    order["status"] = "completed"
+    close_sla(f"o{target_user_id}:{order_index}")
+    save_data(data)
+    try:
+        await bot.send_message(
+            chat_id=int(target_user_id),
+            text="🙏 ဝယ်ယူအားပေးမှုအတွက် ကျေးဇူးအများကြီးတင်ပါတယ်။\n\n✅ Order Done! 🎉"
+        )
+    except:
+        pass
+    return True
+
+async def refund_order(bot: Bot, target_user_id, order_index, reason=None):
+    """Refund an order: return its price, mark it refunded and tell the user.
+
+    The balance, status and sales aggregates change in one save_data() with
+    no await before it, so a refund is applied completely or not at all.
+    Returns the user's new balance.
+    """
+    data = load_data()
+    order = data["users"][target_user_id]["orders"][order_index]
+
+    post_ledger(data, "sales", f"user:{target_user_id}", order["price"], "refund", order["order_id"])
+    order["status"] = "refunded"
+    order["refunded_at"] = datetime.now().isoformat()
+    if reason:
+        order["refund_reason"] = reason
+    remove_order_stats(data, target_user_id, order)
+    close_sla(f"o{target_user_id}:{order_index}")
+    save_data(data)
+
+    try:
+        await bot.send_message(
+            chat_id=int(target_user_id),
+            text=(
+                f"💸 **အော်ဒါ ပယ်ဖျက်ပြီး ငွေပြန်အမ်းပါပြီ!**\n\n"
+                f"📝 Order ID: `{order['order_id']}`\n"
+                f"💎 Amount: {order['amount']}\n"
+                f"💰 ပြန်ရငွေ: `{order['price']:,} MMK`\n"
+                f"💳 လက်ကျန်ငွေ: `{data['users'][target_user_id]['balance']:,} MMK`\n"
+                + (f"📝 အကြောင်းရင်း: `{reason}`\n" if reason else "") +
+                "\n📞 မေးခွန်းရှိရင် admin ကို ဆက်သွယ်ပါ။"
+            ),
+            parse_mode="Markdown"
+        )
     except:
         pass
 
+    return data["users"][target_user_id]["balance"]
+
+async def approve_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
+
+    args = context.args
+    if len(args) not in (2, 3) or (len(args) == 3 and args[2].lower() != "manual"):
+        await update.message.reply_text(
+            "❌ အမှားရှိပါတယ်!\n\n"
+            "**မှန်ကန်တဲ့ format**: `/approve user_id amount`\n"
+            "**ဥပမာ**: `/approve 123456789 50000`\n\n"
+            "Pending topup မရှိဘဲ ငွေထည့်ရန်: `/approve user_id amount manual`"
+        )
+        return
+
+    try:
+        target_user_id = args[0]
+        amount = int(args[1])
+    except ValueError:
+        await update.message.reply_text("❌ ငွေပမာဏမှားနေပါတယ်!")
+        return
+
+    if target_user_id not in load_data()["users"]:
+        await update.message.reply_text("❌ User မတွေ့ရှိပါ!")
+        return
+
+    # Only a pending topup of this amount is credited; it may already have been
+    # approved with the buttons, so crediting without one has to be asked for
+    topup_index = find_pending_topup(load_data()["users"][target_user_id]["topups"], amount)
+    if topup_index is None and len(args) != 3:
+        await update.message.reply_text(
+            f"❌ `{target_user_id}` မှာ {amount:,} MMK pending topup မရှိပါ! (Approve လုပ်ပြီးသား ဖြစ်နိုင်ပါတယ်)\n\n"
+            f"Topup မရှိဘဲ ငွေထည့်ရန်: `/approve {target_user_id} {amount} manual`",
+            parse_mode="Markdown"
+        )
+        return
+
+    # approve_topup saves before its first await, so the key lands in the same write
+    remember_result(context, f"Approve {target_user_id} {amount:,} MMK")
+    new_balance = await approve_topup(context.bot, target_user_id, amount, topup_index)
+
     # Confirm to admin
     await update.message.reply_text(
         f"✅ **Approve အောင်မြင်ပါပြီ!**\n\n"
         f"👤 User ID: `{target_user_id}`\n"
         f"💰 Amount: `{amount:,} MMK`\n"
-        f"💳 User's new balance: `{data['users'][target_user_id]['balance']:,} MMK`\n"
+        f"💳 User's new balance: `{new_balance:,} MMK`\n"
         f"🔓 User restrictions cleared!",
         parse_mode="Markdown"
     )
 
 async def deduct_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-
-    # Check if user is admin
-    if int(user_id) != ADMIN_ID:
-        await update.message.reply_text("❌ သင်သည် admin မဟုတ်ပါ!")
-        return
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
 
     args = context.args
     if len(args) != 2:
@@ -1156,7 +2722,8 @@ async def deduct_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Deduct balance from user
-    data["users"][target_user_id]["balance"] -= amount
+    post_ledger(data, f"user:{target_user_id}", "adjustments", amount, "deduct", f"admin:{update.effective_user.id}")
+    remember_result(context, f"Deduct {target_user_id} {amount:,} MMK")
     save_data(data)
 
     # Notify user
@@ -1181,13 +2748,62 @@ async def deduct_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode="Markdown"
     )
 
-async def done_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    # Check if user is admin
-    if int(user_id) != ADMIN_ID:
-        await update.message.reply_text("❌ သင်သည် admin မဟုတ်ပါ!")
+async def refund_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
+
+    args = context.args
+    if not args:
+        await update.message.reply_text(
+            "❌ အမှားရှိပါတယ်!\n\n"
+            "**မှန်ကန်တဲ့ format**: `/refund order_id [user_id] [reason]`\n"
+            "**ဥပမာ**: `/refund ORD20250701123045 Game ID မှားနေ`"
+        )
+        return
+
+    order_id = args[0].upper()
+    matches = order_index.get(order_id, [])
+    rest = args[1:]
+    # Several users can share an order id; the user id picks one
+    if rest and any(user_id == rest[0] for user_id, _ in matches):
+        matches = [m for m in matches if m[0] == rest[0]]
+        rest = rest[1:]
+    reason = " ".join(rest).replace("`", "'") or None
+
+    if not matches:
+        await update.message.reply_text("❌ Order မတွေ့ရှိပါ!")
+        return
+    if len(matches) > 1:
+        await update.message.reply_text(
+            f"⚠️ `{order_id}` နဲ့ order {len(matches)} ခု ရှိပါတယ်။ User ID ထည့်ပေးပါ:\n\n"
+            + "\n".join(f"• `/refund {order_id} {user_id}`" for user_id, _ in matches),
+            parse_mode="Markdown"
+        )
         return
+
+    target_user_id, index = matches[0]
+    order = load_data()["users"][target_user_id]["orders"][index]
+    if order["status"] == "refunded":
+        await update.message.reply_text("ℹ️ ဒီ order ကို ငွေပြန်အမ်းပြီးသားပါ။")
+        return
+    claim = get_work_claim(f"o{target_user_id}:{index}")
+    if claim and claim["user_id"] == "provider":
+        await update.message.reply_text("🤖 Auto delivery လုပ်နေဆဲပါ။ ပြီးမှ ပြန်ကြိုးစားပါ။")
+        return
+
+    work_claims.pop(f"o{target_user_id}:{index}", None)
+    new_balance = await refund_order(context.bot, target_user_id, index, reason)
+
+    await update.message.reply_text(
+        f"✅ **Refund အောင်မြင်ပါပြီ!**\n\n"
+        f"📝 Order ID: `{order_id}`\n"
+        f"👤 User ID: `{target_user_id}`\n"
+        f"💰 Amount: `{order['price']:,} MMK`\n"
+        f"💳 User's new balance: `{new_balance:,} MMK`",
+        parse_mode="Markdown"
+    )
+
+async def done_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
         
     args = context.args
     if len(args) != 1 or not args[0].isdigit():
@@ -1205,12 +2821,7 @@ async def done_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ User ID မှားနေပါတယ်။ Message မပို့နိုင်ပါ။")
 
 async def reply_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    # Check if user is admin
-    if int(user_id) != ADMIN_ID:
-        await update.message.reply_text("❌ သင်သည် admin မဟုတ်ပါ!")
-        return
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
         
     args = context.args
     if len(args) < 2 or not args[0].isdigit():
@@ -1229,12 +2840,7 @@ async def reply_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Message မပို့နိုင်ပါ။")
 
 async def authorize_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    # Check if user is admin
-    if int(user_id) != ADMIN_ID:
-        await update.message.reply_text("❌ သင်သည် admin မဟုတ်ပါ!")
-        return
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
         
     args = context.args
     if len(args) != 1 or not args[0].isdigit():
@@ -1275,12 +2881,7 @@ async def authorize_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 async def unauthorize_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    # Check if user is admin
-    if int(user_id) != ADMIN_ID:
-        await update.message.reply_text("❌ သင်သည် admin မဟုတ်ပါ!")
-        return
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
         
     args = context.args
     if len(args) != 1 or not args[0].isdigit():
@@ -1316,42 +2917,224 @@ async def unauthorize_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         parse_mode="Markdown"
     )
 
-async def maintenance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    # Check if user is admin
-    if int(user_id) != ADMIN_ID:
-        await update.message.reply_text("❌ သင်သည် admin မဟုတ်ပါ!")
+BAN_USAGE = (
+    "**ဥပမာ:**\n"
+    "• `{command} 123456789` - Game ID\n"
+    "• `{command} 123456789 8662` - Game ID + Server ID\n"
+    "• `{command} 98765*` - ဒီဂဏန်းနဲ့ စတဲ့ IDs\n"
+    "• `{command} 100000000-100999999` - ID range"
+)
+
+BAN_KIND_NAMES = {"ids": "Game ID", "accounts": "Account", "prefixes": "Prefix", "ranges": "Range"}
+
+async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
+
+    entry = parse_ban_entry(context.args)
+    if not entry:
+        await update.message.reply_text(
+            "❌ မှန်ကန်တဲ့အတိုင်း: /ban <entry>\n\n" + BAN_USAGE.format(command="/ban"),
+            parse_mode="Markdown"
+        )
         return
-        
+
+    kind, value = entry
+    data = load_data()
+    bans = data.setdefault("bans", {})
+    entries = bans.setdefault(kind, [])
+    if value in entries:
+        await update.message.reply_text(f"ℹ️ {BAN_KIND_NAMES[kind]} `{value}` ကို ban ပြီးသားပါ။", parse_mode="Markdown")
+        return
+
+    entries.append(value)
+    save_data(data)
+    build_ban_registry(bans)
+
+    await update.message.reply_text(
+        f"🚫 **Ban ထည့်ပြီးပါပြီ!**\n\n"
+        f"📋 {BAN_KIND_NAMES[kind]}: `{value}`\n"
+        f"🔢 စုစုပေါင်း: {sum(len(v) for v in bans.values())} entries",
+        parse_mode="Markdown"
+    )
+
+async def unban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
+
+    entry = parse_ban_entry(context.args)
+    if not entry:
+        await update.message.reply_text(
+            "❌ မှန်ကန်တဲ့အတိုင်း: /unban <entry>\n\n" + BAN_USAGE.format(command="/unban"),
+            parse_mode="Markdown"
+        )
+        return
+
+    kind, value = entry
+    data = load_data()
+    bans = data.get("bans", {})
+    if value not in bans.get(kind, []):
+        await update.message.reply_text(f"❌ {BAN_KIND_NAMES[kind]} `{value}` ban list ထဲမှာ မရှိပါ။", parse_mode="Markdown")
+        return
+
+    bans[kind].remove(value)
+    save_data(data)
+    build_ban_registry(bans)
+
+    await update.message.reply_text(
+        f"✅ **Ban ဖယ်ပြီးပါပြီ!**\n\n📋 {BAN_KIND_NAMES[kind]}: `{value}`",
+        parse_mode="Markdown"
+    )
+
+async def bans_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
+
+    bans = load_data().get("bans", {})
+    msg = "🚫 **Ban List**\n\n"
+    for kind, name in BAN_KIND_NAMES.items():
+        entries = bans.get(kind, [])
+        msg += f"**{name}** ({len(entries)}):"
+        msg += " " + ", ".join(f"`{e}`" for e in entries[-5:]) if entries else " -"
+        msg += "\n"
+    await update.message.reply_text(msg, parse_mode="Markdown")
+
+async def sla_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
+
+    now = time.time()
+    msg = "⏱ **SLA Status**\n\n"
+    for kind, title, sla in (("orders", "🛒 Orders", f"{ORDER_SLA // 60} မိနစ်"), ("topups", "💳 Topups", f"{TOPUP_SLA // 3600} နာရီ")):
+        stats = sla_stats[kind]
+        closed = stats["met"] + stats["missed"]
+        open_refs = [d for ref, d in sla_open.items() if ref[0] == kind[0]]
+        compliance = f"{stats['met'] / closed:.0%}" if closed else "-"
+        msg += (
+            f"{title} ({sla}):\n"
+            f"• ပြီးဆုံး: {stats['met']} အချိန်မီ, {stats['missed']} နောက်ကျ ({compliance})\n"
+            f"• ဖွင့်ထား: {len(open_refs)} ({sum(d <= now for d in open_refs)} ကျော်နေ)\n\n"
+        )
+    msg += f"⏰ Escalated: {sla_stats['escalated']}\n"
+
+    overdue = heapq.nsmallest(10, ((d, ref) for ref, d in sla_open.items() if d <= now))
+    if overdue:
+        data = load_data()
+        msg += "\n**အကြာဆုံး:**\n"
+        for _, ref in overdue:
+            kind, user_id, index = parse_work_ref(ref)
+            msg += format_sla_item(ref, data["users"][user_id][kind][index], now) + "\n"
+
+    await update.message.reply_text(msg, parse_mode="Markdown")
+
+async def reconcile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
+
+    mismatches = await reconcile_balances()
+    await update.message.reply_text(format_reconcile_report(mismatches), parse_mode="Markdown")
+
+async def staff_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
+
     args = context.args
-    if len(args) != 2:
+    if not args:
+        msg = "👮 **Staff List**\n\n"
+        msg += f"👑 `{ADMIN_ID}` - owner\n"
+        for staff_id, role in sorted(staff_roles.items(), key=lambda item: item[1]):
+            msg += f"• `{staff_id}` - {role}\n"
+        await update.message.reply_text(msg, parse_mode="Markdown")
+        return
+
+    action = args[0].lower()
+    if action == "add" and len(args) == 3 and args[1].isdigit() and args[2].lower() in ROLE_PERMISSIONS:
+        target_user_id, role = args[1], args[2].lower()
+    elif action == "remove" and len(args) == 2 and args[1].isdigit():
+        target_user_id, role = args[1], None
+    else:
+        await update.message.reply_text(
+            "❌ မှန်ကန်တဲ့အတိုင်း:\n"
+            "• `/staff` - Staff list\n"
+            "• `/staff add <user_id> <owner/approver/fulfiller/viewer>`\n"
+            "• `/staff remove <user_id>`\n\n"
+            "**Roles:**\n"
+            "• approver - topup approve/deduct\n"
+            "• fulfiller - order done/reply\n"
+            "• viewer - reports သာ",
+            parse_mode="Markdown"
+        )
+        return
+
+    data = load_data()
+    staff = data.setdefault("staff", {})
+    if role:
+        staff[target_user_id] = role
+    elif staff.pop(target_user_id, None) is None:
+        await update.message.reply_text("❌ Staff list ထဲမှာ မရှိပါ။")
+        return
+    save_data(data)
+    load_staff_roles()
+
+    if role:
+        await update.message.reply_text(f"✅ User `{target_user_id}` ကို **{role}** အဖြစ် သတ်မှတ်ပြီးပါပြီ။", parse_mode="Markdown")
+    else:
+        await update.message.reply_text(f"✅ User `{target_user_id}` ကို staff မှ ဖယ်ပြီးပါပြီ။", parse_mode="Markdown")
+
+async def maintenance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
+        
+    args = [a.lower() for a in context.args]
+    if len(args) < 2 or args[0] not in FEATURE_FLAGS:
         await update.message.reply_text(
             "❌ မှန်ကန်တဲ့အတိုင်း: `/maintenance <feature> <on/off>`\n\n"
             "**Features:**\n"
             "• `orders` - အော်ဒါလုပ်ဆောင်ချက်\n"
             "• `topups` - ငွေဖြည့်လုပ်ဆောင်ချက်\n"
             "• `general` - ယေဘူယျ လုပ်ဆောင်ချက်\n\n"
+            "**ပိတ်ချိန်နဲ့ ခွင့်ပြုစာရင်း:**\n"
+            "• `/maintenance <feature> window 02:00-03:00` - နေ့စဉ် ပိတ်ချိန် ထည့်\n"
+            "• `/maintenance <feature> window clear` - ပိတ်ချိန်များ ဖျက်\n"
+            "• `/maintenance <feature> allow <user_id>` - ပိတ်ထားချိန် သုံးခွင့်ပေး/ပြန်ရုပ်\n"
+            "  (ခွင့်ပြုစာရင်းသာ ဖြစ်ပါတယ် - user တစ်ယောက်ချင်းအတွက် သီးသန့် မပိတ်နိုင်ပါ)\n\n"
             "**ဥပမာ:**\n"
             "• `/maintenance orders off`\n"
-            "• `/maintenance topups on`"
+            "• `/maintenance topups window 02:00-03:00`",
+            parse_mode="Markdown"
         )
         return
         
-    feature = args[0].lower()
-    status = args[1].lower()
-    
-    if feature not in ["orders", "topups", "general"]:
-        await update.message.reply_text("❌ Feature မှားနေပါတယ်! orders, topups, general ထဲမှ ရွေးပါ")
-        return
-        
-    if status not in ["on", "off"]:
-        await update.message.reply_text("❌ Status မှားနေပါတယ်! on သို့မဟုတ် off ရွေးပါ")
+    feature, action = args[0], args[1]
+    data = load_data()
+    config = data.setdefault("flags", {}).setdefault(feature, {})
+
+    if action in ("on", "off"):
+        config["enabled"] = action == "on"
+    elif action == "window" and len(args) == 3:
+        if args[2] == "clear":
+            config.pop("windows", None)
+        elif parse_flag_window(args[2]):
+            windows = config.setdefault("windows", [])
+            if args[2] not in windows:
+                windows.append(args[2])
+        else:
+            await update.message.reply_text("❌ အချိန်မှားနေပါတယ်! ဥပမာ: `02:00-03:00`", parse_mode="Markdown")
+            return
+    elif action == "allow" and len(args) == 3:
+        allow = config.setdefault("allow", [])
+        if args[2] == "clear":
+            allow.clear()
+        elif args[2].isdigit():
+            if args[2] in allow:
+                allow.remove(args[2])
+            else:
+                allow.append(args[2])
+        else:
+            await update.message.reply_text("❌ User ID မှားနေပါတယ်!")
+            return
+        if not allow:
+            del config["allow"]
+    else:
+        await update.message.reply_text("❌ Status မှားနေပါတယ်! on, off, window, allow ထဲမှ ရွေးပါ")
         return
-        
-    bot_maintenance[feature] = (status == "on")
+
+    save_data(data)
+    build_feature_flags(data["flags"])
     
-    status_text = "🟢 ဖွင့်ထား" if status == "on" else "🔴 ပိတ်ထား"
     feature_text = {
         "orders": "အော်ဒါလုပ်ဆောင်ချက်",
         "topups": "ငွေဖြည့်လုပ်ဆောင်ချက်", 
@@ -1361,21 +3144,16 @@ async def maintenance_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     await update.message.reply_text(
         f"✅ **Maintenance Mode ပြောင်းလဲပါပြီ!**\n\n"
         f"🔧 Feature: {feature_text[feature]}\n"
-        f"📊 Status: {status_text}\n\n"
+        f"📊 Status: {format_flag_status(feature)}\n\n"
         f"**လက်ရှိ Maintenance Status:**\n"
-        f"• အော်ဒါများ: {'🟢 ဖွင့်ထား' if bot_maintenance['orders'] else '🔴 ပိတ်ထား'}\n"
-        f"• ငွေဖြည့်များ: {'🟢 ဖွင့်ထား' if bot_maintenance['topups'] else '🔴 ပိတ်ထား'}\n"
-        f"• ယေဘူယျ: {'🟢 ဖွင့်ထား' if bot_maintenance['general'] else '🔴 ပိတ်ထား'}",
+        f"• အော်ဒါများ: {format_flag_status('orders')}\n"
+        f"• ငွေဖြည့်များ: {format_flag_status('topups')}\n"
+        f"• ယေဘူယျ: {format_flag_status('general')}",
         parse_mode="Markdown"
     )
 
 async def setprice_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    # Check if user is admin
-    if int(user_id) != ADMIN_ID:
-        await update.message.reply_text("❌ သင်သည် admin မဟုတ်ပါ!")
-        return
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
         
     args = context.args
     if len(args) != 2:
@@ -1401,6 +3179,8 @@ async def setprice_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     custom_prices = load_prices()
     custom_prices[item] = price
     save_prices(custom_prices)
+    build_price_template()
+    build_price_engine()
     
     await update.message.reply_text(
         f"✅ **ဈေးနှုန်း ပြောင်းလဲပါပြီ!**\n\n"
@@ -1411,12 +3191,7 @@ async def setprice_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 async def removeprice_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    # Check if user is admin
-    if int(user_id) != ADMIN_ID:
-        await update.message.reply_text("❌ သင်သည် admin မဟုတ်ပါ!")
-        return
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
         
     args = context.args
     if len(args) != 1:
@@ -1435,6 +3210,8 @@ async def removeprice_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         
     del custom_prices[item]
     save_prices(custom_prices)
+    build_price_template()
+    build_price_engine()
     
     await update.message.reply_text(
         f"✅ **Custom Price ဖျက်ပါပြီ!**\n\n"
@@ -1443,47 +3220,310 @@ async def removeprice_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         parse_mode="Markdown"
     )
 
+PRICING_USAGE = (
+    "❌ မှန်ကန်တဲ့အတိုင်း:\n\n"
+    "• `/pricing` - လက်ရှိ setting ကြည့်\n"
+    "• `/pricing group <name> discount <percent>`\n"
+    "• `/pricing group <name> price <item> <price>`\n"
+    "• `/pricing group <name> volume <30-day spend> <percent>`\n"
+    "• `/pricing group <name> delete`\n"
+    "• `/pricing member <user_id> <group/default>`\n"
+    "• `/pricing promo <item/*> <percent> <hours> [group]`\n"
+    "• `/pricing promo clear`\n\n"
+    "**ဥပမာ:**\n"
+    "• `/pricing group reseller discount 5`\n"
+    "• `/pricing group reseller volume 1000000 3`\n"
+    "• `/pricing promo 86 10 24`"
+)
+
+def format_pricing(pricing):
+    groups = pricing.get("groups", {})
+    members = pricing.get("members", {})
+    msg = "🏷️ **Pricing Settings**\n\n"
+    if not groups:
+        msg += "Group မရှိသေးပါ။\n"
+    for name, config in groups.items():
+        msg += f"👥 **{name}** ({sum(g == name for g in members.values())} members)\n"
+        if config.get("discount"):
+            msg += f"• Discount: {config['discount']}%\n"
+        for item, price in config.get("prices", {}).items():
+            msg += f"• {item} = {price:,} MMK\n"
+        for threshold, percent in sorted(config.get("volume", [])):
+            msg += f"• 30 ရက် {threshold:,} MMK+ → {percent}%\n"
+    promos = pricing.get("promos", [])
+    if promos:
+        msg += "\n🔥 **Promos:**\n"
+        for promo in promos:
+            msg += (f"• `{promo['item']}` -{promo['percent']}% (`{promo.get('group', '*')}`) "
+                    f"{promo['from'].replace('T', ' ')} → {promo['to'].replace('T', ' ')}\n")
+    return msg
+
+async def pricing_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
+
+    args = context.args
+    data = load_data()
+    pricing = data.setdefault("pricing", {})
+    groups = pricing.setdefault("groups", {})
+
+    if not args:
+        await update.message.reply_text(format_pricing(pricing), parse_mode="Markdown")
+        return
+
+    # Group prices and promos may target custom /setprice items too
+    items = {**BASE_PRICES, **data.get("prices", {})}
+    try:
+        if args[0] == "group" and len(args) >= 3:
+            name, action = args[1].lower(), args[2]
+            if name == DEFAULT_PRICE_GROUP or not re.fullmatch(r"[a-z0-9]{1,20}", name):
+                raise ValueError
+            if action == "delete" and name in groups:
+                del groups[name]
+                pricing["members"] = {u: g for u, g in pricing.get("members", {}).items() if g != name}
+            elif action == "discount" and len(args) == 4 and 0 <= int(args[3]) < 100:
+                groups.setdefault(name, {})["discount"] = int(args[3])
+            elif action == "price" and len(args) == 5 and args[3] in items and int(args[4]) > 0:
+                groups.setdefault(name, {}).setdefault("prices", {})[args[3]] = int(args[4])
+            elif action == "volume" and len(args) == 5 and 0 <= int(args[4]) < 100:
+                threshold, percent = int(args[3]), int(args[4])
+                tiers = [t for t in groups.setdefault(name, {}).get("volume", []) if t[0] != threshold]
+                if percent:
+                    tiers.append([threshold, percent])
+                groups[name]["volume"] = sorted(tiers)
+            else:
+                raise ValueError
+
+        elif args[0] == "member" and len(args) == 3 and args[1].isdigit():
+            group = args[2].lower()
+            members = pricing.setdefault("members", {})
+            if group == DEFAULT_PRICE_GROUP:
+                members.pop(args[1], None)
+            elif group in groups:
+                members[args[1]] = group
+            else:
+                raise ValueError
+
+        elif args[0] == "promo" and args[1:] == ["clear"]:
+            pricing["promos"] = []
+
+        elif args[0] == "promo" and len(args) in (4, 5):
+            item, percent, hours = args[1], int(args[2]), float(args[3])
+            group = args[4].lower() if len(args) == 5 else "*"
+            if (item != "*" and item not in items) or not 0 < percent < 100 or not 0 < hours <= PROMO_MAX_HOURS \
+                    or (group != "*" and group != DEFAULT_PRICE_GROUP and group not in groups):
+                raise ValueError
+            start = datetime.now()
+            pricing.setdefault("promos", []).append({
+                "item": item,
+                "percent": percent,
+                "group": group,
+                "from": start.isoformat(timespec="minutes"),
+                "to": (start + timedelta(hours=hours)).isoformat(timespec="minutes")
+            })
+        else:
+            raise ValueError
+    except (ValueError, OverflowError):
+        await update.message.reply_text(PRICING_USAGE, parse_mode="Markdown")
+        return
+
+    # Drop promos that are over
+    now = datetime.now().isoformat(timespec="minutes")
+    pricing["promos"] = [p for p in pricing.get("promos", []) if p["to"] > now]
+    save_data(data)
+    build_price_engine()
+
+    await update.message.reply_text("✅ **Pricing ပြောင်းလဲပါပြီ!**\n\n" + format_pricing(pricing), parse_mode="Markdown")
+
 async def adminhelp_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
-    
-    # Check if user is admin
-    if int(user_id) != ADMIN_ID:
-        await update.message.reply_text("❌ သင်သည် admin မဟုတ်ပါ!")
-        return
+
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
         
     help_msg = (
         "🔧 **Admin Commands List** 🔧\n\n"
         "👥 **User Management:**\n"
         "• `/authorize <user_id>` - User အသုံးပြုခွင့်ပေး\n"
-        "• `/unauthorize <user_id>` - User အသုံးပြုခွင့်ရုပ်သိမ်း\n\n"
+        "• `/unauthorize <user_id>` - User အသုံးပြုခွင့်ရုပ်သိမ်း\n"
+        "• `/staff add <user_id> <role>` - Staff role ပေး\n\n"
         "💰 **Balance Management:**\n"
         "• `/approve <user_id> <amount>` - Topup approve လုပ်\n"
-        "• `/deduct <user_id> <amount>` - Balance နှုတ်ခြင်း\n\n"
+        "• `/approve <user_id> <amount> manual` - Pending topup မပါဘဲ ငွေထည့်\n"
+        "• `/deduct <user_id> <amount>` - Balance နှုတ်ခြင်း\n"
+        "• `/refund <order_id> [reason]` - Order ပယ်ဖျက်ပြီး ငွေပြန်အမ်း\n\n"
         "💬 **Communication:**\n"
         "• `/reply <user_id> <message>` - User ကို message ပို့\n"
         "• `/done <user_id>` - Order complete message ပို့\n"
-        "• `/sendgroup <message>` - Admin group ကို message ပို့\n\n"
+        "• `/sendgroup <message>` - Admin group ကို message ပို့\n"
+        "• `/broadcast [all/buyers/active/balance] <message>` - Users အားလုံးကို message ပို့\n\n"
+        "📊 **Reports:**\n"
+        "• `/report <day/week/month>` - ရောင်းအား report\n"
+        "• `/export <orders/topups> <csv/jsonl>` - မှတ်တမ်း file ထုတ်\n"
+        "• `/reconcile` - Balance နဲ့ ledger တိုက်စစ်\n"
+        "• `/sla` - အချိန်မီ ပြီးဆုံးမှု နှုန်း နဲ့ ကျော်နေတဲ့ အလုပ်များ\n\n"
+        "🐢 **Flood Control:**\n"
+        "• `/floodtop` - Spam အများဆုံး users များ ကြည့်\n\n"
+        "🚫 **Ban List:**\n"
+        "• `/ban <id/prefix*/from-to/id server>` - Account ban\n"
+        "• `/unban <entry>` - Ban ဖယ်\n"
+        "• `/bans` - Ban list ကြည့်\n\n"
         "🔧 **Bot Maintenance:**\n"
-        "• `/maintenance <orders/topups/general> <on/off>` - Features ဖွင့်ပိတ်\n\n"
+        "• `/maintenance <orders/topups/general> <on/off>` - Features ဖွင့်ပိတ်\n"
+        "• `/maintenance <feature> window 02:00-03:00` - နေ့စဉ် ပိတ်ချိန် သတ်မှတ်\n"
+        "• `/maintenance <feature> allow <user_id>` - ပိတ်ထားချိန် သုံးခွင့်ပေး\n\n"
         "💎 **Price Management:**\n"
         "• `/setprice <item> <price>` - Custom price ထည့်\n"
-        "• `/removeprice <item>` - Custom price ဖျက်\n\n"
+        "• `/removeprice <item>` - Custom price ဖျက်\n"
+        "• `/pricing` - Reseller ဈေးနှုန်းအဆင့်၊ promo နဲ့ volume discount\n\n"
         "📊 **Current Status:**\n"
-        f"• Orders: {'🟢 Enabled' if bot_maintenance['orders'] else '🔴 Disabled'}\n"
-        f"• Topups: {'🟢 Enabled' if bot_maintenance['topups'] else '🔴 Disabled'}\n"
-        f"• General: {'🟢 Enabled' if bot_maintenance['general'] else '🔴 Disabled'}\n"
+        f"• Your Role: {get_staff_role(user_id)}\n"
+        f"• Orders: {'🟢 Enabled' if is_feature_enabled('orders') else '🔴 Disabled'}\n"
+        f"• Topups: {'🟢 Enabled' if is_feature_enabled('topups') else '🔴 Disabled'}\n"
+        f"• General: {'🟢 Enabled' if is_feature_enabled('general') else '🔴 Disabled'}\n"
         f"• Authorized Users: {len(AUTHORIZED_USERS)}\n"
-        f"• AI Users: {len(ai_users)}"
+        f"• AI Users: {len(ai_users)}\n"
+        f"• Ledger: {ledger_stats['seq']:,} entries, last check {ledger_stats['last_reconcile'] or '-'} "
+        f"({ledger_stats['mismatches']} mismatches)\n"
+        f"• Access Gate: {gate_stats['calls']} checks, {gate_stats['blocked']} blocked, "
+        f"avg {gate_stats['total_ns'] / max(gate_stats['calls'], 1) / 1000:.1f} µs\n"
+        f"• Auto Delivery ({FULFILMENT_PROVIDER}): {fulfilment_stats['completed']} done, "
+        f"{fulfilment_stats['failed']} failed, {fulfilment_stats['retries']} retries, "
+        f"{fulfilment_state['queue'].qsize() if fulfilment_state['queue'] else 0} queued\n"
+        f"• Game ID Lookups ({GAME_ID_VERIFIER}): {game_id_stats['hits']} cached, {game_id_stats['lookups']} lookups, "
+        f"{game_id_stats['coalesced']} coalesced, {game_id_stats['errors']} errors"
     )
     
     await update.message.reply_text(help_msg, parse_mode="Markdown")
 
+async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
+
+    args = context.args
+    period = args[0].lower() if args else "day"
+
+    if period == "rebuild":
+        # Viewers may read reports, but a rebuild rewrites the whole data file
+        if not has_permission(str(update.effective_user.id), "report_rebuild"):
+            await update.message.reply_text("❌ သင့်မှာ ဒီအလုပ်အတွက် ခွင့်ပြုချက် မရှိပါ!")
+            return
+        data = load_data()
+        rebuild_sales_stats(data)
+        save_data(data)
+        await update.message.reply_text("✅ Sales report data ကို history အကုန်ကနေ ပြန်တွက်ပြီးပါပြီ။")
+        return
+
+    if period not in REPORT_PERIODS:
+        await update.message.reply_text(
+            "❌ မှန်ကန်တဲ့အတိုင်း: `/report <day/week/month>`\n\n"
+            "**ဥပမာ:**\n"
+            "• `/report day` - ဒီနေ့\n"
+            "• `/report week` - နောက်ဆုံး 7 ရက်\n"
+            "• `/report month` - နောက်ဆုံး 30 ရက်",
+            parse_mode="Markdown"
+        )
+        return
+
+    data = load_data()
+    report = build_sales_report(data, REPORT_PERIODS[period])
+
+    msg = (
+        f"📊 **Sales Report ({period})**\n\n"
+        f"🛒 Orders: {report['orders']}\n"
+        f"💰 Revenue: {report['revenue']:,} MMK\n"
+        f"💳 Approved topups: {report['topups']} ({report['topup_total']:,} MMK)\n"
+    )
+
+    if report["by_amount"]:
+        msg += "\n💎 **By Package**:\n"
+        by_amount = sorted(report["by_amount"].items(), key=lambda item: item[1]["revenue"], reverse=True)
+        for amount, item in by_amount:
+            msg += f"• {amount} × {item['count']} = {item['revenue']:,} MMK\n"
+
+    if report["users"]:
+        msg += "\n👑 **Top Users**:\n"
+        top_users = sorted(report["users"].items(), key=lambda item: item[1], reverse=True)[:5]
+        for target_user_id, revenue in top_users:
+            name = data["users"].get(target_user_id, {}).get("name", "") or "-"
+            name = name.replace('*', '').replace('_', '').replace('`', '').replace('[', '').replace(']', '')
+            msg += f"• {name} (`{target_user_id}`) - {revenue:,} MMK\n"
+
+    await update.message.reply_text(msg, parse_mode="Markdown")
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
+
+    try:
+        options = parse_export_args(context.args)
+    except ValueError as e:
+        await update.message.reply_text(
+            f"❌ `{e}` ကို နားမလည်ပါ!\n\n"
+            "**မှန်ကန်တဲ့အတိုင်း**: `/export <orders/topups> <csv/jsonl> [from=YYYY-MM-DD] [to=YYYY-MM-DD] [status=...] [user=...]`\n\n"
+            "**ဥပမာ:**\n"
+            "• `/export orders csv from=2025-07-01 to=2025-07-31`\n"
+            "• `/export topups jsonl status=approved`",
+            parse_mode="Markdown"
+        )
+        return
+
+    kind = options.pop("kind")
+    fmt = options.pop("fmt")
+
+    # Snapshot the user list so new users don't break iteration while we yield
+    users = list(load_data()["users"].items())
+    records = iter_export_records(users, kind, **options)
+
+    count = 0
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    # The temp file is removed however the export ends, including a failed write
+    try:
+        with open(fd, "w", newline="", encoding="utf-8") as f:
+            write_row = make_export_writer(f, kind, fmt)
+            for record in records:
+                write_row(record)
+                count += 1
+                if count % EXPORT_CHUNK == 0:
+                    await asyncio.sleep(0)
+
+        try:
+            filename = f"{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+            with open(path, "rb") as f:
+                await context.bot.send_document(
+                    chat_id=update.effective_chat.id,
+                    document=f,
+                    filename=filename,
+                    caption=f"📤 {kind} export - {count:,} rows"
+                )
+        except Exception as e:
+            await update.message.reply_text(f"❌ Export file မပို့နိုင်ပါ။\nError: {str(e)}")
+    finally:
+        os.remove(path)
+
+async def floodtop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
+
+    offenders = sorted(
+        (item for item in flood_state.items() if item[1]["dropped"]),
+        key=lambda item: item[1]["dropped"],
+        reverse=True
+    )[:10]
+
+    if not offenders:
+        await update.message.reply_text("✅ Flood လုပ်နေတဲ့ user မရှိပါ။")
+        return
+
+    msg = "🐢 **Top Flood Offenders**\n\n"
+    for target_user_id, state in offenders:
+        cooldown = get_flood_cooldown(target_user_id)
+        status = f"⏳ {cooldown}s" if cooldown else "🟢"
+        msg += f"• `{target_user_id}` - dropped {state['dropped']}, strikes {state['strikes']} {status}\n"
+    msg += f"\n📊 Tracked users: {len(flood_state)} | Total dropped: {gate_stats['flood_dropped']}"
+
+    await update.message.reply_text(msg, parse_mode="Markdown")
+
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
 
     # Check if user is authorized
-    load_authorized_users()
-    if not is_user_authorized(user_id):
+    if not get_access(context, user_id)["authorized"]:
         return
 
     # Validate if it's a payment screenshot
@@ -1508,10 +3548,34 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     pending = pending_topups[user_id]
     amount = pending["amount"]
+    photo = update.message.photo[-1]
+    now = datetime.now()
 
     # Set user state to restricted
     user_states[user_id] = "waiting_approval"
 
+    # The exact same file sent before is caught without downloading anything
+    duplicate_of = screenshot_index["file_ids"].get(photo.file_unique_id)
+
+    # Save topup request first
+    data = load_data()
+    if user_id not in data["users"]:
+        data["users"][user_id] = {"name": "", "username": "", "balance": 0, "orders": [], "topups": []}
+
+    topup_request = {
+        "amount": amount,
+        "status": "pending",
+        "timestamp": now.isoformat(),
+        "file_unique_id": photo.file_unique_id
+    }
+    data["users"][user_id]["topups"].append(topup_request)
+    topup_index = len(data["users"][user_id]["topups"]) - 1
+    track_sla(f"t{user_id}:{topup_index}", topup_request["timestamp"])
+    remember_result(context, f"Topup {amount:,} MMK screenshot - admin approve စောင့်ပါ")
+    save_data(data)
+    index_screenshot((user_id, topup_request["timestamp"][:16]), photo.file_unique_id)
+    del pending_topups[user_id]
+
     # Notify admin about topup request
     admin_msg = (
         f"💳 **ငွေဖြည့်တောင်းဆိုမှု**\n\n"
@@ -1519,57 +3583,47 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"🆔 User ID: `{user_id}`\n"
         f"💰 Amount: `{amount:,} MMK`\n"
         f"⏰ Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-        f"Screenshot ပါ ပါပါတယ်။ Approve လုပ်ရန်:\n"
-        f"`/approve {user_id} {amount}`"
+        f"Screenshot ပါ ပါပါတယ်။"
     )
+    if duplicate_of:
+        admin_msg += f"\n\n🔍 {format_duplicate(duplicate_of)}"
 
+    admin_message = None
     try:
         await context.bot.forward_message(
             chat_id=ADMIN_ID,
             from_chat_id=update.effective_chat.id,
             message_id=update.message.message_id
         )
-        await context.bot.send_message(chat_id=ADMIN_ID, text=admin_msg, parse_mode="Markdown")
+        admin_message = await context.bot.send_message(
+            chat_id=ADMIN_ID,
+            text=admin_msg,
+            parse_mode="Markdown",
+            reply_markup=get_topup_review_keyboard(f"t{user_id}:{topup_index}")
+        )
     except:
         pass
 
-    # Save topup request first
-    data = load_data()
-    if user_id not in data["users"]:
-        data["users"][user_id] = {"name": "", "username": "", "balance": 0, "orders": [], "topups": []}
-
-    topup_request = {
-        "amount": amount,
-        "status": "pending",
-        "timestamp": datetime.now().isoformat()
-    }
-    data["users"][user_id]["topups"].append(topup_request)
-    save_data(data)
+    # Check the largest photo size in the background; the verdict is added
+    # to the admin notification when it's ready
+    if admin_message and Image is not None and not duplicate_of:
+        context.application.create_task(
+            check_screenshot(context.bot, photo, user_id, amount, admin_message, topup_index)
+        )
 
     # Notify admin group
-    await notify_group_topup(topup_request, update.effective_user.first_name or "Unknown", user_id)
-
-    del pending_topups[user_id]
+    await notify_group_topup(
+        context.bot, topup_request, update.effective_user.first_name or "Unknown",
+        user_id, topup_index
+    )
 
     await update.message.reply_text(
-        f"✅ **Screenshot လက်ခံပါပြီ!**\n\n"
-        f"💰 ပမာဏ: `{amount:,} MMK`\n"
-        f"⏰ အချိန်: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-        "🔒 **အသုံးပြုမှု ယာယီ ကန့်သတ်ပါ**\n"
-        "❌ Admin က လက်ခံပြီးကြောင်း အတည်ပြုတဲ့အထိ commands တွေ အသုံးပြုလို့ မရပါ။\n\n"
-        "🔍 Admin မှ စစ်ဆေးပြီး 24 နာရီအတွင်း confirm လုပ်ပါမယ်။\n"
-        "✅ Approve ရပြီးမှ ပြန်လည် အသုံးပြုနိုင်ပါမယ်။\n"
-        "📞 ပြဿနာရှိရင် admin ကို ဆက်သွယ်ပါ။",
+        render_template("screenshot_received", amount=amount, time=datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
         parse_mode="Markdown"
     )
 
 async def send_to_group_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    
-    # Check if user is admin
-    if int(user_id) != ADMIN_ID:
-        await update.message.reply_text("❌ သင်သည် admin မဟုတ်ပါ!")
-        return
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
         
     args = context.args
     if len(args) < 1:
@@ -1591,49 +3645,610 @@ async def send_to_group_command(update: Update, context: ContextTypes.DEFAULT_TY
     except Exception as e:
         await update.message.reply_text(f"❌ Group ထဲကို message မပို့နိုင်ပါ။\nError: {str(e)}")
 
-async def notify_group_order(order_data, user_name):
+def get_broadcast_recipients(data, audience):
+    """Authorized user ids matching a broadcast audience"""
+    since = (datetime.now() - timedelta(days=BROADCAST_ACTIVE_DAYS)).isoformat()
+    recipients = []
+    for user_id in sorted(AUTHORIZED_USERS):
+        user_data = data["users"].get(user_id, {})
+        orders = user_data.get("orders", [])
+        if audience == "buyers" and not orders:
+            continue
+        if audience == "active" and not (orders and orders[-1].get("timestamp", "") >= since):
+            continue
+        if audience == "balance" and user_data.get("balance", 0) <= 0:
+            continue
+        recipients.append(user_id)
+    return recipients
+
+def load_broadcast_job():
+    try:
+        with open(BROADCAST_FILE, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_broadcast_job(job):
+    with open(BROADCAST_FILE, "w") as f:
+        json.dump(job, f, ensure_ascii=False)
+
+def format_broadcast_status(job):
+    total = len(job["recipients"])
+    return (
+        f"📢 **Broadcast** ({job['audience']}) - {job['status']}\n\n"
+        f"📤 Progress: {job['next']}/{total}\n"
+        f"✅ Delivered: {job['delivered']}\n"
+        f"🚫 Blocked: {job['blocked']}\n"
+        f"❌ Failed: {job['failed']}"
+    )
+
+async def run_broadcast(bot: Bot, job):
+    """Send job["text"] to every remaining recipient, checkpointing progress"""
+    delay = 1 / BROADCAST_RATE
+    try:
+        while job["next"] < len(job["recipients"]):
+            if job["status"] != "running":
+                break
+
+            user_id = job["recipients"][job["next"]]
+            try:
+                await bot.send_message(chat_id=int(user_id), text=job["text"])
+                job["delivered"] += 1
+            except RetryAfter as e:
+                # Flood limit hit: wait it out and retry the same user
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                await asyncio.sleep(retry_after)
+                continue
+            except Forbidden:
+                job["blocked"] += 1
+            except TelegramError:
+                job["failed"] += 1
+
+            job["next"] += 1
+            if job["next"] % BROADCAST_CHECKPOINT_EVERY == 0:
+                save_broadcast_job(job)
+            await asyncio.sleep(delay)
+    finally:
+        if job["status"] == "running" and job["next"] >= len(job["recipients"]):
+            job["status"] = "done"
+        save_broadcast_job(job)
+        broadcast_state["task"] = None
+
+    if job["status"] == "done":
+        try:
+            await bot.send_message(chat_id=ADMIN_ID, text=format_broadcast_status(job), parse_mode="Markdown")
+        except TelegramError:
+            pass
+
+def start_broadcast_task(application: Application, job):
+    broadcast_state["job"] = job
+    # Not application.create_task: stop() would wait for the whole broadcast;
+    # stop_background_jobs cancels it instead and the restart resumes it
+    broadcast_state["task"] = asyncio.create_task(run_broadcast(application.bot, job))
+
+async def resume_broadcast(application: Application):
+    """Continue a broadcast interrupted by a restart"""
+    job = load_broadcast_job()
+    if job and job["status"] == "running":
+        print(f"📢 Broadcast ပြန်စပါမယ် - {job['next']}/{len(job['recipients'])}")
+        start_broadcast_task(application, job)
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Staff role is checked by access_gate (ADMIN_COMMAND_ACCESS)
+
+    args = context.args
+    running = broadcast_state["task"] is not None
+
+    if args and args[0].lower() in ("status", "cancel"):
+        job = broadcast_state["job"] or load_broadcast_job()
+        if not job:
+            await update.message.reply_text("📢 Broadcast မရှိသေးပါ။")
+            return
+        if args[0].lower() == "cancel" and running:
+            job["status"] = "cancelled"
+            save_broadcast_job(job)
+        await update.message.reply_text(format_broadcast_status(job), parse_mode="Markdown")
+        return
+
+    if running:
+        await update.message.reply_text("⏳ Broadcast တစ်ခု ပို့နေဆဲပါ။ `/broadcast status` နဲ့ ကြည့်ပါ။", parse_mode="Markdown")
+        return
+
+    # Keep the message's own line breaks: take everything after the command
+    parts = update.message.text.split(None, 1)
+    text = parts[1] if len(parts) > 1 else ""
+    audience = "all"
+    if args and args[0].lower() in BROADCAST_AUDIENCES:
+        audience = args[0].lower()
+        text = text.split(None, 1)[1] if len(args) > 1 else ""
+
+    if not text.strip():
+        await update.message.reply_text(
+            "❌ မှန်ကန်တဲ့အတိုင်း: /broadcast [all/buyers/active/balance] <message>\n\n"
+            "**ဥပမာ:**\n"
+            "• `/broadcast ဈေးနှုန်းအသစ် ပြောင်းပါပြီ`\n"
+            "• `/broadcast balance လက်ကျန်ငွေ သုံးဖို့ မမေ့ပါနဲ့`\n"
+            "• `/broadcast status` / `/broadcast cancel`",
+            parse_mode="Markdown"
+        )
+        return
+
+    recipients = get_broadcast_recipients(load_data(), audience)
+    job = {
+        "audience": audience,
+        "text": text,
+        "recipients": recipients,
+        "next": 0,
+        "delivered": 0,
+        "blocked": 0,
+        "failed": 0,
+        "status": "running",
+        "started": datetime.now().isoformat()
+    }
+    save_broadcast_job(job)
+    start_broadcast_task(context.application, job)
+
+    minutes = len(recipients) / BROADCAST_RATE / 60
+    await update.message.reply_text(
+        f"📢 Broadcast စတင်ပါပြီ!\n\n"
+        f"👥 Users: {len(recipients)}\n"
+        f"⏱️ ကြာချိန်: ~{minutes:.1f} မိနစ်\n\n"
+        f"`/broadcast status` နဲ့ progress ကြည့်နိုင်ပါတယ်။",
+        parse_mode="Markdown"
+    )
+
+def get_sla_deadline(kind, timestamp):
+    sla = ORDER_SLA if kind == "orders" else TOPUP_SLA
+    return datetime.fromisoformat(timestamp).timestamp() + sla
+
+def track_sla(ref, timestamp):
+    """Start the SLA timer of a new work item"""
+    deadline = get_sla_deadline(parse_work_ref(ref)[0], timestamp)
+    sla_open[ref] = deadline
+    heapq.heappush(sla_heap, (deadline, ref))
+
+def close_sla(ref):
+    """Stop a work item's timer and count it as met or missed"""
+    deadline = sla_open.pop(ref, None)
+    if deadline is None:
+        return
+    kind = parse_work_ref(ref)[0]
+    sla_stats[kind]["met" if time.time() <= deadline else "missed"] += 1
+
+def build_sla_heap(data):
+    """Start timers for every processing order and pending topup"""
+    sla_open.clear()
+    for user_id, user_data in data["users"].items():
+        for kind, status in (("orders", "processing"), ("topups", "pending")):
+            for i, record in enumerate(user_data.get(kind, [])):
+                if record.get("status") == status:
+                    sla_open[f"{kind[0]}{user_id}:{i}"] = get_sla_deadline(kind, record["timestamp"])
+    sla_heap[:] = [(deadline, ref) for ref, deadline in sla_open.items()]
+    heapq.heapify(sla_heap)
+
+def pop_overdue_sla(now):
+    """Pop the open items whose deadline has passed, oldest first"""
+    overdue = []
+    while sla_heap and sla_heap[0][0] <= now:
+        deadline, ref = heapq.heappop(sla_heap)
+        if sla_open.get(ref) == deadline:
+            overdue.append(ref)
+    return overdue
+
+def format_sla_item(ref, record, now):
+    _, user_id, _ = parse_work_ref(ref)
+    late = int(now - sla_open.get(ref, now)) // 60
+    late = f"{late // 1440} ရက်" if late >= 1440 else f"{late // 60} နာရီ" if late >= 60 else f"{late} မိနစ်"
+    if ref[0] == "o":
+        line = f"🛒 `{record['order_id']}` - {record['amount']} (`{user_id}`)"
+    else:
+        line = f"💳 {record['amount']:,} MMK (`{user_id}`)"
+    claim = get_work_claim(ref)
+    return line + f" - {late} ကျော်" + (f" 🔒 {escape_markdown(claim['name'])}" if claim else "")
+
+async def escalate_sla(bot: Bot, refs):
+    """Post overdue work items to the admin group (one digest when there are many)"""
+    now = time.time()
+    data = load_data()
+    items = []
+    for ref in refs:
+        kind, user_id, index = parse_work_ref(ref)
+        records = data["users"].get(user_id, {}).get(kind, [])
+        if index < len(records) and records[index]["status"] in ("processing", "pending"):
+            items.append((ref, records[index]))
+    if not items:
+        return
+    sla_stats["escalated"] += len(items)
+
+    try:
+        if len(items) > SLA_DIGEST_OVER:
+            await bot.send_message(
+                chat_id=ADMIN_GROUP_ID,
+                text=f"⏰ **SLA ကျော်နေတဲ့ အလုပ် {len(items)} ခု!**\n\n"
+                     + "\n".join(format_sla_item(ref, record, now) for ref, record in items[:20])
+                     + "\n\n📊 အသေးစိတ်: `/sla`\n\n#SLA",
+                parse_mode="Markdown"
+            )
+            return
+        for ref, record in items:
+            await bot.send_message(
+                chat_id=ADMIN_GROUP_ID,
+                text=f"⏰ **SLA ကျော်သွားပါပြီ!**\n\n{format_sla_item(ref, record, now)}\n\n#SLA",
+                parse_mode="Markdown",
+                reply_markup=None if get_work_claim(ref) else get_work_keyboard(ref)
+            )
+    except Exception as e:
+        print(f"SLA escalation error: {e}")
+
+async def sla_loop(bot: Bot):
+    """Background job: escalate work items as their SLA deadline passes"""
+    while True:
+        await asyncio.sleep(SLA_CHECK_INTERVAL)
+        try:
+            overdue = pop_overdue_sla(time.time())
+            if overdue:
+                await escalate_sla(bot, overdue)
+        except Exception as e:
+            print(f"⚠️ SLA check failed: {e}")
+
+# Delivery backends: async (order) -> {"status": "completed"/"failed", "ref", "error"}.
+# Exceptions and timeouts are retried. A retry or a restart can send the
+# same order again, so providers must treat order_id as an idempotency key.
+FULFILMENT_PROVIDERS = {}
+
+# Delivery work queue, set up by start_fulfilment()
+fulfilment_state = {"queue": None}
+
+# Delivery counters (shown in /adminhelp)
+fulfilment_stats = {
+    "completed": 0,
+    "failed": 0,
+    "retries": 0
+}
+
+def register_fulfilment_provider(name, provider):
+    FULFILMENT_PROVIDERS[name] = provider
+
+async def simulate_fulfilment(order):
+    """Local backend for testing: slow, sometimes times out, refuses banned accounts"""
+    await asyncio.sleep(random.uniform(0.5, 2))
+    if random.random() < FULFILMENT_SIM_FAILURE:
+        raise ConnectionError("simulated provider timeout")
+    if is_banned_account(order["game_id"], order["server_id"]):
+        return {"status": "failed", "error": "account rejected by provider"}
+    return {"status": "completed", "ref": f"SIM{order['order_id'][3:]}{random.randint(100, 999)}"}
+
+register_fulfilment_provider("simulator", simulate_fulfilment)
+
+async def fail_order(bot: Bot, target_user_id, order_index, error):
+    """Mark an order failed after automatic delivery gave up and alert the admin group"""
+    data = load_data()
+    order = data["users"][target_user_id]["orders"][order_index]
+    if order["status"] != "processing":
+        return
+    order["status"] = "failed"
+    order["failed_at"] = datetime.now().isoformat()
+    order["fulfilment_error"] = error
+    close_sla(f"o{target_user_id}:{order_index}")
+    save_data(data)
+
+    error = error.replace("`", "'")
+    try:
+        await bot.send_message(
+            chat_id=ADMIN_GROUP_ID,
+            text=(
+                f"🤖 **Auto delivery မအောင်မြင်ပါ!**\n\n"
+                f"📝 Order ID: `{order['order_id']}`\n"
+                f"🆔 User ID: `{target_user_id}`\n"
+                f"🎮 Game ID: `{order['game_id']}`\n"
+                f"🌐 Server ID: `{order['server_id']}`\n"
+                f"💎 Amount: {order['amount']}\n"
+                f"❗ Error: `{error}`\n\n"
+                f"ငွေပြန်အမ်းရန်: `/refund {order['order_id']} {target_user_id}`\n\n"
+                f"#DeliveryFailed"
+            ),
+            parse_mode="Markdown"
+        )
+    except Exception as e:
+        print(f"Group delivery failure notification error: {e}")
+
+def release_provider_claim(ref):
+    """Drop the provider's claim on a work item, leaving an operator's alone"""
+    claim = work_claims.get(ref)
+    if claim and claim["user_id"] == "provider":
+        del work_claims[ref]
+
+async def deliver_order(bot: Bot, ref):
+    """Send one order through the provider, retrying with backoff.
+
+    The order is claimed in work_claims while the provider works on it so
+    operators can't finish or refund it at the same time.
+    """
+    _, user_id, index = parse_work_ref(ref)
+    provider = FULFILMENT_PROVIDERS[FULFILMENT_PROVIDER]
+    error = None
+    for attempt in range(FULFILMENT_RETRIES + 1):
+        order = load_data()["users"][user_id]["orders"][index]
+        claim = get_work_claim(ref)
+        # An operator may have taken over or finished the order meanwhile
+        if order["status"] != "processing" or (claim and claim["user_id"] != "provider"):
+            return None
+        work_claims[ref] = {"user_id": "provider", "name": f"🤖 {FULFILMENT_PROVIDER}", "at": time.monotonic()}
+
+        try:
+            result = await asyncio.wait_for(provider(dict(order)), FULFILMENT_TIMEOUT)
+        except Exception as e:
+            error = repr(e)
+        else:
+            if result["status"] == "completed":
+                release_provider_claim(ref)
+                order = load_data()["users"][user_id]["orders"][index]
+                # Check again: the order may have been finished while the provider worked
+                if order["status"] != "processing":
+                    print(f"⚠️ {ref} was delivered by the provider but is already {order['status']}")
+                    return None
+                order["provider_ref"] = result.get("ref")
+                await complete_order(bot, user_id, index)
+                fulfilment_stats["completed"] += 1
+                return "completed"
+            error = result.get("error") or "rejected by provider"
+            break
+
+        if attempt < FULFILMENT_RETRIES:
+            fulfilment_stats["retries"] += 1
+            await asyncio.sleep(FULFILMENT_BACKOFF * 2 ** attempt)
+
+    release_provider_claim(ref)
+    fulfilment_stats["failed"] += 1
+    await fail_order(bot, user_id, index, error)
+    return "failed"
+
+async def fulfilment_worker(bot: Bot):
+    queue = fulfilment_state["queue"]
+    while True:
+        ref = await queue.get()
+        try:
+            await deliver_order(bot, ref)
+        except Exception as e:
+            print(f"⚠️ Delivery of {ref} failed: {e!r}")
+        finally:
+            queue.task_done()
+
+def enqueue_fulfilment(ref):
+    """Queue an order for automatic delivery; False when it's off"""
+    if fulfilment_state["queue"] is None:
+        return False
+    fulfilment_state["queue"].put_nowait(ref)
+    return True
+
+def start_fulfilment(bot: Bot):
+    """Start the delivery workers and requeue unfinished orders; returns the worker tasks"""
+    if FULFILMENT_PROVIDER not in FULFILMENT_PROVIDERS:
+        return []
+    fulfilment_state["queue"] = asyncio.Queue()
+    workers = [asyncio.create_task(fulfilment_worker(bot)) for _ in range(FULFILMENT_WORKERS)]
+    for user_id, user_data in load_data()["users"].items():
+        for i, order in enumerate(user_data.get("orders", [])):
+            if order.get("status") == "processing" and order.get("fulfilment"):
+                enqueue_fulfilment(f"o{user_id}:{i}")
+    return workers
+
+async def notify_group_order(bot: Bot, order_data, user_name, user_id, order_index):
     """Notify admin group about new order"""
     try:
-        bot = Bot(token=BOT_TOKEN)
         message = (
             f"🛒 **အော်ဒါအသစ် ရောက်ပါပြီ!**\n\n"
             f"📝 Order ID: `{order_data['order_id']}`\n"
             f"👤 User: {user_name}\n"
             f"🎮 Game ID: `{order_data['game_id']}`\n"
             f"🌐 Server ID: `{order_data['server_id']}`\n"
+            + (f"👤 Nickname: `{order_data['nickname']}`\n" if order_data.get("nickname") else "") +
             f"💎 Amount: {order_data['amount']}\n"
             f"💰 Price: {order_data['price']:,} MMK\n"
             f"⏰ Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
             f"#NewOrder #MLBB"
         )
-        await bot.send_message(chat_id=ADMIN_GROUP_ID, text=message, parse_mode="Markdown")
+        await bot.send_message(
+            chat_id=ADMIN_GROUP_ID,
+            text=message,
+            parse_mode="Markdown",
+            reply_markup=get_work_keyboard(f"o{user_id}:{order_index}")
+        )
     except Exception as e:
         print(f"Group notification error: {e}")
 
-async def notify_group_topup(topup_data, user_name, user_id):
+async def notify_group_topup(bot: Bot, topup_data, user_name, user_id, topup_index):
     """Notify admin group about new topup request"""
     try:
-        bot = Bot(token=BOT_TOKEN)
         message = (
             f"💳 **ငွေဖြည့်တောင်းဆိုမှု**\n\n"
             f"👤 User: {user_name}\n"
             f"🆔 User ID: `{user_id}`\n"
             f"💰 Amount: `{topup_data['amount']:,} MMK`\n"
             f"⏰ Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-            f"Approve လုပ်ရန်: `/approve {user_id} {topup_data['amount']}`\n\n"
             f"#TopupRequest #Payment"
         )
-        await bot.send_message(chat_id=ADMIN_GROUP_ID, text=message, parse_mode="Markdown")
+        await bot.send_message(
+            chat_id=ADMIN_GROUP_ID,
+            text=message,
+            parse_mode="Markdown",
+            reply_markup=get_work_keyboard(f"t{user_id}:{topup_index}")
+        )
     except Exception as e:
         print(f"Group topup notification error: {e}")
 
+def parse_work_ref(ref):
+    """`o<user_id>:<index>` / `t<user_id>:<index>` -> (records key, user_id, index)"""
+    kind = {"o": "orders", "t": "topups"}.get(ref[:1])
+    user_id, _, index = ref[1:].partition(":")
+    if not kind or not user_id.isdigit() or not index.isdigit():
+        return None
+    return kind, user_id, int(index)
+
+def get_work_keyboard(ref, claimed=False):
+    """Buttons under a group work item: Claim, or Done/Approve + Release once claimed"""
+    if not claimed:
+        return InlineKeyboardMarkup([[InlineKeyboardButton("🙋 Claim", callback_data=f"q:c:{ref}")]])
+    release = InlineKeyboardButton("🔓 Release", callback_data=f"q:r:{ref}")
+    if ref[0] == "o":
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton("✅ Done", callback_data=f"q:d:{ref}"), release],
+            [InlineKeyboardButton("💸 Refund", callback_data=f"q:f:{ref}")]
+        ])
+    return InlineKeyboardMarkup([[InlineKeyboardButton("✅ Approve", callback_data=f"q:a:{ref}"), release]])
+
+def get_work_claim(ref):
+    """Return the live claim on a work item, dropping it once CLAIM_TIMEOUT passes"""
+    claim = work_claims.get(ref)
+    if claim and time.monotonic() - claim["at"] > CLAIM_TIMEOUT:
+        del work_claims[ref]
+        return None
+    return claim
+
+def format_finished_status(status):
+    emoji = {"rejected": "❌", "failed": "❌", "refunded": "💸"}.get(status, "✅")
+    return f"{emoji} {status.capitalize()}"
+
+async def update_work_message(query, status, reply_markup=None):
+    """Replace the status line under a group work item and its buttons"""
+    base = query.message.text_markdown.split("\n\n📌 ")[0]
+    # Status lines are plain text but carry staff names, which may hold * or _
+    status = escape_markdown(status)
+    try:
+        await query.edit_message_text(f"{base}\n\n📌 {status}", parse_mode="Markdown", reply_markup=reply_markup)
+    except TelegramError:
+        pass
+
+def get_topup_review_keyboard(ref):
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("✅ Approve", callback_data=f"p:a:{ref}"),
+        InlineKeyboardButton("❌ Reject", callback_data=f"p:r:{ref}")
+    ]])
+
+async def topup_review_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """One-tap Approve/Reject under the admin's screenshot notification"""
+    query = update.callback_query
+    staff = query.from_user
+    _, action, ref = query.data.split(":", 2)
+    parsed = parse_work_ref(ref)
+    if not parsed or parsed[0] != "topups":
+        await query.answer()
+        return
+
+    if not has_permission(str(staff.id), "approve"):
+        await query.answer("❌ သင့်မှာ ဒီအလုပ်အတွက် ခွင့်ပြုချက် မရှိပါ!", show_alert=True)
+        return
+
+    _, target_user_id, index = parsed
+    topups = load_data()["users"].get(target_user_id, {}).get("topups", [])
+    if index >= len(topups):
+        await query.answer("❌ မှတ်တမ်း မတွေ့ပါ!", show_alert=True)
+        return
+    topup = topups[index]
+    if topup["status"] != "pending":
+        await query.answer(f"ℹ️ ပြီးသွားပါပြီ ({topup['status']})", show_alert=True)
+        await update_work_message(query, format_finished_status(topup["status"]))
+        return
+
+    # The record leaves "pending" before the first await below, so a double
+    # tap or a parallel group approval can't credit it twice
+    work_claims.pop(ref, None)
+    if action == "a":
+        new_balance = await approve_topup(context.bot, target_user_id, topup["amount"], index)
+        status = f"✅ Approved by {staff.first_name} - balance {new_balance:,} MMK"
+    else:
+        await reject_topup(context.bot, target_user_id, index)
+        status = f"❌ Rejected by {staff.first_name}"
+    await query.answer(status)
+    await update_work_message(query, f"{status} ({datetime.now().strftime('%H:%M')})")
+
+async def work_queue_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Claim / Release / Done / Approve buttons under group order and topup messages"""
+    query = update.callback_query
+    staff = query.from_user
+    staff_id = str(staff.id)
+    _, action, ref = query.data.split(":", 2)
+    parsed = parse_work_ref(ref)
+    if not parsed:
+        await query.answer()
+        return
+
+    kind, target_user_id, index = parsed
+    if action in ("c", "r") and kind == "orders":
+        # An order is claimed either to finish it (fulfiller) or to refund it (approver)
+        allowed = has_permission(staff_id, "done") or has_permission(staff_id, "refund")
+    else:
+        permission = "refund" if action == "f" else "done" if kind == "orders" else "approve"
+        allowed = has_permission(staff_id, permission)
+    if not allowed:
+        await query.answer("❌ သင့်မှာ ဒီအလုပ်အတွက် ခွင့်ပြုချက် မရှိပါ!", show_alert=True)
+        return
+
+    records = load_data()["users"].get(target_user_id, {}).get(kind, [])
+    if index >= len(records):
+        await query.answer("❌ မှတ်တမ်း မတွေ့ပါ!", show_alert=True)
+        return
+    record = records[index]
+    if record["status"] not in ("processing", "pending"):
+        await query.answer(f"ℹ️ ပြီးသွားပါပြီ ({record['status']})", show_alert=True)
+        await update_work_message(query, format_finished_status(record["status"]))
+        return
+
+    # Claim check and update happen without an await in between, so two
+    # operators tapping at once can't both win
+    claim = get_work_claim(ref)
+    mine = claim is not None and claim["user_id"] == staff_id
+    if claim and not mine and action != "r":
+        await query.answer(f"🔒 {claim['name']} လုပ်နေပါတယ်!", show_alert=True)
+        return
+
+    if action == "c":
+        work_claims[ref] = {"user_id": staff_id, "name": staff.first_name, "at": time.monotonic()}
+        await query.answer("✅ Claim လုပ်ပြီးပါပြီ")
+        await update_work_message(
+            query,
+            f"🔒 Claimed by {staff.first_name} ({datetime.now().strftime('%H:%M')})",
+            get_work_keyboard(ref, claimed=True)
+        )
+
+    elif action == "r":
+        # The owner may release a stale operator claim, but never the provider's
+        # while a delivery is in flight
+        if claim and not mine and (claim["user_id"] == "provider" or get_staff_role(staff_id) != "owner"):
+            await query.answer(f"🔒 {claim['name']} ရဲ့ claim ပါ!", show_alert=True)
+            return
+        work_claims.pop(ref, None)
+        await query.answer("🔓 Release လုပ်ပြီးပါပြီ")
+        await update_work_message(query, f"🔓 Released by {staff.first_name}", get_work_keyboard(ref))
+
+    elif action in ("d", "a", "f"):
+        if not mine:
+            await query.answer("❌ အရင်ဆုံး Claim လုပ်ပါ!", show_alert=True)
+            return
+        # complete_order/refund_order/approve_topup save the new status before their first
+        # await, so a second tap already sees the item finished
+        del work_claims[ref]
+        if action == "d":
+            await complete_order(context.bot, target_user_id, index)
+            status = f"✅ Done by {staff.first_name}"
+        elif action == "f":
+            await refund_order(context.bot, target_user_id, index)
+            status = f"💸 Refunded by {staff.first_name}"
+        else:
+            await approve_topup(context.bot, target_user_id, record["amount"], index)
+            status = f"✅ Approved by {staff.first_name}"
+        await query.answer(status)
+        await update_work_message(query, f"{status} ({datetime.now().strftime('%H:%M')})")
+
 async def handle_restricted_content(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle all non-command messages for restricted users"""
     user_id = str(update.effective_user.id)
+    access = get_access(context, user_id)
     
     # Check if user is authorized first
-    load_authorized_users()
-    if not is_user_authorized(user_id):
+    if not access["authorized"]:
         # For unauthorized users, give AI reply
         if update.message.text:
             reply = ai_reply(update.message.text)
@@ -1641,24 +4256,14 @@ async def handle_restricted_content(update: Update, context: ContextTypes.DEFAUL
         return
 
     # Check if user is restricted after sending screenshot
-    if user_id in user_states and user_states[user_id] == "waiting_approval":
+    if access["restricted"]:
         # Block everything except photos for restricted users
         if update.message.photo:
             await handle_photo(update, context)
             return
         
         # Block all other content types
-        await update.message.reply_text(
-            "❌ **အသုံးပြုမှု ကန့်သတ်ထားပါ!**\n\n"
-            "🔒 Screenshot ပို့ပြီးပါပြီ။ Admin က လက်ခံပြီးကြောင်း အတည်ပြုတဲ့အထိ:\n\n"
-            "❌ Commands အသုံးပြုလို့ မရပါ\n"
-            "❌ စာသား ပို့လို့ မရပါ\n"
-            "❌ Voice, Sticker, GIF, Video ပို့လို့ မရပါ\n"
-            "❌ Emoji ပို့လို့ မရပါ\n\n"
-            "⏰ Admin က approve လုပ်ပြီးမှ ပြန်လည် အသုံးပြုနိုင်ပါမယ်။\n"
-            "📞 အရေးပေါ်ဆိုရင် admin ကို ဆက်သွယ်ပါ။",
-            parse_mode="Markdown"
-        )
+        await update.message.reply_text(get_template("restricted_content"), parse_mode="Markdown")
         return
 
     # For authorized users with AI enabled
@@ -1668,122 +4273,178 @@ async def handle_restricted_content(update: Update, context: ContextTypes.DEFAUL
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    user_id = str(query.from_user.id)
-    
-    # Check if user is restricted
-    if user_id in user_states and user_states[user_id] == "waiting_approval":
-        await query.answer("❌ Screenshot ပို့ပြီးပါပြီ! Admin approve စောင့်ပါ။", show_alert=True)
-        return
     
-    if query.data == "copy_kpay":
-        await query.answer("📱 KPay Number copied! 09678786528", show_alert=True)
-        await query.message.reply_text(
-            "📱 **KBZ Pay Number**\n\n"
-            "`09678786528`\n\n"
-            "👤 Name: **Ma May Phoo Wai**\n"
-            "📋 Number ကို အပေါ်မှ copy လုပ်ပါ",
-            parse_mode="Markdown"
-        )
+    # Restricted users are stopped by access_gate before reaching here
+    if query.data.startswith("h:"):
+        await history_callback(update, context)
+
+    elif query.data.startswith("q:"):
+        await work_queue_callback(update, context)
+
+    elif query.data.startswith("p:"):
+        await topup_review_callback(update, context)
+
+    elif query.data == "copy_kpay":
+        await query.answer(get_template("copy_kpay_alert"), show_alert=True)
+        await query.message.reply_text(get_template("copy_kpay"), parse_mode="Markdown")
         
     elif query.data == "copy_wave":
-        await query.answer("📱 Wave Number copied! 09673585480", show_alert=True)
-        await query.message.reply_text(
-            "📱 **Wave Money Number**\n\n"
-            "`09673585480`\n\n"
-            "👤 Name: **Nine Nine**\n"
-            "📋 Number ကို အပေါ်မှ copy လုပ်ပါ",
-            parse_mode="Markdown"
-        )
+        await query.answer(get_template("copy_wave_alert"), show_alert=True)
+        await query.message.reply_text(get_template("copy_wave"), parse_mode="Markdown")
         
     elif query.data == "topup_button":
         try:
-            keyboard = [
-                [InlineKeyboardButton("📱 Copy KPay Number", callback_data="copy_kpay")],
-                [InlineKeyboardButton("📱 Copy Wave Number", callback_data="copy_wave")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
             await query.edit_message_text(
-                text="💳 **ငွေဖြည့်လုပ်ငန်းစဉ်**\n\n"
-                     "**အဆင့် 1**: ငွေပမာဏ ရေးပါ\n"
-                     "`/topup amount` ဥပမာ: `/topup 50000`\n\n"
-                     "**အဆင့် 2**: ငွေလွှဲပါ\n"
-                     "📱 KBZ Pay: `09678786528` (Ma May Phoo Wai)\n"
-                     "📱 Wave Money: `09673585480` (Nine Nine)\n\n"
-                     "**အဆင့် 3**: Screenshot တင်ပါ\n"
-                     "ငွေလွှဲပြီးရင် screenshot ကို ဒီမှာ တင်ပေးပါ။\n\n"
-                     "⏰ 24 နာရီအတွင်း confirm လုပ်ပါမယ်။",
+                text=get_template("topup_steps"),
                 parse_mode="Markdown",
-                reply_markup=reply_markup
+                reply_markup=get_keyboard("payment")
             )
         except Exception as e:
             # If edit fails, send new message
-            keyboard = [
-                [InlineKeyboardButton("📱 Copy KPay Number", callback_data="copy_kpay")],
-                [InlineKeyboardButton("📱 Copy Wave Number", callback_data="copy_wave")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
             await query.message.reply_text(
-                text="💳 **ငွေဖြည့်လုပ်ငန်းစဉ်**\n\n"
-                     "**အဆင့် 1**: ငွေပမာဏ ရေးပါ\n"
-                     "`/topup amount` ဥပမာ: `/topup 50000`\n\n"
-                     "**အဆင့် 2**: ငွေလွှဲပါ\n"
-                     "📱 KBZ Pay: `09678786528` (Ma May Phoo Wai)\n"
-                     "📱 Wave Money: `09673585480` (Nine Nine)\n\n"
-                     "**အဆင့် 3**: Screenshot တင်ပါ\n"
-                     "ငွေလွှဲပြီးရင် screenshot ကို ဒီမှာ တင်ပေးပါ။\n\n"
-                     "⏰ 24 နာရီအတွင်း confirm လုပ်ပါမယ်။",
+                text=get_template("topup_steps"),
                 parse_mode="Markdown",
-                reply_markup=reply_markup
+                reply_markup=get_keyboard("payment")
             )
 
-def main():
-    if not BOT_TOKEN:
-        print("❌ BOT_TOKEN environment variable မရှိပါ!")
-        return
-
-    application = Application.builder().token(BOT_TOKEN).build()
-
+# Periodic jobs that run until shutdown. They are plain asyncio tasks because
+# Application.stop() waits for everything started with application.create_task()
+background_tasks = []
+
+async def start_background_jobs(application: Application):
+    """post_init hook: resume an interrupted broadcast and start the periodic jobs"""
+    await resume_broadcast(application)
+    background_tasks.append(asyncio.create_task(reconcile_loop(application.bot)))
+    background_tasks.append(asyncio.create_task(sla_loop(application.bot)))
+    background_tasks.extend(start_fulfilment(application.bot))
+
+async def stop_background_jobs(application: Application):
+    """post_stop hook: cancel the periodic jobs and a running broadcast"""
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+
+    task = broadcast_state["task"]
+    if task:
+        # The job stays "running" on disk so resume_broadcast picks it up
+        save_broadcast_job(broadcast_state["job"])
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+def setup_application(application):
+    """Load bot state and register every handler on the application"""
     # Load authorized users on startup
     load_authorized_users()
 
+    # Build sales aggregates for older data files
+    ensure_sales_stats()
+
+    # Open the balance ledger (seeded from current balances on first run)
+    ensure_ledger()
+
+    # Staff roles and their cached permissions
+    load_staff_roles()
+
+    # Compile the saved feature flags
+    build_feature_flags(load_data().get("flags", {}))
+
+    # Compile the banned account list
+    build_ban_registry(load_data().get("bans", {}))
+
+    # Index orders by order_id for /refund
+    build_order_index(load_data())
+
+    # Start SLA timers for open orders and topups
+    build_sla_heap(load_data())
+
+    # Index stored screenshot ids/hashes for duplicate detection
+    build_screenshot_index(load_data())
+
+    # Pre-render static messages and keyboards
+    build_templates()
+
+    # Compile price groups and promos
+    build_price_engine()
+
+    # Compile the AI assistant keyword matcher
+    build_intent_matcher()
+    if AI_BACKEND == "classifier" and not train_intent_classifier():
+        print(f"⚠️ {INTENT_EXAMPLES_FILE} မရှိပါ - AI keyword rules ကိုသာ သုံးပါမယ်")
+
+    # Background jobs start once the bot is up
+    application.post_init = start_background_jobs
+    application.post_stop = stop_background_jobs
+
+    # Access gate runs before every other handler group
+    application.add_handler(TypeHandler(Update, access_gate), group=-1)
+
+    # Runs after the command/photo handlers to release idempotency keys
+    application.add_handler(TypeHandler(Update, idempotency_done), group=1)
+
+    application.add_error_handler(on_error)
+
+    # Handlers only take new messages; an edited message must not re-run a
+    # command or skip the checks made on the original
+    new_message = filters.UpdateType.MESSAGE
+
     # Command handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("mmb", mmb_command))
-    application.add_handler(CommandHandler("balance", balance_command))
-    application.add_handler(CommandHandler("topup", topup_command))
-    application.add_handler(CommandHandler("price", price_command))
-    application.add_handler(CommandHandler("history", history_command))
-    application.add_handler(CommandHandler("aistart", aistart_command))
-    application.add_handler(CommandHandler("stopai", stopai_command))
+    application.add_handler(CommandHandler("start", start, filters=new_message))
+    application.add_handler(CommandHandler("mmb", mmb_command, filters=new_message))
+    application.add_handler(CommandHandler("balance", balance_command, filters=new_message))
+    application.add_handler(CommandHandler("topup", topup_command, filters=new_message))
+    application.add_handler(CommandHandler("price", price_command, filters=new_message))
+    application.add_handler(CommandHandler("history", history_command, filters=new_message))
+    application.add_handler(CommandHandler("aistart", aistart_command, filters=new_message))
+    application.add_handler(CommandHandler("stopai", stopai_command, filters=new_message))
     
     # Admin commands
-    application.add_handler(CommandHandler("approve", approve_command))
-    application.add_handler(CommandHandler("deduct", deduct_command))
-    application.add_handler(CommandHandler("done", done_command))
-    application.add_handler(CommandHandler("reply", reply_command))
-    application.add_handler(CommandHandler("authorize", authorize_command))
-    application.add_handler(CommandHandler("unauthorize", unauthorize_command))
-    application.add_handler(CommandHandler("sendgroup", send_to_group_command))
-    application.add_handler(CommandHandler("maintenance", maintenance_command))
-    application.add_handler(CommandHandler("setprice", setprice_command))
-    application.add_handler(CommandHandler("removeprice", removeprice_command))
-    application.add_handler(CommandHandler("adminhelp", adminhelp_command))
+    application.add_handler(CommandHandler("approve", approve_command, filters=new_message))
+    application.add_handler(CommandHandler("deduct", deduct_command, filters=new_message))
+    application.add_handler(CommandHandler("refund", refund_command, filters=new_message))
+    application.add_handler(CommandHandler("done", done_command, filters=new_message))
+    application.add_handler(CommandHandler("reply", reply_command, filters=new_message))
+    application.add_handler(CommandHandler("authorize", authorize_command, filters=new_message))
+    application.add_handler(CommandHandler("unauthorize", unauthorize_command, filters=new_message))
+    application.add_handler(CommandHandler("sendgroup", send_to_group_command, filters=new_message))
+    application.add_handler(CommandHandler("maintenance", maintenance_command, filters=new_message))
+    application.add_handler(CommandHandler("setprice", setprice_command, filters=new_message))
+    application.add_handler(CommandHandler("removeprice", removeprice_command, filters=new_message))
+    application.add_handler(CommandHandler("pricing", pricing_command, filters=new_message))
+    application.add_handler(CommandHandler("adminhelp", adminhelp_command, filters=new_message))
+    application.add_handler(CommandHandler("floodtop", floodtop_command, filters=new_message))
+    application.add_handler(CommandHandler("report", report_command, filters=new_message))
+    # A big export yields between chunks; block=False lets other updates run meanwhile
+    application.add_handler(CommandHandler("export", export_command, filters=new_message, block=False))
+    application.add_handler(CommandHandler("broadcast", broadcast_command, filters=new_message))
+    application.add_handler(CommandHandler("ban", ban_command, filters=new_message))
+    application.add_handler(CommandHandler("unban", unban_command, filters=new_message))
+    application.add_handler(CommandHandler("bans", bans_command, filters=new_message))
+    application.add_handler(CommandHandler("staff", staff_command, filters=new_message))
+    application.add_handler(CommandHandler("reconcile", reconcile_command, filters=new_message))
+    application.add_handler(CommandHandler("sla", sla_command, filters=new_message))
     
     # Callback query handler
     application.add_handler(CallbackQueryHandler(button_callback))
     
     # Photo handler (for payment screenshots)
-    application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+    application.add_handler(MessageHandler(new_message & filters.PHOTO, handle_photo))
     
     # Handle all other message types (text, voice, sticker, video, etc.)
     application.add_handler(MessageHandler(
-        (filters.TEXT | filters.VOICE | filters.Sticker.ALL | filters.VIDEO | 
+        new_message & (filters.TEXT | filters.VOICE | filters.Sticker.ALL | filters.VIDEO | 
          filters.ANIMATION | filters.AUDIO | filters.Document.ALL) & ~filters.COMMAND, 
         handle_restricted_content
     ))
 
+def main():
+    if not BOT_TOKEN:
+        print("❌ BOT_TOKEN environment variable မရှိပါ!")
+        return
+
+    application = Application.builder().token(BOT_TOKEN).build()
+    setup_application(application)
+
     print("🤖 Bot စတင်နေပါသည် - 24/7 Running Mode")
     print("✅ Orders, Topups နဲ့ AI စလုံးအဆင်သင့်ပါ")
     print("🔧 Admin commands များ အသုံးပြုနိုင်ပါပြီ")